@@ -0,0 +1,1192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; -*-
+
+# Benchmarks and regression checks for grab.py and map-gen.py. Run
+# `bench.py --help` for the list of benchmarks.
+
+import sys, os
+import time
+import copy
+import random
+import argparse
+import tempfile
+import importlib
+import resource
+import tracemalloc
+import multiprocessing
+import shutil
+import contextlib
+import json
+import io
+import asyncio
+import urllib.parse
+import platform
+import itertools
+import functools
+import concurrent.futures
+import threading
+import http.server
+import hashlib
+
+import lxml.etree as etree
+
+import grab
+import profiling
+mapgen = importlib.import_module("map-gen")
+tileserver = importlib.import_module("tile-server")
+mapdiff = importlib.import_module("map-diff")
+lootplan = importlib.import_module("loot-plan")
+
+Icon3ds = '<img src="https://gamefaqs.akamaized.net/faqs/95/73095-150.png" />'
+IconSwitch = '<img src="https://gamefaqs.akamaized.net/faqs/95/73095-151.png" />'
+
+# ========== Reference implementations =============================>
+
+# These are the implementations before the rewrite, kept to check that the new
+# ones produce the same output, and to compare the performance.
+
+def legacyDropTag(node):
+    def _preserve_tail_before_delete(node):
+        if node.tail: # preserve the tail
+            previous = node.getprevious()
+            if previous is not None:
+                # if there is a previous sibling it will get the tail
+                if previous.tail is None:
+                    previous.tail = node.tail
+                else:
+                    previous.tail = previous.tail + node.tail
+            else: # The parent get the tail as text
+                parent = node.getparent()
+                if parent.text is None:
+                    parent.text = node.tail
+                else:
+                    parent.text = parent.text + node.tail
+
+    Children = copy.copy(node.xpath("child::node()"))
+    Parent = node.getparent()
+    _preserve_tail_before_delete(node)
+    Parent.remove(node)
+    grab.appendAll(Parent, Children)
+
+def legacyDealWith3dsSwitch(html):
+    platformFromImgTag = grab.platformFromImgTag
+    for ImgTag in html.xpath('//img'):
+        if ImgTag.getparent() is None:
+            # Ghost tags...
+            continue
+
+        if ImgTag.getparent().tag == "platform" or ImgTag.getparent().tag == "platform-specific":
+            continue
+        Platform = platformFromImgTag(ImgTag)
+        if Platform is None:
+            continue
+
+        # Switch/3ds disclaimer in the first paragraph
+        if ImgTag.getparent().tag == "p":
+            Para = ImgTag.getparent()
+            if Para.getprevious() is not None and Para.getprevious().tag == "h2":
+                Para.getparent().remove(Para)
+
+        PlatformRoot = etree.Element("platform-specific")
+        PlatformNode = etree.SubElement(PlatformRoot, "platform", name=Platform)
+        ToDelete = []
+
+        Next = ImgTag.getnext()
+        PlatformNode.append(copy.copy(ImgTag))
+        ToDelete.append(ImgTag)
+        BrOccurred = False
+        while Next is not None:
+            if Next.tag == "br":
+                BrOccurred = True
+            else:
+                if Next.tag == "img":
+                    Platform = platformFromImgTag(Next)
+                    if Platform is not None:
+                        PlatformNode = etree.SubElement(PlatformRoot, "platform",
+                                                        name=Platform)
+                PlatformNode.append(copy.copy(Next))
+            ToDelete.append(Next)
+            Next = Next.getnext()
+
+        if BrOccurred:
+            ImgTag.addprevious(PlatformRoot)
+            for Node in ToDelete:
+                Node.getparent().remove(Node)
+        else:
+            PlatformRoot = etree.Element("platform-specific")
+            PlatformNode = etree.SubElement(PlatformRoot, "platform",
+                                            name=platformFromImgTag(ImgTag))
+            PlatformNode.append(copy.copy(ImgTag))
+            ImgTag.addprevious(PlatformRoot)
+            ImgTag.getparent().remove(ImgTag)
+
+    for ImgTag in html.xpath('//img'):
+        if ImgTag.getparent().tag == "platform" or ImgTag.getparent().tag == "platform-specific":
+            if platformFromImgTag(ImgTag) is not None:
+                legacyDropTag(ImgTag)
+
+# ========== Synthetic input =======================================>
+
+def iconPage(icon_count, icons_per_para=50):
+    """Return a page (as processed by htmlPreprocess) with `icon_count`
+    platform icons, in paragraphs of `icons_per_para` icons. Every other
+    paragraph has a <br> at the end.
+    """
+    Lines = ['<html><body><div id="faqwrap"><h2>Icons Map</h2>',
+             '<p>Versions: {} and {}</p>'.format(Icon3ds, IconSwitch)]
+    Para = 0
+    while icon_count > 0:
+        Count = min(icon_count, icons_per_para)
+        Lines.append("<p>")
+        for i in range(Count):
+            Lines.append("{} value {} ".format(
+                Icon3ds if i % 2 == 0 else IconSwitch, i))
+        if Para % 2 == 0:
+            Lines.append("<br /> after")
+        Lines.append("</p>")
+        icon_count -= Count
+        Para += 1
+    Lines.append("</div></body></html>")
+    return '\n'.join(Lines)
+
+DifficultyColors = ["000000", "008000", "ff9900", "800080", "ff6600", "0000ff",
+                    "ff0000"]
+
+def cellValue(rand, i):
+    """Return a random table cell in the styles used by the guide."""
+    Kind = rand.randrange(7)
+    if Kind == 0:
+        return "({} {} | {} {})".format(Icon3ds, 1000 + i, IconSwitch, 1500 + i)
+    elif Kind == 1:
+        return "{} Young Link {}|{} Old Link".format(Icon3ds, i, IconSwitch)
+    elif Kind == 2:
+        return "{} Keaton Mask Material".format(IconSwitch)
+    elif Kind == 3:
+        return "Item A {}<br>Item B<br>{} Item C<br>".format(i, IconSwitch)
+    elif Kind == 4:
+        return "N/A"
+    elif Kind == 5:
+        return "<p>Para &rsquo;value&rsquo; &nbsp; {} &ndash; x</p>".format(i)
+    else:
+        return "Plain value {} &raquo; y".format(i)
+
+def columnName(col):
+    """0 -> A, 25 -> Z, 26 -> AA..."""
+    Name = ""
+    col += 1
+    while col > 0:
+        col, Rem = divmod(col - 1, 26)
+        Name = chr(ord('A') + Rem) + Name
+    return Name
+
+def chapterPage(title, cols, rows, seed=0):
+    """Return a GameFAQs-style map chapter, with a difficulty grid of `cols` x
+    `rows` tiles, and a ffaq table for most of the tiles.
+    """
+    Rand = random.Random(seed)
+    Lines = ['<!DOCTYPE html>',
+             '<html lang="en"><head><meta charset="utf-8"><title>{}</title>'
+             '</head><body>'.format(title),
+             '<div id="faqwrap"><h2>{} Map</h2>'.format(title),
+             '<p>This guide covers the {} 3DS and {} Switch versions.</p>'
+             .format(Icon3ds, IconSwitch),
+             '<div class="ftoc"><ul><li><a href="#top">Top</a></li></ul></div>',
+             '<p>See <a href="adventure-map#a-1">here</a>.</p>',
+             '<p>Grid</p><table class="ffaq"><tbody>']
+    Lines.append("<tr>" + "".join("<td>{}</td>".format(columnName(Col))
+                                  for Col in range(cols)) + "</tr>")
+    for Row in range(1, rows + 1):
+        Lines.append("<tr>")
+        for Col in range(cols):
+            Lines.append('<td><span style="background-color: #{};">'
+                         '<a href="#{}-{}">{}-{}</a></span></td>'.format(
+                             Rand.choice(DifficultyColors),
+                             columnName(Col).lower(), Row, columnName(Col), Row))
+        Lines.append("</tr>")
+    Lines.append("</tbody></table>")
+    for Col in range(cols):
+        for Row in range(1, rows + 1):
+            if Rand.random() < 0.1:
+                continue
+            Lines.append('<h4>{} Map <b>{}-{}</b></h4>'.format(
+                title, columnName(Col), Row))
+            Lines.append('<table class="ffaq"><tbody>')
+            Lines.append('<tr><th>Mission</th><th>Battle Victory</th>'
+                         '<th>A-Rank Victory</th></tr>')
+            Lines.append('<tr><td>{}</td><td>{}</td><td>{}</td></tr>'.format(
+                cellValue(Rand, Col), cellValue(Rand, Row),
+                cellValue(Rand, Col + Row)))
+            Lines.append('<tr><th>Treasure</th><th>A-Rank KOs</th>'
+                         '<th>A-Rank Time</th><th>A-Rank Damage</th></tr>')
+            Lines.append('<tr><td>{}</td><td>{}</td><td>15 Minutes</td>'
+                         '<td>{}</td></tr>'.format(
+                             cellValue(Rand, 1), cellValue(Rand, 2),
+                             cellValue(Rand, 3)))
+            Lines.append('</tbody></table>')
+    Lines.append("</div></body></html>")
+    return '\n'.join(Lines)
+
+# Values marked with platform icons, as in the guide and in ways it could get
+# wrong. {ds} is the 3DS icon, {sw} the Switch one.
+MarkerValues = [
+    # Well-formed pairs, with and without parentheses.
+    "({ds} 1000 | {sw} 1500)",
+    "{ds} Young Link|{sw} Old Link",
+    "Before ( {ds} A |  {sw} B ) after",
+    # One platform only, or the Switch icon first.
+    "{sw} Keaton Mask Material",
+    "{ds} Only on 3DS",
+    "{sw} B | {ds} A",
+    # Nested in other tags, and pairs whose values span tags.
+    "<b>({ds} 10 | {sw} 20)</b>",
+    "<span><i>{ds} A|{sw} B</i> tail</span>",
+    "({ds} <b>A</b> | {sw} B)",
+    "({ds} A | {sw} <i>B</i>)",
+    "{ds} A|{sw} B <b>C</b>",
+    "<ul><li>{ds} A<br>{sw} B<br></li><li>({ds} 1 | {sw} 2)</li></ul>",
+    # Malformed: unbalanced parentheses and bars, unclosed and stray tags.
+    "({ds} A | {sw} B<br>C)",
+    "{ds} A | B |{sw} C)",
+    "{ds} A |",
+    "{ds}|{sw}",
+    "({ds} A | {sw} B) ({ds} C | {sw} D)",
+    "<b>{ds} A|{sw} B",
+    "{ds} A</i>|{sw} B",
+    "<p>{ds} A<br>{sw} B</p>",
+    "{ds}{ds} A<br>{sw}",
+    '<img alt="3DS" src="https://gamefaqs.akamaized.net/faqs/95/73095-150.png">'
+    ' A|<img width="16" '
+    'src="https://gamefaqs.akamaized.net/faqs/95/73095-151.png"> B',
+    "<!-- {ds} A --> x",
+]
+
+def markerPage(title, cells, seed=0):
+    """Return a chapter with a table of `cells` random MarkerValues, some of
+    them two to a cell.
+    """
+    Rand = random.Random(seed)
+    def value():
+        return Rand.choice(MarkerValues).format(ds=Icon3ds, sw=IconSwitch)
+
+    Lines = ['<!DOCTYPE html>',
+             '<html lang="en"><head><meta charset="utf-8"><title>{}</title>'
+             '</head><body>'.format(title),
+             '<div id="faqwrap"><h2>{} Map</h2>'.format(title),
+             '<p>This guide covers the {} 3DS and {} Switch versions.</p>'
+             .format(Icon3ds, IconSwitch),
+             '<table class="ffaq"><tbody>']
+    for i in range(cells):
+        Value = value()
+        if Rand.random() < 0.3:
+            Value += "<br>" + value()
+        Lines.append("<tr><td>{}</td><td>{}</td></tr>".format(i, Value))
+    Lines.append("</tbody></table>")
+    Lines.append("<p>{}</p>".format(value()))
+    Lines.append("</div></body></html>")
+    return '\n'.join(Lines)
+
+def syntheticPages(count=64):
+    """Return a list of (chapter, page) to check the passes against the
+    reference implementations without the raw archive: a few map chapters,
+    and `count` chapters of MarkerValues. Most of the latter go through the
+    string passes in parseHtml(), and the rest through the tree ones.
+    """
+    Pages = [("synthetic-{}-map".format(Seed),
+              chapterPage("Synthetic {}".format(Seed), 8, 8, Seed))
+             for Seed in range(4)]
+    Pages += [("markers-{}-map".format(Seed),
+               markerPage("Markers {}".format(Seed), 1 + Seed % 16, Seed))
+              for Seed in range(count)]
+    return Pages
+
+def xmlValue(rand, i):
+    """Return the content of a tile field in maps.xml, in one of the forms
+    grab.py writes.
+    """
+    Kind = rand.randrange(5)
+    if Kind == 0:
+        return ''
+    elif Kind == 1:
+        return 'Value {}'.format(i)
+    elif Kind == 2:
+        return ('<platform-specific><platform name="3ds"> {} </platform>'
+                '<platform name="switch"> {}</platform></platform-specific>'
+                .format(1000 + i, 1500 + i))
+    elif Kind == 3:
+        return ('<platform-specific><platform name="switch"> Keaton Mask '
+                'Material</platform></platform-specific>')
+    else:
+        return '<item>Item A {}</item><item>Item B</item>'.format(i)
+
+def mapsXml(tiles, seed=0, cols=26, rows=8):
+    """Return a maps.xml with `tiles` tiles, in maps of at most `cols` x
+    `rows` tiles.
+    """
+    Rand = random.Random(seed)
+    Rows = rows
+    MapSize = cols * Rows
+    Lines = ["<?xml version='1.0' encoding='utf-8'?>", "<maps>"]
+    for MapIndex in range((tiles + MapSize - 1) // MapSize):
+        Count = min(MapSize, tiles - MapIndex * MapSize)
+        Lines.append('<map name="Synthetic {}"><tiles>'.format(MapIndex))
+        for i in range(Count):
+            Lines.append('<tile coordinate="{}{}">'.format(
+                columnName(i // Rows), i % Rows + 1))
+            Lines.append('<mission>Mission {}</mission>'.format(i))
+            for Field in ("loot-a", "loot-v", "treasure"):
+                Lines.append('<{0}>{1}</{0}>'.format(Field, xmlValue(Rand, i)))
+            Lines.append('<ko-a>{}</ko-a>'.format(Rand.choice(("", 1200 + i))))
+            Lines.append('<time-a>15 Minutes</time-a>')
+            Lines.append('<damage-a>{}</damage-a>'.format(Rand.randrange(10000)))
+            Lines.append('<difficulty>{}</difficulty>'.format(Rand.randrange(7)))
+            Lines.append('</tile>')
+        Lines.append('</tiles></map>')
+    Lines.append("</maps>")
+    return '\n'.join(Lines)
+
+def changedMapsXml(xml_file, out_file, changes, seed=0):
+    """Write a copy of `xml_file` with the missions of `changes` random
+    tiles changed, and the last tile of a map removed.
+    """
+    Rand = random.Random(seed)
+    Tree = etree.parse(xml_file)
+    Tiles = Tree.xpath("//tile")
+    for Tile in Rand.sample(Tiles, changes):
+        Tile.find("mission").text += " (updated)"
+    Tiles[-1].getparent().remove(Tiles[-1])
+    Tree.write(out_file, encoding="utf-8", xml_declaration=True)
+    return changes + 1
+
+def passesBefore3dsSwitch(chapter, html_raw):
+    """Return the tree of `html_raw` after the passes before
+    dealWith3dsSwitch.
+    """
+    HtmlRaw = grab.dealWith3dsSwitchPre(grab.htmlPreprocess(html_raw))
+    Html = etree.XML(HtmlRaw).xpath('//div[@id = "faqwrap"]')[0]
+    grab.removeToc(Html)
+    grab.dealWithTempTags(Html)
+    grab.dealWithLinks(Html, chapter)
+    return Html
+
+def archivedPages():
+    """Return a list of (chapter, page) in the raw archive after the passes
+    before dealWith3dsSwitch. Empty if there is no archive.
+    """
+    if not os.path.exists(grab.ArchiveFileName):
+        return []
+    Archive = grab.RawArchive(grab.ArchiveFileName)
+    Result = []
+    for Chapter in grab.Chapters:
+        if Chapter not in Archive:
+            continue
+        Result.append((Chapter, passesBefore3dsSwitch(
+            Chapter, Archive.text(Chapter).replace("\r", ""))))
+    Archive.close()
+    return Result
+
+def timeIt(func, *args):
+    Start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - Start
+
+def measure(func, *args):
+    """Return the time and the peak of Python allocations (in bytes) of
+    calling `func`. Memory allocated by libxml2 is not counted. Tracing slows
+    down allocations, so the time is measured in a separate call.
+    """
+    Time = timeIt(func, *args)
+    tracemalloc.start()
+    func(*args)
+    Peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return Time, Peak
+
+def maxRss():
+    """Peak RSS of this process in bytes. On Linux ru_maxrss survives exec()
+    and includes the parent's peak, so VmHWM is preferred.
+    """
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for Line in f:
+                if Line.startswith("VmHWM:"):
+                    return int(Line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def loadInChild(func, *args):
+    """Run `func` in a fresh interpreter, and return its time and the growth
+    of the peak RSS while it runs. The result of `func` is kept alive until
+    the end of the measurement.
+    """
+    Context = multiprocessing.get_context("spawn")
+    with Context.Pool(1) as Pool:
+        return Pool.apply(childMeasure, (func,) + args)
+
+def childMeasure(func, *args):
+    Before = maxRss()
+    Start = time.perf_counter()
+    Result = func(*args)
+    Time = time.perf_counter() - Start
+    del Result
+    return Time, maxRss() - Before
+
+def loadXml(xml_file):
+    return list(mapgen.iterMaps(xml_file))
+
+def loadSnapshot(xml_file, snapshot_file):
+    return list(mapgen.loadMaps(xml_file, snapshot_file))
+
+def measureOnCopy(func, node, *args):
+    """Like measure(), for a `func` that changes the tree `node`. Each call
+    gets its own copy of it, made outside of the measurement.
+    """
+    Time = timeIt(func, copy.deepcopy(node), *args)
+    Copy = copy.deepcopy(node)
+    tracemalloc.start()
+    func(Copy, *args)
+    Peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return Time, Peak
+
+class LineList(list):
+    """The lines of map-gen's page kept in memory, as genHtml() did before
+    the streaming writer.
+    """
+    def appendXml(self, node):
+        self.append(etree.tostring(node, encoding="utf-8", pretty_print=True,
+                                   xml_declaration=False).decode("utf-8"))
+
+def legacyWriteHtml(filename):
+    Lines = LineList()
+    mapgen.renderPage(Lines)
+    with open(filename, 'wb') as f:
+        f.write('\n'.join(Lines).encode("utf-8"))
+
+def streamWriteHtml(filename):
+    with open(filename, 'wb') as f:
+        mapgen.writeHtml(f)
+
+@contextlib.contextmanager
+def mapGenDir(tiles, cols=26, rows=8):
+    """A temporary directory with map-gen's assets and a synthetic maps.xml
+    with `tiles` tiles in maps of `cols` x `rows`, as the working directory.
+    """
+    Cwd = os.getcwd()
+    Here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as Dir:
+        for Asset in ("style.css", "github.svg", "logic.js"):
+            shutil.copy(os.path.join(Here, Asset), Dir)
+        with open(os.path.join(Dir, "maps.xml"), 'w') as f:
+            f.write(mapsXml(tiles, cols=cols, rows=rows))
+        os.chdir(Dir)
+        try:
+            yield Dir
+        finally:
+            os.chdir(Cwd)
+
+# ========== Benchmarks ============================================>
+
+def benchPlatform(args):
+    """Check that dealWith3dsSwitch gives the same output as the reference
+    implementation on the archived and synthetic chapters, and time both on
+    synthetic pages.
+    """
+    Archived = archivedPages()
+    Synthetic = [(Chapter, passesBefore3dsSwitch(Chapter, HtmlRaw))
+                 for Chapter, HtmlRaw in syntheticPages()]
+    for Chapter, Html in Archived + Synthetic:
+        Old = copy.deepcopy(Html)
+        legacyDealWith3dsSwitch(Old)
+        grab.dealWith3dsSwitch(Html)
+        if etree.tostring(Old) != etree.tostring(Html):
+            print("MISMATCH: {}".format(Chapter))
+            return 1
+    print("Output identical on {} archived and {} synthetic chapters.".format(
+        len(Archived), len(Synthetic)))
+
+    print("{:>8} {:>12} {:>12}".format("Icons", "New (s)", "Legacy (s)"))
+    Sizes = [args.size // 8 * 2 ** i for i in range(4)]
+    for Size in Sizes:
+        Raw = iconPage(Size, args.per_para)
+        New = timeIt(grab.dealWith3dsSwitch, etree.XML(Raw))
+        if Size <= args.legacy_max:
+            Legacy = "{:12.4f}".format(
+                timeIt(legacyDealWith3dsSwitch, etree.XML(Raw)))
+        else:
+            Legacy = "{:>12}".format("-")
+        print("{:8d} {:12.4f} {}".format(Size, New, Legacy))
+    return 0
+
+def legacyParseHtml(html_raw):
+    return etree.XML(grab.dealWith3dsSwitchPre(grab.htmlPreprocess(html_raw)))
+
+def benchPreprocess(args):
+    """Check that parseHtml() builds the same tree as the string passes on
+    the archived and synthetic chapters, and compare time and peak memory of
+    both on synthetic chapters.
+    """
+    Archive = None
+    if os.path.exists(grab.ArchiveFileName):
+        Archive = grab.RawArchive(grab.ArchiveFileName)
+    Archived = [(Chapter, Archive.text(Chapter).replace("\r", ""))
+                for Chapter in grab.Chapters
+                if Archive is not None and Chapter in Archive]
+    Synthetic = syntheticPages()
+    for Chapter, HtmlRaw in Archived + Synthetic:
+        if etree.tostring(legacyParseHtml(HtmlRaw)) != \
+           etree.tostring(grab.parseHtml(HtmlRaw)):
+            print("MISMATCH: {}".format(Chapter))
+            return 1
+    print("Output identical on {} archived and {} synthetic chapters.".format(
+        len(Archived), len(Synthetic)))
+
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "Tiles", "Size (KB)", "Old (s)", "New (s)", "Old (MB)", "New (MB)"))
+    Rows = 8
+    for i in range(4):
+        Cols = max(1, args.size // Rows // 8 * 2 ** i)
+        HtmlRaw = chapterPage("Synthetic", Cols, Rows)
+        OldTime, OldPeak = measure(legacyParseHtml, HtmlRaw)
+        NewTime, NewPeak = measure(grab.parseHtml, HtmlRaw)
+        print("{:8d} {:10.0f} {:10.4f} {:10.4f} {:10.2f} {:10.2f}".format(
+            Cols * Rows, len(HtmlRaw) / 1024, OldTime, NewTime,
+            OldPeak / 2 ** 20, NewPeak / 2 ** 20))
+    return 0
+
+def benchLoad(args):
+    """Compare loading the maps from maps.xml and from the snapshot, on
+    synthetic maps.xml files.
+    """
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "Tiles", "XML (KB)", "Snap (KB)", "XML (s)", "Snap (s)", "XML (MB)",
+        "Snap (MB)"))
+    with tempfile.TemporaryDirectory() as Dir:
+        XmlFile = os.path.join(Dir, "maps.xml")
+        SnapshotFile = os.path.join(Dir, "maps.snapshot")
+        for i in range(4):
+            Tiles = args.size // 8 * 2 ** i
+            with open(XmlFile, 'w') as f:
+                f.write(mapsXml(Tiles))
+            # Writes the snapshot.
+            loadSnapshot(XmlFile, SnapshotFile)
+            XmlTime, XmlRss = loadInChild(loadXml, XmlFile)
+            SnapTime, SnapRss = loadInChild(loadSnapshot, XmlFile, SnapshotFile)
+            print("{:8d} {:10.0f} {:10.0f} {:10.4f} {:10.4f} {:10.2f} {:10.2f}"
+                  .format(Tiles, os.path.getsize(XmlFile) / 1024,
+                          os.path.getsize(SnapshotFile) / 1024, XmlTime,
+                          SnapTime, XmlRss / 2 ** 20, SnapRss / 2 ** 20))
+    return 0
+
+def benchHtml(args):
+    """Compare writing the page with the streaming writer and with joining
+    all the lines in memory, on synthetic maps.xml files.
+    """
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "Tiles", "Size (KB)", "Old (s)", "New (s)", "Old (MB)", "New (MB)"))
+    for i in range(4):
+        Tiles = args.size // 8 * 2 ** i
+        with mapGenDir(Tiles):
+            # Parse maps.xml and write the snapshot, so that both runs load
+            # the same way.
+            streamWriteHtml("new.html")
+            OldTime, OldPeak = measure(legacyWriteHtml, "old.html")
+            NewTime, NewPeak = measure(streamWriteHtml, "new.html")
+            with open("old.html", 'rb') as Old, open("new.html", 'rb') as New:
+                if Old.read() != New.read():
+                    print("MISMATCH at {} tiles".format(Tiles))
+                    return 1
+            print("{:8d} {:10.0f} {:10.4f} {:10.4f} {:10.2f} {:10.2f}".format(
+                Tiles, os.path.getsize("new.html") / 1024, OldTime, NewTime,
+                OldPeak / 2 ** 20, NewPeak / 2 ** 20))
+    return 0
+
+def benchLayout(args):
+    """Time the SVG of single square maps of growing size, with multi-letter
+    columns and multi-digit rows. The time per tile should stay flat.
+    """
+    print("{:>8} {:>8} {:>10} {:>12} {:>12}".format(
+        "Tiles", "Size", "Parse (s)", "SVG (us)", "Compact (us)"))
+    with tempfile.TemporaryDirectory() as Dir:
+        XmlFile = os.path.join(Dir, "maps.xml")
+        for i in range(4):
+            Side = int((args.size // 16 * 4 ** i) ** 0.5)
+            Tiles = Side * Side
+            with open(XmlFile, 'w') as f:
+                f.write(mapsXml(Tiles, cols=Side, rows=Side))
+            Maps = []
+            ParseTime = timeIt(lambda: Maps.extend(mapgen.iterMaps(XmlFile)))
+            Map = Maps[0]
+            LastCoord = "{}{}".format(columnName(Side - 1), Side)
+            Last = Map.Tiles[LastCoord]
+            if (Map.Cols, Map.Rows) != (Side, Side) or \
+               (Last.Col, Last.Row) != (Side, Side):
+                print("WRONG LAYOUT at {} tiles".format(Tiles))
+                return 1
+            SvgTime = timeIt(Map.genSvg)
+            CompactTime = timeIt(Map.genSvg, True)
+            print("{:8d} {:>8} {:10.4f} {:12.2f} {:12.2f}".format(
+                Tiles, LastCoord, ParseTime, SvgTime / Tiles * 1e6,
+                CompactTime / Tiles * 1e6))
+    return 0
+
+def parallelWriteHtml(filename, jobs, compact):
+    """Write the page with the maps rendered in `jobs` processes, including
+    the start-up of the pool.
+    """
+    with open(filename, 'wb') as f, \
+         concurrent.futures.ProcessPoolExecutor(jobs) as Pool:
+        mapgen.writeHtml(f, compact=compact, render_maps=functools.partial(
+            mapgen.renderMaps, pool=Pool))
+
+def benchParallel(args):
+    """Compare rendering the maps serially and in process pools, on
+    synthetic maps.xml files with 32 x 32 maps. The outputs have to be the
+    same.
+    """
+    Jobs = sorted({2, 4, os.cpu_count() or 1} - {1})
+    print("CPUs: {}".format(os.cpu_count()))
+    print("{:>8} {:>8} {:>10}".format("Tiles", "Compact", "Serial (s)") +
+          "".join(" {:>10}".format("{} jobs (s)".format(Job)) for Job in Jobs))
+    for i in range(3):
+        Tiles = args.size // 4 * 2 ** i
+        with mapGenDir(Tiles, 32, 32):
+            # Write the snapshot first, so that all runs load the same way.
+            streamWriteHtml("serial.html")
+            for Compact in (False, True):
+                with open("serial.html", 'wb') as f:
+                    SerialTime = timeIt(mapgen.writeHtml, f, None, Compact)
+                with open("serial.html", 'rb') as f:
+                    Serial = f.read()
+                Times = []
+                for Job in Jobs:
+                    Times.append(timeIt(parallelWriteHtml, "parallel.html",
+                                        Job, Compact))
+                    with open("parallel.html", 'rb') as f:
+                        if f.read() != Serial:
+                            print("MISMATCH at {} tiles with {} jobs".format(
+                                Tiles, Job))
+                            return 1
+                print("{:8d} {:>8} {:10.4f}".format(Tiles, str(Compact),
+                                                    SerialTime) +
+                      "".join(" {:10.4f}".format(Time) for Time in Times))
+    return 0
+
+def grabMaps(names, stream):
+    """Parse chapters `names` from the raw archive in the working directory
+    and write maps.xml, streaming or, without `stream`, keeping all the
+    fragments and the whole tree in memory as grab.py did before.
+    """
+    Archive = grab.RawArchive(grab.ArchiveFileName)
+    with contextlib.redirect_stdout(io.StringIO()):
+        FileNames, _ = grab.chapterFragments(names, Archive, rebuild=True)
+    Archive.close()
+    if stream:
+        grab.writeMapsXml("maps.xml", FileNames)
+        return
+    Root = etree.Element("maps")
+    for FileName in FileNames:
+        with open(FileName, 'rb') as f:
+            Data = f.read()
+        if Data:
+            Root.append(etree.fromstring(Data))
+    with open("maps.xml", 'wb') as f:
+        f.write(etree.tostring(Root, xml_declaration=True, encoding="utf-8",
+                               pretty_print=True))
+
+def benchGrabMemory(args):
+    """Compare the peak RSS of parsing guides of more and more chapters of
+    400 tiles and writing maps.xml, streaming and in memory. The streaming
+    peak should stay flat.
+    """
+    # With profiling disabled, no pass may keep the tree of a chapter alive
+    # while the next one is parsed.
+    grab.Profile.Enabled = False
+    grab.dealWithChapter("synthetic-map",
+                         chapterPage("Synthetic", 50, 8))
+    if profiling.NullSection.tree is not None:
+        print("The tree of a chapter is kept alive with profiling disabled")
+        return 1
+
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "Chapters", "Size (KB)", "Old (s)", "New (s)", "Old (MB)", "New (MB)"))
+    Cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as Dir:
+        os.chdir(Dir)
+        try:
+            os.makedirs(grab.CacheDir)
+            Archive = grab.RawArchive(grab.ArchiveFileName)
+            Names = []
+            for i in range(4):
+                Count = args.size // 4000 * 2 ** i
+                while len(Names) < Count:
+                    Name = "synthetic-{}-map".format(len(Names))
+                    Page = chapterPage("Synthetic {}".format(len(Names)), 50, 8,
+                                       len(Names))
+                    Archive.put(Name, Page.encode("utf-8"), "utf-8")
+                    Names.append(Name)
+                Archive.save()
+                Archive.close()
+                Archive = grab.RawArchive(grab.ArchiveFileName)
+                OldTime, OldRss = loadInChild(grabMaps, Names, False)
+                with open("maps.xml", 'rb') as f:
+                    Old = f.read()
+                NewTime, NewRss = loadInChild(grabMaps, Names, True)
+                with open("maps.xml", 'rb') as f:
+                    if f.read() != Old:
+                        print("MISMATCH at {} chapters".format(Count))
+                        return 1
+                print("{:8d} {:10.0f} {:10.4f} {:10.4f} {:10.2f} {:10.2f}".format(
+                    Count, len(Old) / 1024, OldTime, NewTime, OldRss / 2 ** 20,
+                    NewRss / 2 ** 20))
+            Archive.close()
+        finally:
+            os.chdir(Cwd)
+    return 0
+
+class StubSite(object):
+    """A local HTTP server serving the chapter `pages` ({name: str}) with
+    ETags, in place of the guide. Each request for a chapter first takes the
+    next (status, headers) in Script[name], if any, and is answered with an
+    empty body of that status. Every request is logged as (name, status).
+    """
+    def __init__(self, pages):
+        self.Pages = pages
+        self.Script = {}
+        self.Log = []
+        self.Lock = threading.Lock()
+        Site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                Name = self.path.lstrip("/")
+                Headers = {}
+                with Site.Lock:
+                    Script = Site.Script.get(Name)
+                    if Script:
+                        Status, Headers = Script.pop(0)
+                        Body = b""
+                    elif Name in Site.Pages:
+                        Body = Site.Pages[Name].encode("utf-8")
+                        Headers = {"ETag": '"{}"'.format(
+                            hashlib.sha1(Body).hexdigest()[:16])}
+                        Status = 200
+                        if self.headers.get("If-None-Match") == \
+                           Headers["ETag"]:
+                            Status, Body = 304, b""
+                    else:
+                        Status, Body = 404, b""
+                    Site.Log.append((Name, Status))
+                self.send_response(Status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(Body)))
+                for Key, Value in Headers.items():
+                    self.send_header(Key, Value)
+                self.end_headers()
+                self.wfile.write(Body)
+
+        self.Server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                      Handler)
+        self.Url = "http://127.0.0.1:{}/".format(self.Server.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.Server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.Server.shutdown()
+        self.Server.server_close()
+        return False
+
+    def statuses(self, name):
+        return [Status for Name, Status in self.Log if Name == name]
+
+def grabXml(pages, filename):
+    """Write the maps.xml of the chapter `pages` ([(name, page)]) put
+    straight into a raw archive, as if they were downloaded.
+    """
+    Archive = grab.RawArchive(filename + ".archive")
+    for Name, Page in pages:
+        Archive.put(Name, Page.encode("utf-8"), "utf-8")
+    Archive.save()
+    with contextlib.redirect_stdout(io.StringIO()):
+        FileNames, _ = grab.chapterFragments([Name for Name, _ in pages],
+                                             Archive, rebuild=True)
+    Archive.close()
+    grab.writeMapsXml(filename, FileNames)
+
+def benchFetch(args):
+    """Check grab.py's downloads against a local stub of the guide: retries
+    with backoff on 5xx, Retry-After on 429, giving up after the retries,
+    and revalidation with 304s. The maps.xml written from the downloads has
+    to be the same as from the pages themselves.
+    """
+    Retries = 3
+    Names = ["fixture-{}-map".format(i) for i in range(6)]
+    Pages = {Name: chapterPage("Fixture {}".format(i), 8, 8, i)
+             for i, Name in enumerate(Names)}
+    Cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as Dir, StubSite(Pages) as Site:
+        os.chdir(Dir)
+        try:
+            os.makedirs(grab.CacheDir)
+            Archive = grab.RawArchive(grab.ArchiveFileName)
+
+            def fetch():
+                Start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    Failed = grab.fetchChapters(
+                        Names, Archive, Site.Url, concurrency=4, rate=1000,
+                        burst=1000, retries=Retries, backoff=0.01)
+                Archive.save()
+                return Failed, time.perf_counter() - Start
+
+            # A cold run: one 429 asking for 1 s, two 503s, and a chapter
+            # that fails more often than it is retried.
+            Site.Script = {Names[0]: [(429, {"Retry-After": "1"})],
+                           Names[1]: [(503, {}), (503, {})],
+                           Names[2]: [(500, {})] * (Retries + 1)}
+            Failed, ColdTime = fetch()
+            Expected = {Names[0]: [429, 200], Names[1]: [503, 503, 200],
+                        Names[2]: [500] * (Retries + 1)}
+            Checks = [("failed chapters", Failed, [Names[2]]),
+                      ("archived chapters", sorted(Archive.Index),
+                       sorted(set(Names) - {Names[2]})),
+                      ("waited for Retry-After", ColdTime >= 1, True)]
+            Checks += [("statuses of " + Name, Site.statuses(Name),
+                        Expected.get(Name, [200])) for Name in Names]
+
+            # Revalidation after a chapter changed.
+            Site.Log = []
+            Pages[Names[3]] = chapterPage("Fixture 3 updated", 8, 8, 99)
+            Failed, WarmTime = fetch()
+            Checks.append(("failed chapters on revalidation", Failed, []))
+            Checks += [("statuses of {} on revalidation".format(Name),
+                        Site.statuses(Name),
+                        [200] if Name in Names[2:4] else [304])
+                       for Name in Names]
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                FileNames, _ = grab.chapterFragments(Names, Archive)
+            Archive.close()
+            grab.writeMapsXml("maps.xml", FileNames)
+            grabXml([(Name, Pages[Name]) for Name in Names], "expected.xml")
+            with open("maps.xml", 'rb') as New, \
+                 open("expected.xml", 'rb') as Old:
+                Checks.append(("maps.xml", New.read() == Old.read(), True))
+        finally:
+            os.chdir(Cwd)
+
+    for What, Value, Wanted in Checks:
+        if Value != Wanted:
+            print("MISMATCH: {}: {} instead of {}".format(What, Value, Wanted))
+            return 1
+    print("{} checks passed. Cold run: {:.2f} s, revalidation: {:.2f} s"
+          .format(len(Checks), ColdTime, WarmTime))
+    return 0
+
+async def httpClient(port, target, count):
+    """Send `count` GETs of `target` on one keep-alive connection."""
+    Reader, Writer = await asyncio.open_connection("127.0.0.1", port)
+    Request = "GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(
+        urllib.parse.quote(target, safe="/?=&")).encode("latin-1")
+    for _ in range(count):
+        Writer.write(Request)
+        Length = 0
+        while True:
+            Line = await Reader.readline()
+            if Line == b"\r\n":
+                break
+            if Line.lower().startswith(b"content-length:"):
+                Length = int(Line.split(b":")[1])
+        await Reader.readexactly(Length)
+    Writer.close()
+
+async def serverThroughput(server, target, clients, count):
+    Server = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    Port = Server.sockets[0].getsockname()[1]
+    Start = time.perf_counter()
+    await asyncio.gather(*(httpClient(Port, target, count)
+                           for _ in range(clients)))
+    Time = time.perf_counter() - Start
+    Server.close()
+    await Server.wait_closed()
+    return clients * count / Time
+
+def benchServer(args):
+    """Requests per second of tile-server.py, with the client in the same
+    process, on a synthetic maps.xml with --size / 4 tiles. Both the server
+    and the clients share one core.
+    """
+    Targets = ["/maps", "/maps/Synthetic 0/B3", "/maps/Synthetic 1",
+               "/tiles?difficulty=3&map=Synthetic 2", "/tiles?loot=Item B"]
+    with mapGenDir(args.size // 4):
+        print("{:<40} {:>12} {:>12}".format("Target", "Cached (/s)",
+                                            "Uncached (/s)"))
+        for Target in Targets:
+            Rates = []
+            for CacheSize in (1024, 0):
+                Server = tileserver.TileServer("maps.xml", CacheSize)
+                Server.load()
+                Rates.append(asyncio.run(serverThroughput(Server, Target, 8,
+                                                          250)))
+            print("{:<40} {:12.0f} {:12.0f}".format(Target, *Rates))
+    return 0
+
+def patchWriteHtml(page_file, patch, filename):
+    Page = mapgen.PreviousPage(page_file, patch)
+    with open(filename, 'wb') as f:
+        mapgen.writeHtml(f, render_maps=Page.renderMaps)
+
+def benchDiff(args):
+    """Time map-diff.py between synthetic maps.xml files that differ in
+    about one tile in a thousand, and compare writing the page from scratch
+    with updating the previous page with the patch. Both pages have to be
+    the same. The snapshot is up to date for both.
+    """
+    print("{:>8} {:>10} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        "Tiles", "XML (KB)", "Changed", "Diff (s)", "Patch (KB)", "Full (s)",
+        "Patched (s)"))
+    for Tiles in args.tiles:
+        with mapGenDir(Tiles):
+            shutil.copy("maps.xml", "old.xml")
+            streamWriteHtml("old.html")
+            Changed = changedMapsXml("old.xml", "maps.xml",
+                                     max(1, Tiles // 1000), args.seed)
+            DiffTime = timeIt(mapdiff.diffMaps, "old.xml", "maps.xml")
+            Patch = mapdiff.diffMaps("old.xml", "maps.xml")
+            mapdiff.writePatch(Patch, "maps.patch.json")
+            # Writes the snapshot of the new maps.xml.
+            streamWriteHtml("full.html")
+            FullTime = timeIt(streamWriteHtml, "full.html")
+            PatchTime = timeIt(patchWriteHtml, "old.html", Patch,
+                               "patched.html")
+            with open("full.html", 'rb') as Full, \
+                 open("patched.html", 'rb') as Patched:
+                if Full.read() != Patched.read():
+                    print("MISMATCH at {} tiles".format(Tiles))
+                    return 1
+            print("{:8d} {:10.0f} {:8d} {:10.4f} {:10.1f} {:10.4f} {:10.4f}"
+                  .format(Tiles, os.path.getsize("old.xml") / 1024, Changed,
+                          DiffTime, os.path.getsize("maps.patch.json") / 1024,
+                          FullTime, PatchTime), flush=True)
+    return 0
+
+def assetSizes():
+    """Return the size of the page with fingerprinted assets, and {path:
+    size} of the files under its asset directory.
+    """
+    Page, Files = mapgen.genHtml("assets", fingerprint=True)
+    return len(Page.encode("utf-8")), \
+        {Path: len(Data.encode("utf-8")) for Path, Data in Files.items()}
+
+def benchAssets(args):
+    """Compare what a browser with the previous version in its cache
+    downloads again after a change of style.css or of a few tiles: the
+    whole page when everything is inline, and the shell and the files with
+    new names with fingerprinted assets.
+    """
+    print("{:>8} {:>12} {:>10} {:>12} {:>14} {:>14}".format(
+        "Tiles", "Inline (KB)", "Shell (KB)", "Assets (KB)",
+        "New CSS (KB)", "New tiles (KB)"))
+    for Tiles in args.tiles:
+        with mapGenDir(Tiles):
+            Inline = len(mapgen.genHtml()[0].encode("utf-8"))
+            Shell, Files = assetSizes()
+            Total = sum(Files.values())
+            Downloads = []
+            with open("style.css", 'a') as f:
+                f.write("\nh1 { letter-spacing: 0.01em; }\n")
+            shutil.copy("maps.xml", "old.xml")
+            for Change in ("style", "tiles"):
+                if Change == "tiles":
+                    changedMapsXml("old.xml", "maps.xml",
+                                   max(1, Tiles // 1000), args.seed)
+                NewShell, NewFiles = assetSizes()
+                Downloads.append(NewShell + sum(
+                    Size for Path, Size in NewFiles.items() if Path not in Files))
+                Files = NewFiles
+            print("{:8d} {:12.1f} {:10.1f} {:12.1f} {:14.1f} {:14.1f}".format(
+                Tiles, Inline / 1024, Shell / 1024, Total / 1024,
+                Downloads[0] / 1024, Downloads[1] / 1024), flush=True)
+    return 0
+
+def benchPlan(args):
+    """Time loot-plan.py on synthetic maps: building the index, and planning
+    20 random sets of items of each size, greedily and exactly. Shows the
+    worst time of each, how many exact plans were proven optimal, and the
+    average number of tiles of both plans.
+    """
+    print("{:>8} {:>10} {:>6} {:>12} {:>12} {:>7} {:>8} {:>8}".format(
+        "Tiles", "Index (s)", "Items", "Greedy (ms)", "Exact (ms)", "Proven",
+        "Greedy", "Exact"))
+    Rand = random.Random(args.seed)
+    for Tiles in args.tiles:
+        with mapGenDir(Tiles):
+            Maps = list(mapgen.loadMaps())
+        IndexTime = timeIt(lootplan.LootIndex, Maps)
+        Index = lootplan.LootIndex(Maps)
+        Keys = sorted(Key for Key, (_, TileSet) in Index.Items.items()
+                      if TileSet.bit_count() > 1)
+        for Count in (5, 15, 30):
+            Times = [0.0, 0.0]
+            Sizes = [0, 0]
+            Proven = 0
+            for _ in range(20):
+                Items = Rand.sample(Keys, min(Count, len(Keys)))
+                for i, Exact in enumerate((False, True)):
+                    Start = time.perf_counter()
+                    Plan, _ = lootplan.planLoot(Index, Items, exact=Exact)
+                    Times[i] = max(Times[i], time.perf_counter() - Start)
+                    Sizes[i] += len(Plan.Tiles)
+                Proven += Plan.Proven
+            print("{:8d} {:10.4f} {:6d} {:12.1f} {:12.1f} {:7d} {:8.1f} {:8.1f}"
+                  .format(Tiles, IndexTime, Count, Times[0] * 1000,
+                          Times[1] * 1000, Proven, Sizes[0] / 20,
+                          Sizes[1] / 20), flush=True)
+    return 0
+
+def suiteGrab(tiles, seed):
+    """Yield (stage, input size in bytes, time, peak) for the stages of
+    grab.py on a synthetic chapter with `tiles` tiles, and for
+    dealWith3dsSwitch on a page with `tiles` platform icons.
+    """
+    HtmlRaw = chapterPage("Synthetic", max(1, tiles // 8), 8, seed)
+    Size = len(HtmlRaw.encode("utf-8"))
+    yield ("grab.parseHtml", Size) + measure(grab.parseHtml, HtmlRaw)
+
+    Html = grab.parseHtml(HtmlRaw).xpath('//div[@id = "faqwrap"]')[0]
+    Passes = [("grab.removeToc", grab.removeToc, ()),
+              ("grab.dealWithTempTags", grab.dealWithTempTags, ()),
+              ("grab.dealWithLinks", grab.dealWithLinks, ("synthetic-map",)),
+              ("grab.dealWith3dsSwitch", grab.dealWith3dsSwitch, ())]
+    for Name, Pass, Args in Passes:
+        yield (Name, Size) + measureOnCopy(Pass, Html, *Args)
+        Pass(Html, *Args)
+
+    def extractAll(html):
+        for Table in html.xpath('//table[@class = "ffaq"]'):
+            grab.extractMapInfo(Table)
+
+    yield ("grab.extractMapInfo", Size) + measureOnCopy(extractAll, Html)
+    yield ("grab.dealWithMapTables", Size) + \
+        measureOnCopy(grab.dealWithMapTables, Html)
+    yield ("grab.dealWithMapTileTables", Size) + \
+        measureOnCopy(grab.dealWithMapTileTables, Html)
+    yield ("grab.dealWithChapter", Size) + \
+        measure(grab.dealWithChapter, "synthetic-map", HtmlRaw)
+
+    Icons = iconPage(tiles, 200)
+    yield ("grab.dealWith3dsSwitch/icons", len(Icons.encode("utf-8"))) + \
+        measureOnCopy(grab.dealWith3dsSwitch, etree.XML(Icons))
+
+def suiteMapGen(tiles):
+    """Yield (stage, input size in bytes, time, peak) for the stages of
+    map-gen.py on a synthetic maps.xml with `tiles` tiles.
+    """
+    with mapGenDir(tiles):
+        Size = os.path.getsize("maps.xml")
+        yield ("map-gen.iterMaps", Size) + \
+            measure(lambda: list(mapgen.iterMaps("maps.xml")))
+
+        TileNodes = etree.parse("maps.xml").xpath("//tile")
+        yield ("map-gen.TileInfo.fromNode", Size) + measure(
+            lambda: [mapgen.TileInfo.fromNode(Node) for Node in TileNodes])
+        del TileNodes
+
+        # Writes the snapshot.
+        Maps = list(mapgen.loadMaps())
+        yield ("map-gen.loadMaps/snapshot", os.path.getsize(
+            mapgen.snapshotFileName("maps.xml"))) + measure(lambda: list(mapgen.loadMaps()))
+        yield ("map-gen.genSvg", Size) + \
+            measure(lambda: [Map.genSvg() for Map in Maps])
+        yield ("map-gen.genSvg/compact", Size) + \
+            measure(lambda: [Map.genSvg(compact=True) for Map in Maps])
+        del Maps
+        yield ("map-gen.writeHtml", Size) + measure(streamWriteHtml, "maps.html")
+
+def benchSuite(args):
+    """Time and memory-profile every stage of both scripts on synthetic
+    input, and optionally save the results as JSON or compare them with a
+    saved run.
+    """
+    Baseline = {}
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            for Result in json.load(f)["results"]:
+                Baseline[(Result["stage"], Result["tiles"])] = Result
+
+    Results = []
+    Header = "{:<32} {:>7} {:>10} {:>10} {:>10}".format(
+        "Stage", "Tiles", "Input (KB)", "Time (s)", "Peak (MB)")
+    if Baseline:
+        Header += " {:>8} {:>8}".format("Time x", "Peak x")
+    print(Header)
+    for Tiles in args.tiles:
+        for Stage, Size, Time, Peak in itertools.chain(
+                suiteGrab(Tiles, args.seed), suiteMapGen(Tiles)):
+            Results.append({"stage": Stage, "tiles": Tiles, "input_bytes": Size,
+                            "seconds": Time, "peak_bytes": Peak})
+            Line = "{:<32} {:7d} {:10.0f} {:10.4f} {:10.2f}".format(
+                Stage, Tiles, Size / 1024, Time, Peak / 2 ** 20)
+            Old = Baseline.get((Stage, Tiles))
+            if Old is not None:
+                Line += " {:8.2f} {:8.2f}".format(
+                    Time / max(Old["seconds"], 1e-9),
+                    Peak / max(Old["peak_bytes"], 1))
+            print(Line, flush=True)
+
+    if args.json:
+        Report = {"python": platform.python_version(),
+                  "lxml": ".".join(map(str, etree.LXML_VERSION)),
+                  "libxml2": ".".join(map(str, etree.LIBXML_VERSION)),
+                  "machine": platform.machine(),
+                  "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                  "seed": args.seed,
+                  "results": Results}
+        with open(args.json, 'w') as f:
+            json.dump(Report, f, indent=2)
+    return 0
+
+def tileCounts(text):
+    return [int(Count) for Count in text.split(",")]
+
+Benchmarks = {"platform": benchPlatform, "preprocess": benchPreprocess,
+              "load": benchLoad, "html": benchHtml, "layout": benchLayout,
+              "parallel": benchParallel,
+              "grab-memory": benchGrabMemory, "fetch": benchFetch,
+              "server": benchServer, "diff": benchDiff,
+              "assets": benchAssets, "plan": benchPlan,
+              "suite": benchSuite}
+
+def main():
+    Parser = argparse.ArgumentParser(description="Benchmarks for the map tools.")
+    Parser.add_argument("benchmark", choices=sorted(Benchmarks))
+    Parser.add_argument("--size", type=int, default=16000,
+                        help="Largest input size. Default: %(default)s")
+    Parser.add_argument("--per-para", type=int, default=200,
+                        help="Number of icons per paragraph. Default: %(default)s")
+    Parser.add_argument("--legacy-max", type=int, default=4000,
+                        help="Largest size to run the reference "
+                        "implementations on. Default: %(default)s")
+    Parser.add_argument("--tiles", type=tileCounts,
+                        default=[100, 1000, 10000, 100000],
+                        help="Comma-separated tile counts for the suite and "
+                        "the diff, assets and plan benchmarks. "
+                        "Default: 100,1000,10000,100000")
+    Parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the synthetic input. Default: %(default)s")
+    Parser.add_argument("--json", metavar="FILE",
+                        help="Save the results of the suite to FILE.")
+    Parser.add_argument("--compare", metavar="FILE",
+                        help="Compare the suite with the results in FILE.")
+    Args = Parser.parse_args()
+    return Benchmarks[Args.benchmark](Args)
+
+if __name__ == "__main__":
+    sys.exit(main())
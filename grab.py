@@ -5,15 +5,31 @@ import sys, os
 import re
 import urllib.parse
 import time
-import copy
 import typing
+import argparse
+import threading
+import concurrent.futures
+import json
+import mmap
+import struct
+import zlib
+import hashlib
+import email.utils
 
 import requests
+import requests.adapters
 import lxml.html
 import lxml.etree as etree
 
+import profiling
+
 CacheDir = "cache"
+ArchiveFileName = os.path.join(CacheDir, "raw.archive")
+FragmentDir = os.path.join(CacheDir, "fragments")
 UrlRoot = "https://gamefaqs.gamespot.com/switch/230454-hyrule-warriors-definitive-edition/faqs/73095/"
+UserAgent = "my-grab/0.0.1"
+
+Profile = profiling.Profiler()
 
 Chapters = [
     "introduction",
@@ -81,7 +97,9 @@ def dropTag(node):
                 else:
                     parent.text = parent.text + node.tail
 
-    Children = copy.copy(node.xpath("child::node()"))
+    Children = list(node)
+    if node.text:
+        Children.insert(0, node.text)
     Parent = node.getparent()
     _preserve_tail_before_delete(node)
     Parent.remove(node)
@@ -113,13 +131,18 @@ def dealWithLinks(html, current_chapter):
         elif "target-section" in Link:
             del Link.attrib["target-section"]
 
+PlatformIcons = {"https://gamefaqs.akamaized.net/faqs/95/73095-150.png": "3ds",
+                 "https://gamefaqs.akamaized.net/faqs/95/73095-151.png": "switch"}
+PlatformIconXPath = etree.XPath(
+    "//img[{}]".format(" or ".join('@src = "{}"'.format(Src)
+                                   for Src in PlatformIcons)))
+
 def platformFromImgTag(img_tag):
-    if img_tag.get("src") == "https://gamefaqs.akamaized.net/faqs/95/73095-150.png":
-        return "3ds"
-    elif img_tag.get("src") == "https://gamefaqs.akamaized.net/faqs/95/73095-151.png":
-        return "switch"
-    else:
-        return None
+    return PlatformIcons.get(img_tag.get("src"))
+
+HtmlEntities = [("&rsquo;", '’'), ("&squo;", '‘'), ("&nbsp;", ' '),
+                ("&ndash;", '-'), ("&raquo;", '»')]
+VoidTags = ("img", "br", "meta", "link", "input")
 
 def htmlPreprocess(html_raw):
     Node = etree.HTML(html_raw)
@@ -131,12 +154,10 @@ def htmlPreprocess(html_raw):
 
     NewLine = Result.find('\n')
     Result = "<html>" + Result[NewLine:]
-    Result = re.sub(r'<((img|br|meta|link|input)[^>]*[^/])>', r"<\1 />", Result)
-    Result = Result.replace("&rsquo;", '’')
-    Result = Result.replace("&squo;", '‘')
-    Result = Result.replace("&nbsp;", ' ')
-    Result = Result.replace("&ndash;", '-')
-    Result = Result.replace("&raquo;", '»')
+    Result = re.sub(r'<(({})[^>]*[^/])>'.format('|'.join(VoidTags)), r"<\1 />",
+                    Result)
+    for Entity, Char in HtmlEntities:
+        Result = Result.replace(Entity, Char)
 
     return Result
 
@@ -150,6 +171,160 @@ def dealWith3dsSwitchPre(html_raw):
                     Result)
     return Result
 
+def platformDiv(text_3ds, text_switch):
+    """Return the temporary tags that dealWith3dsSwitchPre() makes for a
+    3DS|Switch value.
+    """
+    Div = etree.Element("div", grab_tag="platform-specific")
+    etree.SubElement(Div, "div", grab_tag="platform", grab_name="3ds").text = \
+        text_3ds or None
+    etree.SubElement(Div, "div", grab_tag="platform", grab_name="switch").text = \
+        text_switch or None
+    return Div
+
+Icon3dsXPath = etree.XPath('//img[@src = "{}"]'.format(
+    next(Src for Src in PlatformIcons if PlatformIcons[Src] == "3ds")))
+# Names that htmlPreprocess() and dealWith3dsSwitchPre() would treat in ways
+# parseHtml() does not reproduce: namespaced names, and tags like <brand> that
+# the void tag regex would match.
+OddAttributesXPath = etree.XPath(
+    '/*/descendant::*/@*[contains(name(), ":") or starts-with(name(), "xmlns")]')
+OddTagRe = re.compile(r'<[a-z][^\s/>]*:|<(?:{})[^\s/>]'.format('|'.join(VoidTags)),
+                      re.IGNORECASE)
+
+def indentTree(root):
+    """Add the whitespace that etree.tostring() adds with `pretty_print`.
+    libxml2 only indents the children of an element that has no text, and
+    nothing below an element with text. It stops indenting deeper after 30
+    levels.
+    """
+    Stack = [(root, 0)]
+    while Stack:
+        Node, Level = Stack.pop()
+        if len(Node) == 0 or Node.text is not None or \
+           any(Child.tail is not None for Child in Node):
+            continue
+        Indent = "\n" + "  " * min(Level + 1, 30)
+        Node.text = Indent
+        for Child in Node:
+            Child.tail = Indent
+            if isinstance(Child.tag, str):
+                Stack.append((Child, Level + 1))
+        Node[-1].tail = "\n" + "  " * min(Level, 30)
+
+def replaceIconPairs(icons):
+    """Do what the regexes in dealWith3dsSwitchPre() do, to the 3DS icons
+    `icons`, which have the same parent: first replace
+    "(<3DS icon>A|<Switch icon>B)", and then "<3DS icon>A|<Switch icon>B" up to
+    the next tag. Return False if a pattern would span tags, which is only
+    handled by the regexes.
+    """
+    def precedingText(child):
+        Previous = child.getprevious()
+        if Previous is None:
+            return child.getparent().text or ""
+        return Previous.tail or ""
+
+    def setPrecedingText(child, text):
+        Previous = child.getprevious()
+        if Previous is None:
+            child.getparent().text = text or None
+        else:
+            Previous.tail = text or None
+
+    def matchPair(icon):
+        """If `icon` is followed by "A|" and a Switch icon, return (A, the
+        Switch icon).
+        """
+        Tail = icon.tail
+        if Tail is None:
+            return None
+        Bar = Tail.find("|")
+        if Bar < 1 or Tail[Bar + 1:].strip(" ") != "":
+            return None
+        Switch = icon.getnext()
+        if Switch is None or Switch.tag != "img" or \
+           platformFromImgTag(Switch) != "switch":
+            return None
+        return Tail[:Bar], Switch
+
+    for WithParens in (True, False):
+        Skip = None
+        for Icon in icons:
+            if Icon is Skip or Icon.getparent() is None:
+                continue
+            Match = matchPair(Icon)
+            if Match is None:
+                continue
+
+            Text3ds, Switch = Match
+            Tail = Switch.tail or ""
+            if WithParens:
+                Before = precedingText(Icon).rstrip(" ")
+                if not Before.endswith("("):
+                    continue
+                if ")" not in Tail:
+                    return False
+                setPrecedingText(Icon, Before[:-1])
+                TextSwitch, Tail = Tail.split(")", 1)
+            else:
+                TextSwitch, Tail = Tail, None
+
+            Div = platformDiv(Text3ds, TextSwitch)
+            Div.tail = Tail or None
+            Icon.addprevious(Div)
+            Parent = Icon.getparent()
+            Parent.remove(Icon)
+            if not WithParens:
+                # The second regex consumes the "<" of the next tag, so that
+                # tag cannot start another match.
+                Skip = Switch.getnext()
+            Parent.remove(Switch)
+    return True
+
+def parseHtml(html_raw):
+    """Parse a downloaded page into the tree that the passes work on. This is
+    the same as etree.XML(dealWith3dsSwitchPre(htmlPreprocess(html_raw))), but
+    it works on the parsed tree directly instead of serializing it and running
+    regexes over the string. Pages with something odd in them still go through
+    the string passes.
+    """
+    Root = etree.HTML(html_raw)
+    if Root is None or len(Root) == 0 or OddTagRe.search(html_raw) or \
+       OddAttributesXPath(Root):
+        return etree.XML(dealWith3dsSwitchPre(htmlPreprocess(html_raw)))
+
+    # htmlPreprocess() replaces the first line with a plain <html>.
+    Root.attrib.clear()
+    if Root.text is not None or any(Node.tail is not None for Node in Root):
+        # The root is not pretty-printed, so the first line runs to the first
+        # newline in the root's text.
+        if Root.text is None or "\n" not in Root.text:
+            return etree.XML(dealWith3dsSwitchPre(htmlPreprocess(html_raw)))
+        Root.text = Root.text[Root.text.index("\n"):]
+    else:
+        indentTree(Root)
+
+    for Comment in Root.iter(etree.Comment):
+        if Comment.text is None:
+            continue
+        if "<" in Comment.text:
+            # The regexes would see markup in the comment.
+            return etree.XML(dealWith3dsSwitchPre(htmlPreprocess(html_raw)))
+        for Entity, Char in HtmlEntities:
+            Comment.text = Comment.text.replace(Entity, Char)
+
+    Groups = []
+    for ImgTag in Icon3dsXPath(Root):
+        if len(Groups) > 0 and Groups[-1][0].getparent() == ImgTag.getparent():
+            Groups[-1].append(ImgTag)
+        else:
+            Groups.append([ImgTag])
+    for Icons in Groups:
+        if not replaceIconPairs(Icons):
+            return etree.XML(dealWith3dsSwitchPre(htmlPreprocess(html_raw)))
+    return Root
+
 def dealWithTempTags(html):
     for Node in html.xpath("//div[@grab_tag]"):
         for Attr in Node.keys():
@@ -161,60 +336,99 @@ def dealWithTempTags(html):
                 Node.attrib.pop(Attr)
 
 def dealWith3dsSwitch(html):
-    for ImgTag in html.xpath('//img'):
-        if ImgTag.getparent() is None:
-            # Ghost tags...
-            continue
+    """Wrap the values marked with platform icons in <platform-specific>. An
+    icon that is followed by a <br> somewhere in its parent starts a
+    <platform-specific>, and all its following siblings are moved into it,
+    each platform icon starting a new <platform>. The <br>s are removed. An
+    icon without a <br> after it only wraps its tail. The icons themselves
+    are removed.
 
-        if ImgTag.getparent().tag == "platform" or ImgTag.getparent().tag == "platform-specific":
-            continue
-        Platform = platformFromImgTag(ImgTag)
-        if Platform is None:
-            continue
+    Each parent of icons is visited once, in document order, and nodes are
+    moved instead of copied, so this is linear in the size of the document.
+    """
+    Root = html.getroottree().getroot()
+    NewRoots = set()
+
+    def isLive(node, moved_ok=False):
+        """Whether `node` is still in the document. Unless `moved_ok`, nodes
+        moved into a <platform-specific> created here are not live either.
+        """
+        Top = node
+        for Ancestor in node.iterancestors():
+            if not moved_ok and Ancestor in NewRoots:
+                return False
+            Top = Ancestor
+        return Top == Root
+
+    def newPlatform(platform_root, img_tag):
+        # The icon is dropped, and its tail becomes the platform text.
+        PlatformNode = etree.SubElement(platform_root, "platform",
+                                        name=platformFromImgTag(img_tag))
+        PlatformNode.text = img_tag.tail
+        img_tag.getparent().remove(img_tag)
+        return PlatformNode
+
+    def splitChildren(parent):
+        BrAhead = None
+        Child = parent[0] if len(parent) > 0 else None
+        while Child is not None:
+            Next = Child.getnext()
+            if Child.tag != "img" or platformFromImgTag(Child) is None:
+                Child = Next
+                continue
+
+            # Switch/3ds disclaimer in the first paragraph
+            if parent.tag == "p":
+                Previous = parent.getprevious()
+                if Previous is not None and Previous.tag == "h2":
+                    parent.getparent().remove(parent)
+                    return
+
+            # Nothing is moved if there is no <br> after this icon, so the
+            # answer holds for the rest of the siblings.
+            if BrAhead is None:
+                BrAhead = any(Node.tag == "br" for Node in Child.itersiblings())
 
-        # Switch/3ds disclaimer in the first paragraph
-        if ImgTag.getparent().tag == "p":
-            Para = ImgTag.getparent()
-            if Para.getprevious() is not None and Para.getprevious().tag == "h2":
-                Para.getparent().remove(Para)
-
-        PlatformRoot = etree.Element("platform-specific")
-        PlatformNode = etree.SubElement(PlatformRoot, "platform", name=Platform)
-        ToDelete = []
-
-        Next = ImgTag.getnext()
-        PlatformNode.append(copy.copy(ImgTag))
-        ToDelete.append(ImgTag)
-        BrOccurred = False
-        while Next is not None:
-            if Next.tag == "br":
-                BrOccurred = True
-            else:
-                if Next.tag == "img":
-                    Platform = platformFromImgTag(Next)
-                    if Platform is not None:
-                        PlatformNode = etree.SubElement(PlatformRoot, "platform",
-                                                        name=Platform)
-                PlatformNode.append(copy.copy(Next))
-            ToDelete.append(Next)
-            Next = Next.getnext()
-
-        if BrOccurred:
-            ImgTag.addprevious(PlatformRoot)
-            for Node in ToDelete:
-                Node.getparent().remove(Node)
-        else:
             PlatformRoot = etree.Element("platform-specific")
-            PlatformNode = etree.SubElement(PlatformRoot, "platform",
-                                            name=platformFromImgTag(ImgTag))
-            PlatformNode.append(copy.copy(ImgTag))
-            ImgTag.addprevious(PlatformRoot)
-            ImgTag.getparent().remove(ImgTag)
+            NewRoots.add(PlatformRoot)
+            Child.addprevious(PlatformRoot)
+            PlatformNode = newPlatform(PlatformRoot, Child)
+            if not BrAhead:
+                Child = Next
+                continue
+
+            while Next is not None:
+                Node = Next
+                Next = Node.getnext()
+                if Node.tag == "br":
+                    parent.remove(Node)
+                elif Node.tag == "img" and platformFromImgTag(Node) is not None:
+                    PlatformNode = newPlatform(PlatformRoot, Node)
+                else:
+                    PlatformNode.append(Node)
+            return
 
-    for ImgTag in html.xpath('//img'):
-        if ImgTag.getparent().tag == "platform" or ImgTag.getparent().tag == "platform-specific":
-            if platformFromImgTag(ImgTag) is not None:
-                dropTag(ImgTag)
+    Parents = []
+    ParentSet = set()
+    for ImgTag in PlatformIconXPath(html):
+        Parent = ImgTag.getparent()
+        if Parent not in ParentSet:
+            ParentSet.add(Parent)
+            Parents.append(Parent)
+
+    PlatformParents = []
+    for Parent in Parents:
+        if Parent.tag == "platform" or Parent.tag == "platform-specific":
+            PlatformParents.append(Parent)
+        elif isLive(Parent):
+            splitChildren(Parent)
+
+    # Icons already inside a platform value are just dropped.
+    for Parent in PlatformParents:
+        if isLive(Parent, moved_ok=True):
+            for ImgTag in list(Parent):
+                if ImgTag.tag == "img" and platformFromImgTag(ImgTag) is not None:
+                    dropTag(ImgTag)
 
 def extractMapInfo(table_tag):
     def hasBr(element):
@@ -251,7 +465,7 @@ def extractMapInfo(table_tag):
                     # Is this value a <br> seperated list?
                     if hasBr(Cols[i]):
                         # It's a <br> seperated list.
-                        ContentRaw = copy.copy(Content)
+                        ContentRaw = Content
                         Content = []
                         for Entry in ContentRaw:
                             if isinstance(Entry, str):
@@ -348,7 +562,11 @@ def dealWithMapTileTables(html):
             Name = LinkNode[0].text.strip()
         else:
             Name = LinkNode.text.strip()
-        Name = Name[0] + Name[2]
+        Match = re.match(r"([A-Z]+)-([0-9]+)", Name)
+        if Match is None:
+            print("Warning: bad tile name {}...".format(Name))
+            continue
+        Name = Match.group(1) + Match.group(2)
         if Color not in Colors:
             raise KeyError("Unknown color: " + Color)
 
@@ -356,40 +574,270 @@ def dealWithMapTileTables(html):
 
     return TileDifficulty
 
-MapInfoRoot = etree.Element("maps")
+class TokenBucket(object):
+    """A thread-safe token bucket. Each request takes one token. Tokens are
+    refilled at `rate` per second, and at most `capacity` of them can be saved
+    up.
+    """
+    def __init__(self, rate, capacity=1):
+        self.Rate = rate
+        self.Capacity = capacity
+        self.Tokens = capacity
+        self.LastTime = time.monotonic()
+        self.Lock = threading.Lock()
 
-def dealWithChapter(name):
-    global MapInfoRoot
+    def acquire(self):
+        while True:
+            with self.Lock:
+                Now = time.monotonic()
+                self.Tokens = min(self.Capacity,
+                                  self.Tokens + (Now - self.LastTime) * self.Rate)
+                self.LastTime = Now
+                if self.Tokens >= 1:
+                    self.Tokens -= 1
+                    return
+                Wait = (1 - self.Tokens) / self.Rate
+            time.sleep(Wait)
 
-    CacheFileName = os.path.join(CacheDir, name + ".xml")
-    if os.path.exists(CacheFileName):
-        with open(CacheFileName, 'r') as f:
-            Content = f.read()
+def makeSession(concurrency):
+    """Return a session with a keep-alive connection pool big enough for
+    `concurrency` threads.
+    """
+    Session = requests.Session()
+    Adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=concurrency)
+    Session.mount("http://", Adapter)
+    Session.mount("https://", Adapter)
+    Session.headers["user-agent"] = UserAgent
+    return Session
 
-        Content = dealWith3dsSwitchPre(Content)
-        Html = etree.XML(Content)
-    else:
-        Headers = {'user-agent': 'my-grab/0.0.1'}
-        print("Downloading {}...".format(name))
-        Res = requests.get(UrlRoot + name, headers=Headers)
-        HtmlRaw = Res.text.replace("\r", "")
-        HtmlRaw = htmlPreprocess(HtmlRaw)
-        HtmlRaw = dealWith3dsSwitchPre(HtmlRaw)
-
-        Html = etree.XML(HtmlRaw)
-        # Html = lxml.html.document_fromstring(HtmlRaw)
-        Html = Html.xpath('//div[@id = "faqwrap"]')[0]
-        time.sleep(2)
-
-    removeToc(Html)
-    dealWithTempTags(Html)
-    dealWithLinks(Html, name)
-    dealWith3dsSwitch(Html)
-    if name.endswith("-map"):
-        MapNode = etree.SubElement(MapInfoRoot, "map")
+MaxRetryAfter = 120
+
+def retryAfter(response):
+    """Return the delay in seconds asked for by the Retry-After header of
+    `response`, at most MaxRetryAfter, or None.
+    """
+    Value = response.headers.get("Retry-After", "").strip()
+    if Value.isdigit():
+        return min(int(Value), MaxRetryAfter)
+    try:
+        When = email.utils.parsedate_to_datetime(Value)
+    except (TypeError, ValueError):
+        return None
+    return min(max(0, When.timestamp() - time.time()), MaxRetryAfter)
+
+def fetchChapter(session, bucket, url, retries=3, backoff=1.0, headers=None):
+    """Download `url`, waiting for `bucket` before every attempt. Connection
+    errors, 429s and 5xx responses are retried with exponential backoff, or
+    after the delay in their Retry-After header if it is longer.
+    """
+    Attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            Res = session.get(url, timeout=30, headers=headers)
+            if Res.status_code == 429 or Res.status_code >= 500:
+                raise requests.HTTPError("HTTP {}".format(Res.status_code),
+                                         response=Res)
+            Res.raise_for_status()
+        except (requests.ConnectionError, requests.Timeout,
+                requests.HTTPError) as e:
+            Retriable = (e.response is None or e.response.status_code == 429 or
+                         e.response.status_code >= 500)
+            if not Retriable or Attempt >= retries:
+                raise
+            Delay = backoff * 2 ** Attempt
+            if e.response is not None:
+                Delay = max(Delay, retryAfter(e.response) or 0)
+            print("Retrying {} ({})...".format(url, e))
+            time.sleep(Delay)
+            Attempt += 1
+        else:
+            return Res
+
+class RawArchive(object):
+    """A compressed archive of the raw HTTP bodies of the chapters, with their
+    ETag and Last-Modified headers.
+
+    The file starts with `Magic`, followed by the length of a JSON index, the
+    index itself, and the zlib-compressed bodies. The index maps chapter names
+    to the offsets and lengths of the bodies (relative to the end of the
+    index) and the response headers. The file is memory-mapped for reading.
+    """
+    Magic = b"HWRAW1\n"
+    Header = struct.Struct(">I")
+
+    def __init__(self, filename):
+        self.FileName = filename
+        self.Index = dict()
+        self.Pending = dict()
+        self.File = None
+        self.Map = None
+        self.DataStart = 0
+        if os.path.exists(filename):
+            self.open()
+
+    def open(self):
+        self.File = open(self.FileName, 'rb')
+        self.Map = mmap.mmap(self.File.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.Map[:len(self.Magic)] != self.Magic:
+            raise ValueError("Not a raw archive: " + self.FileName)
+        Start = len(self.Magic)
+        IndexLen, = self.Header.unpack_from(self.Map, Start)
+        Start += self.Header.size
+        self.Index = json.loads(self.Map[Start:Start + IndexLen].decode("utf-8"))
+        self.DataStart = Start + IndexLen
+
+    def close(self):
+        if self.Map is not None:
+            self.Map.close()
+            self.File.close()
+        self.Map = None
+        self.File = None
+
+    def __contains__(self, name):
+        return name in self.Index
+
+    def meta(self, name):
+        """Return the stored headers of chapter `name`."""
+        return self.Index[name]
+
+    def compressed(self, name):
+        if name in self.Pending:
+            return self.Pending[name]
+        Entry = self.Index[name]
+        Start = self.DataStart + Entry["offset"]
+        return self.Map[Start:Start + Entry["length"]]
+
+    def body(self, name):
+        """Return the raw body of chapter `name` in bytes."""
+        return zlib.decompress(self.compressed(name))
+
+    def text(self, name):
+        """Return the body of chapter `name` decoded into a string."""
+        return self.body(name).decode(self.Index[name]["encoding"], "replace")
+
+    def digest(self, name):
+        """Return the SHA-256 of the raw body of chapter `name`."""
+        Entry = self.Index[name]
+        if "sha256" not in Entry:
+            Entry["sha256"] = hashlib.sha256(self.body(name)).hexdigest()
+        return Entry["sha256"]
+
+    def put(self, name, body, encoding, etag=None, last_modified=None):
+        self.Pending[name] = zlib.compress(body, 9)
+        self.Index[name] = {"offset": None, "length": len(self.Pending[name]),
+                            "encoding": encoding, "etag": etag,
+                            "last-modified": last_modified,
+                            "sha256": hashlib.sha256(body).hexdigest()}
+
+    def conditionalHeaders(self, name):
+        """Return the headers to revalidate chapter `name`."""
+        Headers = dict()
+        if name not in self.Index:
+            return Headers
+        if self.Index[name]["etag"]:
+            Headers["If-None-Match"] = self.Index[name]["etag"]
+        if self.Index[name]["last-modified"]:
+            Headers["If-Modified-Since"] = self.Index[name]["last-modified"]
+        return Headers
+
+    def save(self):
+        """Write the archive if anything was put into it. The file is replaced
+        atomically.
+        """
+        if not self.Pending:
+            return
+
+        Blobs = []
+        Index = dict()
+        Offset = 0
+        for Name in sorted(self.Index):
+            Blob = self.compressed(Name)
+            Index[Name] = dict(self.Index[Name], offset=Offset, length=len(Blob))
+            Blobs.append(Blob)
+            Offset += len(Blob)
+        IndexRaw = json.dumps(Index, sort_keys=True).encode("utf-8")
+
+        Dir = os.path.dirname(self.FileName)
+        if Dir and not os.path.exists(Dir):
+            os.makedirs(Dir)
+        TempName = self.FileName + ".tmp"
+        with open(TempName, 'wb') as f:
+            f.write(self.Magic)
+            f.write(self.Header.pack(len(IndexRaw)))
+            f.write(IndexRaw)
+            for Blob in Blobs:
+                f.write(Blob)
+        self.close()
+        os.replace(TempName, self.FileName)
+        self.Pending = dict()
+        self.open()
+
+def fetchChapters(names, archive, url_root=UrlRoot, concurrency=4, rate=0.5,
+                  burst=1, retries=3, backoff=1.0):
+    """Download chapters `names` concurrently into `archive`. Chapters that
+    are already in the archive are revalidated with conditional requests.
+    Return the names of the chapters that could not be downloaded; the
+    others are put into `archive` anyway.
+    """
+    if len(names) == 0:
+        return []
+
+    Bucket = TokenBucket(rate, burst)
+    with makeSession(concurrency) as Session, \
+         concurrent.futures.ThreadPoolExecutor(concurrency) as Pool:
+        def fetch(name):
+            print("Downloading {}...".format(name))
+            with Profile.section("fetch", name, memory=False):
+                return fetchChapter(Session, Bucket, url_root + name, retries,
+                                    backoff, archive.conditionalHeaders(name))
+
+        Futures = {Name: Pool.submit(fetch, Name) for Name in names}
+        Failed = []
+        for Name in names:
+            try:
+                Res = Futures[Name].result()
+            except requests.RequestException as e:
+                print("Failed to download {}: {}".format(Name, e))
+                Failed.append(Name)
+                continue
+            if Res.status_code == 304:
+                print("{} is not modified.".format(Name))
+                continue
+            archive.put(Name, Res.content,
+                        Res.encoding or Res.apparent_encoding,
+                        Res.headers.get("ETag"),
+                        Res.headers.get("Last-Modified"))
+    return Failed
+
+def dealWithChapter(name, html_raw):
+    """Parse chapter `name`. `html_raw` is the page as it was downloaded.
+    Return the <map> element of the chapter, or None if the chapter is not a
+    map.
+    """
+    with Profile.section("parseHtml", name) as Sec:
+        Html = parseHtml(html_raw.replace("\r", ""))
+        Sec.tree = Html
+    Html = Html.xpath('//div[@id = "faqwrap"]')[0]
+    with Profile.section("removeToc", name, Html):
+        removeToc(Html)
+    with Profile.section("dealWithTempTags", name, Html):
+        dealWithTempTags(Html)
+    with Profile.section("dealWithLinks", name, Html):
+        dealWithLinks(Html, name)
+    with Profile.section("dealWith3dsSwitch", name, Html):
+        dealWith3dsSwitch(Html)
+    if not name.endswith("-map"):
+        return None
+
+    MapNode = etree.Element("map")
+    with Profile.section("dealWithMapTables", name):
         Map = dealWithMapTables(Html)
-        MapNode.set("name", Map["title"])
+    MapNode.set("name", Map["title"])
+    with Profile.section("dealWithMapTileTables", name):
         Difficulty = dealWithMapTileTables(Html)
+    with Profile.section("buildMapNode", name, MapNode):
         TilesNode = etree.SubElement(MapNode, "tiles")
         for Tile in Map["info"]:
             TileNode = etree.SubElement(TilesNode, "tile")
@@ -398,28 +846,193 @@ def dealWithChapter(name):
 
             for Prop in Tile["info"]:
                 PropNode = etree.SubElement(TileNode, Prop)
-                # Deep copy here. Because stuff in `Tile["info"][Prop]` actually
-                # point to the original HTML elements/text in the HTML node
-                # tree.
-                PropValue = copy.deepcopy(Tile["info"][Prop])
-                appendAll(PropNode, PropValue)
+                # The elements in `Tile["info"][Prop]` are moved out of the
+                # HTML tree, which is dropped after this chapter, instead of
+                # being copied. Each of them is in only one property.
+                appendAll(PropNode, Tile["info"][Prop])
                 if PropNode.text == "None" or PropNode.text == "N/A":
                     PropNode.text = None
                 if len(PropNode) == 1 and PropNode[0].tag == 'p':
                     dropTag(PropNode[0])
             if (Difficulty is not None) and (Coord in Difficulty):
-                    etree.SubElement(TileNode, "difficulty").text = str(Difficulty[Coord])
+                etree.SubElement(TileNode, "difficulty").text = str(Difficulty[Coord])
+    return MapNode
+
+def parseChapter(name, html_raw):
+    """Parse chapter `name`, and return its serialized <map> element, or an
+    empty bytes if it is not a map. This runs in the worker processes in the
+    parallel mode.
+    """
+    MapNode = dealWithChapter(name, html_raw)
+    if MapNode is None:
+        return b""
+    with Profile.section("serialize", name):
+        return etree.tostring(MapNode, encoding="utf-8")
+
+def profileChapter(name, html_raw):
+    """parseChapter() for a worker process of a profiled run. Returns the
+    result and the records of the chapter, for the parent to merge.
+    """
+    Profile.enable()
+    Profile.Records = []
+    return parseChapter(name, html_raw), Profile.Records
+
+_PipelineVersion = None
+
+def pipelineVersion():
+    """Return a hash of the source code of this file and the lxml version.
+    Cached fragments made by another version of the pipeline are never
+    used. The whole file is hashed, so that the tables and patterns the
+    passes use are covered too, at the cost of parsing everything again
+    after any change.
+    """
+    global _PipelineVersion
+    if _PipelineVersion is None:
+        Hash = hashlib.sha256(str(etree.LXML_VERSION + etree.LIBXML_VERSION)
+                              .encode("utf-8"))
+        with open(__file__, 'rb') as f:
+            Hash.update(f.read())
+        _PipelineVersion = Hash.hexdigest()
+    return _PipelineVersion
+
+def fragmentKey(name, archive):
+    Key = "\n".join((name, archive.digest(name), pipelineVersion()))
+    return hashlib.sha256(Key.encode("utf-8")).hexdigest()
+
+def writeFragment(filename, fragment):
+    """Write a fragment to the cache. It is replaced atomically, so that an
+    interrupted write does not leave a truncated fragment under its key.
+    """
+    if not os.path.exists(FragmentDir):
+        os.makedirs(FragmentDir)
+    Temp = filename + ".tmp"
+    with open(Temp, 'wb') as f:
+        f.write(fragment)
+    os.replace(Temp, filename)
+
+def chapterFragments(names, archive, rebuild=False, jobs=1):
+    """Return the cache files of the serialized <map> elements of chapters
+    `names` in order, and their cache keys. A fragment is taken from the
+    cache if the raw page and the pipeline are unchanged. The other
+    chapters are parsed, in `jobs` processes if `jobs` > 1, and each result
+    is written to the cache as soon as it is ready, so that only one
+    chapter is in memory at a time.
+    """
+    Keys = [fragmentKey(Name, archive) for Name in names]
+    FileNames = [os.path.join(FragmentDir, Key + ".xml") for Key in Keys]
+    Dirty = [i for i in range(len(names))
+             if rebuild or not os.path.exists(FileNames[i])]
+
+    if jobs > 1 and len(Dirty) > 1:
+        with concurrent.futures.ProcessPoolExecutor(min(jobs, len(Dirty))) as Pool:
+            Futures = {}
+            for i in Dirty:
+                print("Parsing {}...".format(names[i]))
+                Futures[i] = Pool.submit(
+                    profileChapter if Profile.Enabled else parseChapter,
+                    names[i], archive.text(names[i]))
+            for i in Dirty:
+                Fragment = Futures.pop(i).result()
+                if Profile.Enabled:
+                    Fragment, Records = Fragment
+                    Profile.Records.extend(Records)
+                writeFragment(FileNames[i], Fragment)
+    else:
+        for i in Dirty:
+            print("Parsing {}...".format(names[i]))
+            writeFragment(FileNames[i],
+                          parseChapter(names[i], archive.text(names[i])))
+    return FileNames, Keys
+
+MapsXmlHead = b"<?xml version='1.0' encoding='utf-8'?>\n<maps>\n"
+MapsXmlTail = b"</maps>\n"
+
+def writeMapsXml(filename, fragment_files):
+    """Write maps.xml from the fragments in `fragment_files`. The file is
+    streamed, one <map> at a time, and replaced atomically. Each <map> is
+    pretty-printed in a <maps> of its own, which indents it as in the whole
+    tree, and spliced in.
+    """
+    Temp = filename + ".tmp"
+    with open(Temp, 'wb') as f:
+        f.write(MapsXmlHead)
+        for FileName in fragment_files:
+            with open(FileName, 'rb') as Fragment:
+                Data = Fragment.read()
+            if not Data:
+                continue
+            Root = etree.Element("maps")
+            Root.append(etree.fromstring(Data))
+            Text = etree.tostring(Root, encoding="utf-8", pretty_print=True)
+            f.write(Text[len(b"<maps>\n"):-len(MapsXmlTail)])
+        f.write(MapsXmlTail)
+    os.replace(Temp, filename)
+
+def pruneFragments(keys):
+    """Remove the cached fragments that are not in `keys`."""
+    for FileName in os.listdir(FragmentDir):
+        if os.path.splitext(FileName)[0] not in keys:
+            os.remove(os.path.join(FragmentDir, FileName))
+
+def main():
+    Parser = argparse.ArgumentParser(description="Grab the map data from the guide.")
+    Parser.add_argument("--url-root", default=UrlRoot,
+                        help="Download chapters from here. Default: %(default)s")
+    Parser.add_argument("-c", "--concurrency", type=int, default=4,
+                        help="Number of concurrent downloads. Default: %(default)s")
+    Parser.add_argument("--rate", type=float, default=0.5,
+                        help="Maximal number of requests per second. The "
+                        "default is as polite as the old 2 s between "
+                        "downloads. Default: %(default)s")
+    Parser.add_argument("--burst", type=int, default=1,
+                        help="Maximal burst of requests. Default: %(default)s")
+    Parser.add_argument("--retries", type=int, default=3,
+                        help="Number of retries for a failed download. "
+                        "Default: %(default)s")
+    Parser.add_argument("--revalidate", action="store_true",
+                        help="Check archived chapters for updates with "
+                        "conditional requests.")
+    Parser.add_argument("--rebuild", action="store_true",
+                        help="Parse all chapters, even if they are unchanged.")
+    Parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Parse chapters in this many processes. "
+                        "Default: %(default)s")
+    Parser.add_argument("--profile", metavar="FILE",
+                        help="Write the time, memory and node counts of each "
+                        "pass on each chapter to FILE as JSON, and print a "
+                        "summary. Cached chapters are not parsed; use with "
+                        "--rebuild to profile all of them.")
+    Args = Parser.parse_args()
+    if Args.profile:
+        Profile.enable()
+
+    Archive = RawArchive(ArchiveFileName)
+    if Args.revalidate:
+        ToFetch = Chapters
+    else:
+        ToFetch = [Chapter for Chapter in Chapters if Chapter not in Archive]
+    try:
+        Failed = fetchChapters(ToFetch, Archive, Args.url_root,
+                               Args.concurrency, Args.rate, Args.burst,
+                               Args.retries)
+    finally:
+        # Keep what was downloaded, even if interrupted.
+        Archive.save()
+    if Failed:
+        Archive.close()
+        sys.exit("Failed to download: " + ", ".join(Failed))
+
+    FragmentFiles, Keys = chapterFragments(Chapters, Archive, Args.rebuild,
+                                           Args.jobs)
+    Archive.close()
+    pruneFragments(set(Keys))
 
+    with Profile.section("writeXml"):
+        writeMapsXml("maps.xml", FragmentFiles)
 
-    if not os.path.exists(CacheDir):
-        os.makedirs(CacheDir)
-    with open(CacheFileName, 'wb') as f:
-        # Write as XML.
-        f.write(etree.tostring(Html, pretty_print=True, method="xml"))
+    if Args.profile:
+        Profile.save(Args.profile)
+        Profile.printSummary()
 
-for Chapter in Chapters:
-    dealWithChapter(Chapter)
-with open("maps.xml", 'wb') as MapFile:
-    MapFile.write(etree.tostring(MapInfoRoot, xml_declaration=True,
-                                 encoding="utf-8",
-                                 pretty_print=True))
+if __name__ == "__main__":
+    main()
@@ -46,56 +46,1307 @@ function addHoverListener(btn, bg, text, tile)
 }
 
 
-let MapWrappers = document.querySelectorAll(".MapWrapper");
-MapWrappers.forEach(function(map_wrapper, i, wrappers) {
+// Register the <text> of a tile in a compact map.
+function addCompactTile(map_name, svg, text)
+{
+    let Cell = svg.dataset.cell.split(" ").map(Number);
+    text.Col = Math.floor(Number(text.getAttribute("x")) / Cell[0]);
+    text.Row = Math.floor((Number(text.getAttribute("y")) - 5) / Cell[1]);
+    text.Tile = document.getElementById(
+        "Tile-{0}-{1}".format(map_name, text.textContent));
+    svg.ByPosition[text.Col + "," + text.Row] = text;
+    svg.TileTexts[text.textContent] = text;
+}
+
+// Set up a map in the compact rendering of map-gen.py, where a tile is just
+// a <text>. One set of listeners on the <svg> finds the tile from the
+// pointer position.
+function setupCompactMap(map_name, svg)
+{
+    let Cell = svg.dataset.cell.split(" ").map(Number);
+    let Cursor = svg.querySelector("rect.Cursor");
+    // "column,row" (0-based) -> <text>, and coordinate -> <text>
+    svg.ByPosition = {};
+    svg.TileTexts = {};
+    svg.querySelectorAll("g.Tiles text").forEach(function(text){
+        addCompactTile(map_name, svg, text);
+    });
+    svg.Selected = null;
+    let Hovered = null;
+
+    function tileAt(event)
+    {
+        let Box = svg.getBoundingClientRect();
+        let Col = Math.floor((event.clientX - Box.left - 0.5) / Cell[0]);
+        let Row = Math.floor((event.clientY - Box.top - 0.5) / Cell[1]);
+        return svg.ByPosition[Col + "," + Row] || null;
+    }
+
+    function show(text)
+    {
+        Cursor.setAttribute("x", (text.Col * Cell[0] + 0.5).toString());
+        Cursor.setAttribute("y", (text.Row * Cell[1] + 0.5).toString());
+        Cursor.style.visibility = "visible";
+        text.classList.add("Active");
+        text.Tile.style.display = "block";
+    }
+
+    function hide(text)
+    {
+        Cursor.style.visibility = "hidden";
+        text.classList.remove("Active");
+        text.Tile.style.display = "none";
+    }
+
+    svg.addEventListener("mousemove", function(event){
+        if(svg.Selected)
+        {
+            return;
+        }
+        let Text = tileAt(event);
+        if(Text != Hovered)
+        {
+            if(Hovered != null)
+            {
+                hide(Hovered);
+            }
+            if(Text != null)
+            {
+                show(Text);
+            }
+            Hovered = Text;
+        }
+    });
+    svg.addEventListener("mouseleave", function(event){
+        if(!svg.Selected && Hovered != null)
+        {
+            hide(Hovered);
+            Hovered = null;
+        }
+    });
+    svg.addEventListener("click", function(event){
+        let Text = tileAt(event);
+        if(Text == null)
+        {
+            return;
+        }
+        if(svg.Selected == null)
+        {
+            if(Hovered != null && Hovered != Text)
+            {
+                hide(Hovered);
+            }
+            show(Text);
+            svg.Selected = Text;
+        }
+        else if(svg.Selected != Text)
+        {
+            hide(svg.Selected);
+            show(Text);
+            svg.Selected = Text;
+        }
+        else
+        {
+            svg.Selected = null;
+        }
+        Hovered = Text;
+    });
+}
+
+// Attach the listeners to a tile, given its .TileWrapper.
+function setupTile(map_name, map_svg, tile)
+{
+    let Match = tile.getAttribute("id").match(/Tile-.*-(.*)/);
+    let Coord = Match[1];
+    let SvgButton = document.getElementById(
+        "TileBtn-{0}-{1}".format(map_name, Coord));
+    SvgButton.MapSvg = map_svg;
+
+    let SvgGroup = SvgButton.parentElement;
+    let SvgBg = SvgGroup.querySelector("rect.TileBG");
+    let SvgText = SvgGroup.querySelector("text.TileText");
+    addHoverListener(SvgButton, SvgBg, SvgText, tile);
+
+    SvgButton.addEventListener("click", function(event){
+        if(SvgButton.MapSvg.Selected == null)
+        {
+            SvgButton.MapSvg.Selected = tile;
+            SvgButton.MapSvg.SelectedSvgGroup = SvgGroup;
+        }
+        else if(SvgButton.MapSvg.Selected != tile)
+        {
+            SvgButton.MapSvg.Selected.style.display = "none";
+            tile.style.display = "block";
+            let SelectedSvgBg = SvgButton.MapSvg.SelectedSvgGroup
+                .querySelector("rect.TileBG");
+            let SelectedSvgText = SvgButton.MapSvg.SelectedSvgGroup
+                .querySelector("text.TileText");
+            SelectedSvgBg.setAttribute("fill-opacity", "1");
+            SelectedSvgText.setAttribute("fill", "white");
+            SelectedSvgText.setAttribute("font-weight", "normal");
+
+            SvgButton.MapSvg.Selected = tile;
+            SvgButton.MapSvg.SelectedSvgGroup = SvgGroup;
+            SvgBg.setAttribute("fill-opacity", "0");
+            SvgText.setAttribute("fill", SvgBg.getAttribute("fill"));
+            SvgText.setAttribute("font-weight", "bold");
+
+        }
+        else
+        {
+            SvgButton.MapSvg.Selected = null;
+            SvgButton.MapSvg.SelectedSvgGroup = null;
+        }
+    });
+}
+
+// Attach the listeners to the tiles of a map.
+function setupMap(map_wrapper)
+{
     let Match = map_wrapper.getAttribute("id").match(/MapWrapper-(.*)/);
     let MapName = Match[1];
     let MapSvg = document.getElementById("Map-" + MapName);
+    if(MapSvg.classList.contains("CompactMap"))
+    {
+        setupCompactMap(MapName, MapSvg);
+        return;
+    }
     let Tiles = map_wrapper.querySelectorAll(".TileWrapper");
     MapSvg.Selected = null;
 
     Tiles.forEach(function(tile, i, tiles){
-        let Match = tile.getAttribute("id").match(/Tile-.*-(.*)/);
-        let Coord = Match[1];
-        let SvgButton = document.getElementById(
-            "TileBtn-{0}-{1}".format(MapName, Coord));
-        SvgButton.MapSvg = MapSvg;
-
-        let SvgGroup = SvgButton.parentElement;
-        let SvgBg = SvgGroup.querySelector("rect.TileBG");
-        let SvgText = SvgGroup.querySelector("text.TileText");
-        addHoverListener(SvgButton, SvgBg, SvgText, tile);
-
-        SvgButton.addEventListener("click", function(event){
-            if(SvgButton.MapSvg.Selected == null)
+        setupTile(MapName, MapSvg, tile);
+    });
+}
+
+// In the split output of map-gen.py, a map wrapper only has a placeholder,
+// and the URL of the map in data-src. Fetch it and set it up. Return a
+// promise. A map that a patch changed is fetched bypassing the cache, and
+// the patch is applied to it again, because with fingerprinted files the
+// URL still has the version from before the patch.
+function loadMap(map_wrapper)
+{
+    if(map_wrapper.Loading)
+    {
+        return map_wrapper.Loading;
+    }
+    map_wrapper.Loading = fetch(map_wrapper.dataset.src, {
+        cache: map_wrapper.Stale ? "no-cache" : "default"
+    }).then(function(response){
+        if(!response.ok)
+        {
+            throw new Error("{0}: {1}".format(map_wrapper.dataset.src,
+                                              response.statusText));
+        }
+        return response.text();
+    }).then(function(text){
+        map_wrapper.querySelector(".SvgWrapper").remove();
+        map_wrapper.insertAdjacentHTML("beforeend", text);
+        setupMap(map_wrapper);
+        if(map_wrapper.Change)
+        {
+            patchMap(map_wrapper,
+                     map_wrapper.id.substring("MapWrapper-".length),
+                     map_wrapper.Change,
+                     document.getElementById("maps").dataset.platform);
+            map_wrapper.Change = null;
+        }
+        highlightFound();
+    }).catch(function(error){
+        map_wrapper.Loading = null;
+        console.error(error);
+    });
+    return map_wrapper.Loading;
+}
+
+let MapWrappers = document.querySelectorAll(".MapWrapper");
+let LazyMaps = [];
+MapWrappers.forEach(function(map_wrapper, i, wrappers) {
+    if(map_wrapper.dataset.src)
+    {
+        LazyMaps.push(map_wrapper);
+    }
+    else
+    {
+        setupMap(map_wrapper);
+    }
+});
+
+if(LazyMaps.length > 0)
+{
+    let Selected = location.hash ? document.getElementById(
+        decodeURIComponent(location.hash.substring(1))) : null;
+    if(Selected != null && Selected.dataset.src)
+    {
+        loadMap(Selected);
+    }
+
+    if("IntersectionObserver" in window)
+    {
+        let Observer = new IntersectionObserver(function(entries, observer){
+            entries.forEach(function(entry){
+                if(entry.isIntersecting)
+                {
+                    observer.unobserve(entry.target);
+                    loadMap(entry.target);
+                }
+            });
+        }, {rootMargin: "200px"});
+        LazyMaps.forEach(function(map_wrapper){ Observer.observe(map_wrapper); });
+    }
+    else
+    {
+        LazyMaps.forEach(loadMap);
+    }
+}
+
+// ========== Search ================================================>
+
+// The index is generated by map-gen.py, and parsed on the first search. It
+// is in the page, or in the file named by the data-src of its <script>.
+let SearchIndex = null;
+let SearchIndexLoading = null;
+// [patch, platform] of the patches applied to the page before the index was
+// loaded
+let SearchIndexPatches = [];
+// The loot postings of the index, for the loot planner, are in a <script> of
+// their own. They become the "loot" of the index on the first plan.
+let LootIndexLoading = null;
+// [dead tile indices, [item, tile index]] of the patches applied to the
+// index before its loot was loaded
+let LootPatches = [];
+let FoundTiles = [];
+
+// Same normalization as searchTokens() in map-gen.py.
+function searchTokens(text)
+{
+    let Tokens = text.normalize("NFKD").replace(/\p{M}/gu, "").toLowerCase()
+        .match(/[a-z0-9]+/g);
+    return Tokens || [];
+}
+
+function setSearchIndex(index)
+{
+    SearchIndex = index;
+    SearchIndexPatches.forEach(function(args){
+        patchSearchIndex(args[0], args[1]);
+    });
+    SearchIndexPatches = [];
+    return index;
+}
+
+// Return a promise of the JSON in the <script> `script`, or in the file
+// named by its data-src.
+function loadScriptJson(script)
+{
+    if(!script.dataset.src)
+    {
+        return Promise.resolve(JSON.parse(script.textContent));
+    }
+    return fetch(script.dataset.src).then(function(response){
+        if(!response.ok)
+        {
+            throw new Error("{0}: {1}".format(script.dataset.src,
+                                              response.statusText));
+        }
+        return response.json();
+    });
+}
+
+// Return a promise of the index. An index in the page is there at once.
+function loadSearchIndex()
+{
+    if(SearchIndexLoading)
+    {
+        return SearchIndexLoading;
+    }
+    let Script = document.getElementById("SearchIndex");
+    if(!Script.dataset.src)
+    {
+        SearchIndexLoading = Promise.resolve(
+            setSearchIndex(JSON.parse(Script.textContent)));
+        return SearchIndexLoading;
+    }
+    SearchIndexLoading = loadScriptJson(Script).then(setSearchIndex)
+        .catch(function(error){
+            SearchIndexLoading = null;
+            throw error;
+        });
+    return SearchIndexLoading;
+}
+
+// Return a promise of the index with its loot.
+function loadLootIndex()
+{
+    if(LootIndexLoading)
+    {
+        return LootIndexLoading;
+    }
+    LootIndexLoading = Promise.all([
+        loadSearchIndex(),
+        loadScriptJson(document.getElementById("LootIndex"))
+    ]).then(function(results){
+        let Index = results[0];
+        Index.loot = results[1];
+        LootPatches.forEach(function(args){
+            patchLoot(Index.loot, args[0], args[1]);
+        });
+        LootPatches = [];
+        return Index;
+    }).catch(function(error){
+        LootIndexLoading = null;
+        throw error;
+    });
+    return LootIndexLoading;
+}
+
+// Return the [map, coordinate] of the tiles that have all the tokens of
+// the query, or null if the query has no tokens. The index has to be
+// loaded.
+function searchTiles(query)
+{
+    let Tokens = searchTokens(query);
+    if(Tokens.length == 0)
+    {
+        return null;
+    }
+
+    let Result = null;
+    for(let Token of Tokens)
+    {
+        let Posting = Object.prototype.hasOwnProperty.call(
+            SearchIndex.tokens, Token) ? SearchIndex.tokens[Token] : [];
+        if(Result == null)
+        {
+            Result = Posting;
+            continue;
+        }
+        // Both lists are sorted.
+        let Common = [];
+        let i = 0, j = 0;
+        while(i < Result.length && j < Posting.length)
+        {
+            if(Result[i] < Posting[j]) i++;
+            else if(Result[i] > Posting[j]) j++;
+            else { Common.push(Result[i]); i++; j++; }
+        }
+        Result = Common;
+    }
+    return Result.map(function(tile_index){
+        let Tile = SearchIndex.tiles[tile_index];
+        return [SearchIndex.maps[Tile[0]], Tile[1]];
+    });
+}
+
+// Outline the tiles of the last search. Tiles of maps that are not loaded
+// yet are outlined when their map is loaded.
+function highlightFound()
+{
+    FoundTiles.forEach(function(bg){
+        if(bg.classList.contains("Marker"))
+        {
+            bg.remove();
+        }
+        else
+        {
+            bg.classList.remove("Found");
+        }
+    });
+    FoundTiles = [];
+    FoundResult.forEach(function(tile){
+        let Bg = document.getElementById("TileBG-{0}-{1}".format(tile[0], tile[1]));
+        if(Bg != null)
+        {
+            Bg.classList.add("Found");
+            FoundTiles.push(Bg);
+            return;
+        }
+        // Compact rendering: add an outline rect.
+        let Svg = document.getElementById("Map-" + tile[0]);
+        if(Svg == null || !Svg.TileTexts || !Svg.TileTexts[tile[1]])
+        {
+            return;
+        }
+        let Text = Svg.TileTexts[tile[1]];
+        let Cell = Svg.dataset.cell.split(" ").map(Number);
+        let Marker = document.createElementNS("http://www.w3.org/2000/svg", "rect");
+        Marker.setAttribute("class", "Found Marker");
+        Marker.setAttribute("x", (Text.Col * Cell[0] + 0.5).toString());
+        Marker.setAttribute("y", (Text.Row * Cell[1] + 0.5).toString());
+        Marker.setAttribute("width", Cell[0].toString());
+        Marker.setAttribute("height", Cell[1].toString());
+        Svg.appendChild(Marker);
+        FoundTiles.push(Marker);
+    });
+}
+
+let FoundResult = [];
+
+// Outline the tiles `tiles`, [map, coordinate], and load their maps.
+function showFound(tiles)
+{
+    FoundResult = tiles;
+    highlightFound();
+    let Maps = new Set(tiles.map(function(tile){ return tile[0]; }));
+    Maps.forEach(function(map_name){
+        let Wrapper = document.getElementById("MapWrapper-" + map_name);
+        if(Wrapper != null && Wrapper.dataset.src)
+        {
+            loadMap(Wrapper);
+        }
+    });
+}
+
+let SearchBox = document.getElementById("Search");
+let SearchStatus = document.getElementById("SearchStatus");
+// The search or the loot plan, whichever ran last, to run again when the
+// index changes.
+let RefreshFound = runSearch;
+function runSearch()
+{
+    RefreshFound = runSearch;
+    if(SearchIndex == null)
+    {
+        if(searchTokens(SearchBox.value).length == 0)
+        {
+            return;
+        }
+        let Loading = loadSearchIndex();
+        if(SearchIndex == null)
+        {
+            // It is in a file of its own. Search when it is loaded.
+            Loading.then(runSearch).catch(function(error){
+                console.error(error);
+            });
+            return;
+        }
+    }
+    let Tiles = searchTiles(SearchBox.value);
+    showFound(Tiles || []);
+    SearchStatus.textContent = Tiles == null ? "" :
+        "{0} tiles".format(Tiles.length);
+}
+
+SearchBox.addEventListener("input", runSearch);
+
+// ========== Loot planner ==========================================>
+
+// Same as loot-plan.py, on the loot of the search index. Masks have a bit
+// per item of the plan, so a plan has at most 30 items.
+let PlanMaxItems = 30;
+let PlanMaxNodes = 10000;
+
+function bitCount(mask)
+{
+    let Count = 0;
+    for(; mask; mask &= mask - 1)
+    {
+        Count++;
+    }
+    return Count;
+}
+
+// Same as candidates() in loot-plan.py: [{tile, mask, cost, key}] for the
+// lowercase item names `keys`. The key is "map\ncoordinate", which sorts
+// as (map, coordinate) does in Python.
+function planCandidates(index, keys, weighted)
+{
+    let Scale = weighted ? 1 : (DiffiColors.length - 1) * keys.length + 1;
+    let Masks = new Map();      // tile index -> mask
+    for(let Item in index.loot)
+    {
+        let j = keys.indexOf(Item.toLowerCase());
+        if(j < 0)
+        {
+            continue;
+        }
+        index.loot[Item].forEach(function(tile_index){
+            Masks.set(tile_index, (Masks.get(tile_index) || 0) | (1 << j));
+        });
+    }
+    // The best tile for each mask first, then the best masks.
+    let ByMask = new Map();
+    Array.from(Masks.keys()).sort(function(a, b){
+        return a - b;
+    }).forEach(function(tile_index){
+        let Tile = index.tiles[tile_index];
+        let Cand = {tile: tile_index, mask: Masks.get(tile_index),
+                    cost: Scale + Tile[2],
+                    key: index.maps[Tile[0]] + "\n" + Tile[1]};
+        let Best = ByMask.get(Cand.mask);
+        if(Best === undefined || Cand.cost < Best.cost ||
+           (Cand.cost == Best.cost && Cand.key < Best.key))
+        {
+            ByMask.set(Cand.mask, Cand);
+        }
+    });
+    let Cands = Array.from(ByMask.values());
+    return Cands.filter(function(cand){
+        return !Cands.some(function(other){
+            return other.mask != cand.mask && !(cand.mask & ~other.mask) &&
+                other.cost <= cand.cost;
+        });
+    }).sort(function(a, b){
+        return a.cost - b.cost || (a.key < b.key ? -1 : a.key > b.key ? 1 : 0);
+    });
+}
+
+// Same as greedyCover() in loot-plan.py.
+function greedyCover(cands, full)
+{
+    let Chosen = [];
+    let Left = full;
+    while(Left)
+    {
+        let Best = null;
+        let BestCount = 0;
+        cands.forEach(function(cand){
+            let Count = bitCount(cand.mask & Left);
+            if(Count > 0 && (Best == null ||
+                             Count * Best.cost > BestCount * cand.cost))
             {
-                SvgButton.MapSvg.Selected = tile;
-                SvgButton.MapSvg.SelectedSvgGroup = SvgGroup;
+                Best = cand;
+                BestCount = Count;
             }
-            else if(SvgButton.MapSvg.Selected != tile)
+        });
+        Chosen.push(Best);
+        Left &= ~Best.mask;
+    }
+    Chosen.slice().reverse().forEach(function(cand){
+        let Others = 0;
+        Chosen.forEach(function(other){
+            if(other !== cand)
+            {
+                Others |= other.mask;
+            }
+        });
+        if((Others & full) == full)
+        {
+            Chosen.splice(Chosen.indexOf(cand), 1);
+        }
+    });
+    return Chosen;
+}
+
+// Same as exactCover() in loot-plan.py. Return {best, proven, nodes}.
+function exactCover(cands, full, best, max_nodes)
+{
+    let ByItem = {};            // item bit -> [candidate]
+    cands.forEach(function(cand){
+        for(let Mask = cand.mask; Mask; Mask &= Mask - 1)
+        {
+            let Bit = Mask & -Mask;
+            (ByItem[Bit] = ByItem[Bit] || []).push(cand);
+        }
+    });
+    let State = {best: best.slice(), nodes: 0, proven: true,
+                 cost: best.reduce(function(sum, cand){
+                     return sum + cand.cost; }, 0)};
+
+    function search(left, chosen, cost)
+    {
+        State.nodes++;
+        if(State.nodes > max_nodes)
+        {
+            State.proven = false;
+            return;
+        }
+        if(!left)
+        {
+            if(cost < State.cost)
             {
-                SvgButton.MapSvg.Selected.style.display = "none";
-                tile.style.display = "block";
-                let SelectedSvgBg = SvgButton.MapSvg.SelectedSvgGroup
-                    .querySelector("rect.TileBG");
-                let SelectedSvgText = SvgButton.MapSvg.SelectedSvgGroup
-                    .querySelector("text.TileText");
-                SelectedSvgBg.setAttribute("fill-opacity", "1");
-                SelectedSvgText.setAttribute("fill", "white");
-                SelectedSvgText.setAttribute("font-weight", "normal");
-
-                SvgButton.MapSvg.Selected = tile;
-                SvgButton.MapSvg.SelectedSvgGroup = SvgGroup;
-                SvgBg.setAttribute("fill-opacity", "0");
-                SvgText.setAttribute("fill", SvgBg.getAttribute("fill"));
-                SvgText.setAttribute("font-weight", "bold");
+                State.best = chosen.slice();
+                State.cost = cost;
+            }
+            return;
+        }
 
+        let Bound = 0;
+        let Branch = null;
+        for(let Mask = left; Mask; Mask &= Mask - 1)
+        {
+            let Bit = Mask & -Mask;
+            Bound = Math.max(Bound, ByItem[Bit][0].cost);
+            if(Branch == null || ByItem[Bit].length < ByItem[Branch].length)
+            {
+                Branch = Bit;
+            }
+        }
+        let Rate = null;
+        let RateItems = 0;
+        cands.forEach(function(cand){
+            let Items = bitCount(cand.mask & left);
+            if(Items > 0 && (Rate == null ||
+                             Items * Rate.cost > RateItems * cand.cost))
+            {
+                Rate = cand;
+                RateItems = Items;
             }
-            else
+        });
+        Bound = Math.max(Bound, Math.ceil(bitCount(left) * Rate.cost
+                                          / RateItems));
+        if(cost + Bound >= State.cost)
+        {
+            return;
+        }
+
+        let Options = ByItem[Branch].slice().sort(function(a, b){
+            return bitCount(b.mask & left) * a.cost
+                - bitCount(a.mask & left) * b.cost;
+        });
+        for(let Cand of Options)
+        {
+            chosen.push(Cand);
+            search(left & ~Cand.mask, chosen, cost + Cand.cost);
+            chosen.pop();
+            if(!State.proven)
             {
-                SvgButton.MapSvg.Selected = null;
-                SvgButton.MapSvg.SelectedSvgGroup = null;
+                return;
             }
+        }
+    }
+
+    search(full, [], 0);
+    return State;
+}
+
+// Return the plan for the loot `items`: {tiles: [tile index] in the order
+// of the maps, proven}, or {unknown: [item]} if some items are not in the
+// index.
+function planLoot(index, items, weighted, max_nodes)
+{
+    let Keys = [];
+    items.forEach(function(item){
+        if(Keys.indexOf(item.toLowerCase()) < 0)
+        {
+            Keys.push(item.toLowerCase());
+        }
+    });
+    let Known = new Set(Object.keys(index.loot).map(function(item){
+        return item.toLowerCase();
+    }));
+    let Unknown = items.filter(function(item){
+        return !Known.has(item.toLowerCase());
+    });
+    if(Unknown.length > 0)
+    {
+        return {unknown: Unknown};
+    }
+    let Cands = planCandidates(index, Keys, weighted);
+    let Full = (1 << Keys.length) - 1;
+    let Result = exactCover(Cands, Full, greedyCover(Cands, Full), max_nodes);
+    return {tiles: Result.best.map(function(cand){ return cand.tile; })
+            .sort(function(a, b){ return a - b; }),
+            proven: Result.proven};
+}
+
+let PlanBox = document.getElementById("PlanItem");
+let PlanWeighted = document.getElementById("PlanWeighted");
+let PlanList = document.getElementById("PlanItems");
+let PlanStatus = document.getElementById("PlanStatus");
+let PlanItems = [];
+
+function runPlan()
+{
+    RefreshFound = runPlan;
+    PlanList.replaceChildren.apply(PlanList, PlanItems.map(function(item){
+        let Button = document.createElement("button");
+        Button.type = "button";
+        Button.title = "Remove";
+        Button.textContent = item + " ×";
+        Button.addEventListener("click", function(){
+            PlanItems.splice(PlanItems.indexOf(item), 1);
+            runPlan();
         });
-    })
+        return Button;
+    }));
+    if(PlanItems.length == 0)
+    {
+        PlanStatus.textContent = "";
+        showFound([]);
+        return;
+    }
+    loadLootIndex().then(function(index){
+        let Plan = planLoot(index, PlanItems, PlanWeighted.checked,
+                            PlanMaxNodes);
+        if(Plan.unknown)
+        {
+            PlanStatus.textContent = "No loot item {0}".format(
+                Plan.unknown.join(", "));
+            return;
+        }
+        let Tiles = Plan.tiles.map(function(tile_index){
+            let Tile = index.tiles[tile_index];
+            return [index.maps[Tile[0]], Tile[1], Tile[2]];
+        });
+        PlanStatus.textContent = "{0} tiles, difficulty {1}{2}: {3}".format(
+            Tiles.length, Tiles.reduce(function(sum, tile){
+                return sum + tile[2]; }, 0),
+            Plan.proven ? "" : " (maybe not the best)",
+            Tiles.map(function(tile){ return tile[0] + " " + tile[1]; })
+            .join(", "));
+        showFound(Tiles);
+    }).catch(function(error){
+        console.error(error);
+    });
+}
+
+// Offer the items of the index when the box is used.
+PlanBox.addEventListener("focus", function(){
+    loadLootIndex().then(function(index){
+        let List = document.getElementById("LootItems");
+        List.replaceChildren.apply(List, Object.keys(index.loot).sort()
+                                   .map(function(item){
+            let Option = document.createElement("option");
+            Option.value = item;
+            return Option;
+        }));
+    }).catch(function(error){
+        console.error(error);
+    });
+});
+PlanBox.addEventListener("change", function(){
+    let Item = PlanBox.value.trim();
+    PlanBox.value = "";
+    if(Item == "" || PlanItems.some(function(item){
+        return item.toLowerCase() == Item.toLowerCase(); }))
+    {
+        return;
+    }
+    if(PlanItems.length >= PlanMaxItems)
+    {
+        PlanStatus.textContent = "At most {0} items".format(PlanMaxItems);
+        return;
+    }
+    loadLootIndex().then(function(index){
+        let Name = Object.keys(index.loot).find(function(item){
+            return item.toLowerCase() == Item.toLowerCase();
+        });
+        if(Name === undefined)
+        {
+            PlanStatus.textContent = "No loot item {0}".format(Item);
+            return;
+        }
+        PlanItems.push(Name);
+        runPlan();
+    }).catch(function(error){
+        console.error(error);
+    });
 });
+PlanWeighted.addEventListener("change", runPlan);
+
+// ========== Updates ===============================================>
+
+// When maps.xml changes, map-diff.py writes a patch from the previous
+// version, and map-gen.py puts it next to the page. A page that is still
+// made from the previous version applies it to itself, instead of loading
+// everything again.
+
+// Same as DiffiColors in map-gen.py.
+let DiffiColors = ["#bdc3c7", "#27ae60", "#f1c40f", "#8e44ad", "#e67e22",
+                   "#2980b9", "#c0392b"];
+// Cell size of the maps, as in MapInfo.genSvg() in map-gen.py.
+let MapCell = [30, 20];
+let SvgNs = "http://www.w3.org/2000/svg";
+
+// Same as parseCoord() in map-gen.py, but 0-based.
+function parseCoord(coord)
+{
+    let Match = coord.match(/^([A-Z]+)([0-9]+)$/);
+    let Col = 0;
+    for(let Char of Match[1])
+    {
+        Col = Col * 26 + Char.charCodeAt(0) - 64;
+    }
+    return [Col - 1, Number(Match[2]) - 1];
+}
+
+// Same as platformValue() in map-gen.py. A value that differs by platform
+// is an object keyed by platform.
+function platformValue(value, platform)
+{
+    if(Array.isArray(value))
+    {
+        return value.map(function(item){ return platformValue(item, platform); });
+    }
+    if(value != null && typeof value == "object")
+    {
+        return Object.prototype.hasOwnProperty.call(value, platform)
+            ? value[platform] : null;
+    }
+    return value;
+}
+
+// Same as tableRow() in map-gen.py, returning the HTML.
+function tableRowHtml(key, value)
+{
+    if(value == null)
+    {
+        return "";
+    }
+    let Html = [];
+    if(key != null)
+    {
+        Html.push("<tr><th>" + key + "</th><td>");
+    }
+    if(Array.isArray(value))
+    {
+        Html.push("<ul>");
+        value.forEach(function(item){
+            Html.push("<li>" + tableRowHtml(null, item) + "</li>");
+        });
+        Html.push("</ul>");
+    }
+    else
+    {
+        Html.push(String(value));
+    }
+    if(key != null)
+    {
+        Html.push("</td></tr>");
+    }
+    return Html.join("");
+}
+
+// The .TileWrapper of a tile from a patch, as mapContent() in map-gen.py
+// writes it.
+function tileHtml(map_name, coord, tile, platform)
+{
+    let Rows = [["Mission", "mission"], ["Loot", "loot-v"],
+                ["Treasure", "treasure"], ["A-rank loot", "loot-a"],
+                ["A-rank KO", "ko-a"], ["A-rank time", "time-a"],
+                ["A-rank damage", "damage-a"]];
+    return '<div id="Tile-{0}-{1}" class="TileWrapper">'.format(map_name, coord)
+        + '<h3 class="TileTitle">{0}</h3>'.format(coord)
+        + '<table id="TileData-{0}-{1}"><tbody>'.format(map_name, coord)
+        + Rows.map(function(row){
+            return tableRowHtml(row[0], platformValue(tile[row[1]], platform));
+        }).join("")
+        + "</tbody></table></div>";
+}
+
+function mapCell(svg)
+{
+    return svg.dataset.cell ? svg.dataset.cell.split(" ").map(Number) : MapCell;
+}
+
+function svgElement(name, attributes)
+{
+    let Node = document.createElementNS(SvgNs, name);
+    for(let Name in attributes)
+    {
+        Node.setAttribute(Name, attributes[Name].toString());
+    }
+    return Node;
+}
+
+// Add the SVG of a tile to a map, as TileInfo.nodeSvg() or
+// TileInfo.compactSvg() in map-gen.py make it. Return it.
+function addTileSvg(map_name, svg, coord, difficulty)
+{
+    let Pos = parseCoord(coord);
+    let Cell = mapCell(svg);
+    let X = Pos[0] * Cell[0] + 0.5;
+    let Y = Pos[1] * Cell[1] + 0.5;
+    let TextX = (Pos[0] + 0.5) * Cell[0];
+    let TextY = (Pos[1] + 0.5) * Cell[1] + 5;
+    if(svg.classList.contains("CompactMap"))
+    {
+        let Text = svgElement("text", {x: TextX, y: TextY,
+                                       class: "D" + difficulty});
+        Text.textContent = coord;
+        svg.querySelector("g.Tiles").appendChild(Text);
+        return Text;
+    }
+    let Group = svgElement("g", {});
+    Group.appendChild(svgElement("rect", {
+        fill: DiffiColors[difficulty], x: X, y: Y, width: Cell[0],
+        height: Cell[1], class: "TileBG",
+        id: "TileBG-{0}-{1}".format(map_name, coord)}));
+    let Text = svgElement("text", {
+        x: TextX, y: TextY, fill: "white", class: "TileText",
+        id: "TileText-{0}-{1}".format(map_name, coord),
+        "font-family": '"IBM Plex Mono", "Source Code Pro", Inconsolata, '
+            + 'Consolas, monospace',
+        "font-weight": "normal", "font-size": "12", "text-anchor": "middle"});
+    Text.textContent = coord;
+    Group.appendChild(Text);
+    Group.appendChild(svgElement("rect", {
+        fill: "transparent", x: X, y: Y, width: Cell[0], height: Cell[1],
+        class: "TileBtn", id: "TileBtn-{0}-{1}".format(map_name, coord)}));
+    svg.querySelector("g").appendChild(Group);
+    return Group;
+}
+
+// Remove a tile from a map, if it is there.
+function removeTile(map_name, svg, coord)
+{
+    let Tile = document.getElementById("Tile-{0}-{1}".format(map_name, coord));
+    if(Tile == null)
+    {
+        return;
+    }
+    if(svg.classList.contains("CompactMap"))
+    {
+        let Text = svg.TileTexts[coord];
+        if(svg.Selected == Text)
+        {
+            svg.Selected = null;
+            svg.querySelector("rect.Cursor").style.visibility = "hidden";
+        }
+        delete svg.ByPosition[Text.Col + "," + Text.Row];
+        delete svg.TileTexts[coord];
+        Text.remove();
+    }
+    else
+    {
+        if(svg.Selected == Tile)
+        {
+            svg.Selected = null;
+            svg.SelectedSvgGroup = null;
+        }
+        document.getElementById("TileBtn-{0}-{1}".format(map_name, coord))
+            .parentElement.remove();
+    }
+    Tile.remove();
+}
+
+// Set the size of a map to `cols` x `rows` cells, and draw its grid again,
+// as MapInfo.genSvg() in map-gen.py does.
+function resizeMap(svg, cols, rows)
+{
+    let Cell = mapCell(svg);
+    let Width = cols * Cell[0];
+    let Height = rows * Cell[1];
+    svg.setAttribute("width", (Width + 1).toString());
+    svg.setAttribute("height", (Height + 1).toString());
+    if(svg.classList.contains("CompactMap"))
+    {
+        let Grid = ["M0.5 0.5h{0}v{1}h-{0}z".format(Width, Height)];
+        for(let Col = 1; Col < cols; Col++)
+        {
+            Grid.push("M{0} 0.5v{1}".format(Col * Cell[0] + 0.5, Height));
+        }
+        for(let Row = 1; Row < rows; Row++)
+        {
+            Grid.push("M0.5 {0}h{1}".format(Row * Cell[1] + 0.5, Width));
+        }
+        svg.querySelector("path.Grid").setAttribute("d", Grid.join(""));
+        return;
+    }
+    let Lines = [svgElement("rect", {x: 0.5, y: 0.5, width: Width,
+                                     height: Height, fill: "none",
+                                     stroke: "black"})];
+    for(let Col = 1; Col < cols; Col++)
+    {
+        let X = Col * Cell[0] + 0.5;
+        Lines.push(svgElement("line", {x1: X, y1: 0.5, x2: X, y2: Height + 0.5,
+                                       stroke: "black"}));
+    }
+    for(let Row = 1; Row < rows; Row++)
+    {
+        let Y = Row * Cell[1] + 0.5;
+        Lines.push(svgElement("line", {x1: 0.5, y1: Y, x2: Width + 0.5, y2: Y,
+                                       stroke: "black"}));
+    }
+    let Outline = svg.querySelectorAll(":scope > g")[1];
+    Outline.replaceChildren.apply(Outline, Lines);
+}
+
+// Draw the backgrounds of a compact map again from its tiles, as
+// MapInfo.genCompactSvg() in map-gen.py does.
+function drawBackgrounds(svg)
+{
+    let Cell = mapCell(svg);
+    let Paths = {};
+    svg.querySelectorAll("g.Tiles text").forEach(function(text){
+        let Pos = parseCoord(text.textContent);
+        let Class = text.getAttribute("class").split(" ")[0];
+        (Paths[Class] = Paths[Class] || []).push("M{0} {1}h{2}v{3}h-{2}z".format(
+            Pos[0] * Cell[0] + 0.5, Pos[1] * Cell[1] + 0.5, Cell[0], Cell[1]));
+    });
+    let Group = svg.querySelector("g");
+    Group.replaceChildren.apply(Group, Object.keys(Paths).sort().map(
+        function(name){
+            return svgElement("path", {d: Paths[name].join(""), class: name});
+        }));
+}
+
+// Apply the change of a patch to a map on the page. Tiles that are already
+// as in the patch are replaced all the same, so this can run more than
+// once.
+function patchMap(map_wrapper, map_name, change, platform)
+{
+    let Svg = document.getElementById("Map-" + map_name);
+    if(Svg == null)
+    {
+        return;
+    }
+    // The listeners are attached by setupMap() if it has not run yet.
+    let IsSetUp = Svg.Selected !== undefined;
+    let Compact = Svg.classList.contains("CompactMap");
+    let Tables = map_wrapper.querySelector(".TilesWrapper");
+    for(let Coord in change.tiles)
+    {
+        removeTile(map_name, Svg, Coord);
+        let Tile = change.tiles[Coord];
+        if(Tile == null)
+        {
+            continue;
+        }
+        Tables.insertAdjacentHTML("beforeend",
+                                  tileHtml(map_name, Coord, Tile, platform));
+        let Node = addTileSvg(map_name, Svg, Coord, Tile.difficulty);
+        if(IsSetUp && Compact)
+        {
+            addCompactTile(map_name, Svg, Node);
+        }
+        else if(IsSetUp)
+        {
+            setupTile(map_name, Svg, Tables.lastElementChild);
+        }
+    }
+    if(change.size)
+    {
+        resizeMap(Svg, change.size[0], change.size[1]);
+    }
+    if(Compact)
+    {
+        drawBackgrounds(Svg);
+    }
+}
+
+// An empty map wrapper, as renderMap() in map-gen.py writes it.
+function createMap(map_name, compact)
+{
+    let Wrapper = document.createElement("div");
+    Wrapper.id = "MapWrapper-" + map_name;
+    Wrapper.className = "MapWrapper";
+    let Svg = compact
+        ? '<svg xmlns="{0}" version="1.1" id="Map-{1}" class="CompactMap" '
+          + 'data-cell="{2} {3}"><g></g><rect width="{2}" height="{3}" '
+          + 'class="Cursor"></rect><g class="Tiles"></g>'
+          + '<path class="Grid"></path></svg>'
+        : '<svg xmlns="{0}" version="1.1" id="Map-{1}"><g></g><g></g></svg>';
+    Wrapper.innerHTML = ('<h2>{1} Map</h2><div class="SvgWrapper">' + Svg
+                         + '</div><div class="TilesWrapper"></div>').format(
+                             SvgNs, map_name, MapCell[0], MapCell[1]);
+    return Wrapper;
+}
+
+// Remove the tile indices in the set `dead` from the `postings`.
+function removePostings(postings, dead)
+{
+    if(dead.size == 0)
+    {
+        return;
+    }
+    for(let Key in postings)
+    {
+        let Posting = postings[Key].filter(function(tile_index){
+            return !dead.has(tile_index);
+        });
+        if(Posting.length > 0)
+        {
+            postings[Key] = Posting;
+        }
+        else
+        {
+            delete postings[Key];
+        }
+    }
+}
+
+function addPosting(postings, key, tile_index)
+{
+    if(!Object.prototype.hasOwnProperty.call(postings, key))
+    {
+        postings[key] = [];
+    }
+    let Posting = postings[key];
+    if(Posting[Posting.length - 1] != tile_index)
+    {
+        Posting.push(tile_index);
+    }
+}
+
+// Update the loot postings for a patch of the index: remove the tiles
+// `dead`, and add the [item, tile index] `added`.
+function patchLoot(loot, dead, added)
+{
+    removePostings(loot, dead);
+    added.forEach(function(entry){
+        addPosting(loot, entry[0], entry[1]);
+    });
+}
+
+// Update the search index for the changed tiles. Their old entries stay in
+// the index, but no token refers to them anymore.
+function patchSearchIndex(patch, platform)
+{
+    let Index = SearchIndex;
+    let Maps = patch.maps ? new Set(patch.maps) : null;
+    let Dead = new Set();
+    Index.tiles.forEach(function(tile, i){
+        let Name = Index.maps[tile[0]];
+        let Change = Object.prototype.hasOwnProperty.call(patch.changes, Name)
+            ? patch.changes[Name] : null;
+        if((Maps != null && !Maps.has(Name)) || (Change != null &&
+           Object.prototype.hasOwnProperty.call(Change.tiles, tile[1])))
+        {
+            Dead.add(i);
+        }
+    });
+    removePostings(Index.tokens, Dead);
+
+    // New entries come after all the others, so the postings stay sorted.
+    let Loot = [];
+    for(let Name in patch.changes)
+    {
+        let MapIndex = Index.maps.indexOf(Name);
+        if(MapIndex < 0)
+        {
+            MapIndex = Index.maps.push(Name) - 1;
+        }
+        let Tiles = patch.changes[Name].tiles;
+        for(let Coord in Tiles)
+        {
+            if(Tiles[Coord] == null)
+            {
+                continue;
+            }
+            let TileIndex = Index.tiles.push(
+                [MapIndex, Coord,
+                 platformValue(Tiles[Coord].difficulty, platform)]) - 1;
+            // Same fields as SearchIndex.addMap() and TileInfo.lootItems()
+            // in map-gen.py.
+            ["mission", "loot-v", "treasure", "loot-a"].forEach(function(field){
+                let Value = platformValue(Tiles[Coord][field], platform);
+                if(Value == null)
+                {
+                    return;
+                }
+                (Array.isArray(Value) ? Value : [Value]).forEach(function(item){
+                    if(item == null)
+                    {
+                        return;
+                    }
+                    searchTokens(String(item)).forEach(function(token){
+                        addPosting(Index.tokens, token, TileIndex);
+                    });
+                    if(field != "mission")
+                    {
+                        Loot.push([String(item), TileIndex]);
+                    }
+                });
+            });
+        }
+    }
+    if(Index.loot)
+    {
+        patchLoot(Index.loot, Dead, Loot);
+    }
+    else
+    {
+        LootPatches.push([Dead, Loot]);
+    }
+}
+
+function applyPatch(patch)
+{
+    let MapsDiv = document.getElementById("maps");
+    let Platform = MapsDiv.dataset.platform;
+    if(SearchIndex == null)
+    {
+        SearchIndexPatches.push([patch, Platform]);
+    }
+    else
+    {
+        patchSearchIndex(patch, Platform);
+    }
+
+    let Created = new Set();
+    if(patch.maps)
+    {
+        let Names = new Set(patch.maps);
+        MapsDiv.querySelectorAll(".MapWrapper").forEach(function(wrapper){
+            if(!Names.has(wrapper.id.substring("MapWrapper-".length)))
+            {
+                wrapper.remove();
+            }
+        });
+        // Insert the new maps before the next map in the patch.
+        let Next = null;
+        for(let i = patch.maps.length - 1; i >= 0; i--)
+        {
+            let Name = patch.maps[i];
+            let Wrapper = document.getElementById("MapWrapper-" + Name);
+            if(Wrapper == null)
+            {
+                Wrapper = createMap(Name, MapsDiv.classList.contains("Compact"));
+                MapsDiv.insertBefore(Wrapper, Next);
+                Created.add(Name);
+            }
+            Next = Wrapper;
+        }
+    }
+
+    for(let Name in patch.changes)
+    {
+        let Wrapper = document.getElementById("MapWrapper-" + Name);
+        if(Wrapper == null)
+        {
+            continue;
+        }
+        let Change = patch.changes[Name];
+        if(Wrapper.dataset.src)
+        {
+            // Not loaded yet, or loading.
+            Wrapper.Stale = true;
+            Wrapper.Change = Change;
+            if(Wrapper.Loading)
+            {
+                // Unless loadMap() has applied it.
+                Wrapper.Loading.then(function(){
+                    if(Wrapper.Change)
+                    {
+                        patchMap(Wrapper, Name, Change, Platform);
+                        Wrapper.Change = null;
+                    }
+                });
+            }
+            continue;
+        }
+        patchMap(Wrapper, Name, Change, Platform);
+        if(Created.has(Name))
+        {
+            setupMap(Wrapper);
+        }
+    }
+    RefreshFound();
+}
+
+// Fetch the patch that the page names, and apply it if it is from the
+// version of maps.xml that the page is made from.
+function checkForPatch()
+{
+    let MapsDiv = document.getElementById("maps");
+    if(!MapsDiv.dataset.patch || location.protocol == "file:")
+    {
+        return;
+    }
+    fetch(MapsDiv.dataset.patch, {cache: "no-cache"}).then(function(response){
+        // There is no patch most of the time.
+        return response.ok ? response.json() : null;
+    }).then(function(patch){
+        if(patch != null && patch.base == MapsDiv.dataset.version)
+        {
+            applyPatch(patch);
+            MapsDiv.dataset.version = patch.result;
+        }
+    }).catch(function(error){
+        console.error(error);
+    });
+}
+
+checkForPatch();
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; -*-
+
+# Plan which tiles to clear for a set of loot items: the fewest tiles (or
+# the easiest ones) that give all of them between them. The tiles of each
+# item are kept as a bitset, and the set cover is solved greedily, then
+# exactly by a branch and bound with a limit on its size. planLoot() in
+# logic.js is the same planner, on the loot of the search index.
+
+import sys
+import json
+import time
+import argparse
+import functools
+import importlib
+
+mapgen = importlib.import_module("map-gen")
+
+MaxDifficulty = len(mapgen.DiffiColors) - 1
+DefaultMaxNodes = 10000
+
+class LootIndex(object):
+    """The tiles of the maps with the values of `platform`, and the bitset of
+    the tiles (bit i for Tiles[i]) that give each loot item. The items are
+    keyed in lowercase.
+    """
+    def __init__(self, maps, platform=mapgen.DefaultPlatform):
+        self.Tiles = []         # [(map title, TileInfo)]
+        self.Items = {}         # lowercase item -> (item, bitset of tiles)
+        for Map in maps:
+            Map = Map.forPlatform(platform)
+            for Tile in Map.Tiles.values():
+                Bit = 1 << len(self.Tiles)
+                self.Tiles.append((Map.Title, Tile))
+                for Item in Tile.lootItems():
+                    Name, Tiles = self.Items.get(Item.lower(), (Item, 0))
+                    self.Items[Item.lower()] = (Name, Tiles | Bit)
+
+    def find(self, text):
+        """Return the items that contain `text`, ignoring case."""
+        return sorted(Name for Key, (Name, _) in self.Items.items()
+                      if text.lower() in Key)
+
+def bitIndexes(bits):
+    """Yield the indexes of the set bits of the int `bits`, from the lowest,
+    in time linear in its size.
+    """
+    Digits = bin(bits)[:1:-1]
+    Index = Digits.find("1")
+    while Index >= 0:
+        yield Index
+        Index = Digits.find("1", Index + 1)
+
+class Candidate(object):
+    """A tile that gives some of the items of a plan. Bit j of `Mask` is
+    set if it gives the j-th item. Ties are broken by `Key`, (map title,
+    coordinate), which does not depend on the order of the tiles.
+    """
+    __slots__ = ("Tile", "Mask", "Cost", "Key")
+
+    def __init__(self, tile, mask, cost, key):
+        self.Tile = tile
+        self.Mask = mask
+        self.Cost = cost
+        self.Key = key
+
+def candidates(index, keys, weighted=False):
+    """Return the Candidates for the items `keys` (keys of index.Items),
+    sorted by cost and Key. A tile is left out if another gives the same
+    items or more for no more. The cost of a tile is its difficulty plus
+    one if `weighted`. Otherwise it is so much larger than any sum of
+    difficulties that the fewest tiles win, and then the easiest.
+    """
+    Scale = 1 if weighted else MaxDifficulty * len(keys) + 1
+    Masks = {}                  # tile index -> mask
+    for j, Key in enumerate(keys):
+        for TileIndex in bitIndexes(index.Items[Key][1]):
+            Masks[TileIndex] = Masks.get(TileIndex, 0) | 1 << j
+
+    # The best tile for each mask first, then the best masks.
+    ByMask = {}
+    for TileIndex in sorted(Masks):
+        Map, Tile = index.Tiles[TileIndex]
+        Cand = Candidate(TileIndex, Masks[TileIndex],
+                         Scale + Tile.Difficulty, (Map, Tile.Coord))
+        Best = ByMask.get(Cand.Mask)
+        if Best is None or (Cand.Cost, Cand.Key) < (Best.Cost, Best.Key):
+            ByMask[Cand.Mask] = Cand
+    Result = [Cand for Cand in ByMask.values()
+              if not any(Other.Mask != Cand.Mask and
+                         not Cand.Mask & ~Other.Mask and
+                         Other.Cost <= Cand.Cost
+                         for Other in ByMask.values())]
+    Result.sort(key=lambda Cand: (Cand.Cost, Cand.Key))
+    return Result
+
+def greedyCover(cands, full):
+    """Return the Candidates that cover the items in the mask `full`,
+    picked by the most new items per cost, without the ones that turn out
+    not to be needed.
+    """
+    Chosen = []
+    Left = full
+    while Left:
+        Best = None
+        for Cand in cands:
+            Count = (Cand.Mask & Left).bit_count()
+            if Count > 0 and (Best is None or
+                              Count * Best.Cost > BestCount * Cand.Cost):
+                Best = Cand
+                BestCount = Count
+        Chosen.append(Best)
+        Left &= ~Best.Mask
+    for Cand in reversed(list(Chosen)):
+        Others = 0
+        for Other in Chosen:
+            if Other is not Cand:
+                Others |= Other.Mask
+        if Others & full == full:
+            Chosen.remove(Cand)
+    return Chosen
+
+def exactCover(cands, full, best, max_nodes=DefaultMaxNodes):
+    """Return the cheapest Candidates that cover the items in the mask
+    `full`, whether that is proven, and the number of search nodes. `best`
+    is a cover to beat, e.g. from greedyCover(). The search branches on the
+    tiles of the item with the fewest, and gives up after `max_nodes`
+    nodes with the best cover so far.
+    """
+    ByItem = {}                 # item bit -> [Candidate]
+    for Cand in cands:
+        Mask = Cand.Mask
+        while Mask:
+            Bit = Mask & -Mask
+            Mask ^= Bit
+            ByItem.setdefault(Bit, []).append(Cand)
+    State = {"best": list(best), "cost": sum(Cand.Cost for Cand in best),
+             "nodes": 0, "proven": True}
+
+    def search(left, chosen, cost):
+        State["nodes"] += 1
+        if State["nodes"] > max_nodes:
+            State["proven"] = False
+            return
+        if not left:
+            if cost < State["cost"]:
+                State["best"] = list(chosen)
+                State["cost"] = cost
+            return
+
+        # Lower bounds: the cheapest tile of every item, and the items left
+        # at the best rate of items per cost. Costs are integers.
+        Bound = 0
+        Branch = None
+        Mask = left
+        while Mask:
+            Bit = Mask & -Mask
+            Mask ^= Bit
+            Bound = max(Bound, ByItem[Bit][0].Cost)
+            if Branch is None or len(ByItem[Bit]) < len(ByItem[Branch]):
+                Branch = Bit
+        Count = left.bit_count()
+        Rate = None
+        for Cand in cands:
+            Items = (Cand.Mask & left).bit_count()
+            if Items > 0 and (Rate is None or
+                              Items * Rate.Cost > RateItems * Cand.Cost):
+                Rate = Cand
+                RateItems = Items
+        Bound = max(Bound, -(-Count * Rate.Cost // RateItems))
+        if cost + Bound >= State["cost"]:
+            return
+
+        def compare(a, b):
+            return (b.Mask & left).bit_count() * a.Cost - \
+                (a.Mask & left).bit_count() * b.Cost
+
+        for Cand in sorted(ByItem[Branch], key=functools.cmp_to_key(compare)):
+            chosen.append(Cand)
+            search(left & ~Cand.Mask, chosen, cost + Cand.Cost)
+            chosen.pop()
+            if not State["proven"]:
+                return
+
+    search(full, [], 0)
+    return State["best"], State["proven"], State["nodes"]
+
+class Plan(object):
+    """The tiles to clear for some items, in the order of the maps."""
+    def __init__(self, index, keys, tiles, proven, nodes):
+        self.Index = index
+        self.Keys = keys
+        self.Tiles = sorted(tiles)
+        self.Proven = proven
+        self.Nodes = nodes
+
+    def difficulty(self):
+        return sum(self.Index.Tiles[TileIndex][1].Difficulty
+                   for TileIndex in self.Tiles)
+
+    def json(self):
+        Result = {"items": [self.Index.Items[Key][0] for Key in self.Keys],
+                  "tiles": [], "difficulty": self.difficulty(),
+                  "optimal": self.Proven}
+        for TileIndex in self.Tiles:
+            Map, Tile = self.Index.Tiles[TileIndex]
+            Bit = 1 << TileIndex
+            Result["tiles"].append({
+                "map": Map, "coordinate": Tile.Coord,
+                "difficulty": Tile.Difficulty,
+                "items": [self.Index.Items[Key][0] for Key in self.Keys
+                          if self.Index.Items[Key][1] & Bit]})
+        return Result
+
+def planLoot(index, items, weighted=False, exact=True,
+             max_nodes=DefaultMaxNodes):
+    """Return the Plan for the loot `items` (in any case), and the greedy
+    one. The Plan is the greedy one without `exact`. Raise KeyError for an
+    unknown item.
+    """
+    Keys = []
+    for Item in items:
+        if Item.lower() not in index.Items:
+            raise KeyError(Item)
+        if Item.lower() not in Keys:
+            Keys.append(Item.lower())
+    Cands = candidates(index, Keys, weighted)
+    Full = (1 << len(Keys)) - 1
+    Greedy = greedyCover(Cands, Full)
+    GreedyPlan = Plan(index, Keys, [Cand.Tile for Cand in Greedy], False, 0)
+    if not exact:
+        return GreedyPlan, GreedyPlan
+    Tiles, Proven, Nodes = exactCover(Cands, Full, Greedy, max_nodes)
+    return Plan(index, Keys, [Cand.Tile for Cand in Tiles], Proven,
+                Nodes), GreedyPlan
+
+def main():
+    Parser = argparse.ArgumentParser(
+        description="Find the fewest tiles that give all of some loot items.")
+    Parser.add_argument("items", nargs="*", metavar="ITEM",
+                        help="Loot items, as in the guide, in any case.")
+    Parser.add_argument("--xml", default="maps.xml",
+                        help="Map data. Default: %(default)s")
+    Parser.add_argument("--platform", choices=mapgen.Platforms,
+                        default=mapgen.DefaultPlatform,
+                        help="Default: %(default)s")
+    Parser.add_argument("--weighted", action="store_true",
+                        help="Find the easiest tiles instead: the lowest sum "
+                        "of the difficulties plus one per tile.")
+    Parser.add_argument("--greedy", action="store_true",
+                        help="Only pick the tiles greedily, without searching "
+                        "for the best plan.")
+    Parser.add_argument("--max-nodes", type=int, default=DefaultMaxNodes,
+                        help="Give up the search for the best plan after "
+                        "this many steps, with the best plan so far. "
+                        "Default: %(default)s")
+    Parser.add_argument("--list", action="store_true",
+                        help="List the loot items that contain any of the "
+                        "ITEMs (or all of them) with their number of tiles, "
+                        "and exit.")
+    Parser.add_argument("--json", action="store_true",
+                        help="Print the plan as JSON.")
+    Args = Parser.parse_args()
+
+    Start = time.perf_counter()
+    Index = LootIndex(mapgen.loadMaps(Args.xml), Args.platform)
+    LoadTime = time.perf_counter() - Start
+
+    if Args.list:
+        Names = set()
+        for Text in Args.items or [""]:
+            Names.update(Index.find(Text))
+        for Name in sorted(Names, key=str.lower):
+            print("{:4d} {}".format(
+                Index.Items[Name.lower()][1].bit_count(), Name))
+        return 0
+    if not Args.items:
+        Parser.error("No items given")
+
+    Start = time.perf_counter()
+    try:
+        Result, Greedy = planLoot(Index, Args.items, Args.weighted,
+                                  not Args.greedy, Args.max_nodes)
+    except KeyError as e:
+        Similar = Index.find(e.args[0])
+        Parser.error("No loot item {!r}{}".format(
+            e.args[0], "; did you mean: " + "; ".join(Similar[:5])
+            if Similar else ""))
+    PlanTime = time.perf_counter() - Start
+
+    if Args.json:
+        print(json.dumps(Result.json(), ensure_ascii=False, indent=2))
+    else:
+        for Tile in Result.json()["tiles"]:
+            print("{} {} (difficulty {}): {}".format(
+                Tile["map"], Tile["coordinate"], Tile["difficulty"],
+                "; ".join(Tile["items"])))
+    Summary = "{} tiles, difficulty {}".format(len(Result.Tiles),
+                                              Result.difficulty())
+    if not Args.greedy:
+        Summary += ", {} after {} nodes (greedy: {} tiles, difficulty " \
+            "{})".format("optimal" if Result.Proven else "not proven optimal",
+                         Result.Nodes, len(Greedy.Tiles), Greedy.difficulty())
+    print("{}; loaded in {:.0f} ms, planned in {:.1f} ms".format(
+        Summary, LoadTime * 1000, PlanTime * 1000), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
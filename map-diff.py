@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; -*-
+
+# Compare two versions of maps.xml tile by tile, and write the differences
+# as a patch. map-gen.py --patch uses it to update its previous output, and
+# logic.js to update a page that is already open.
+#
+# The patch is JSON:
+#
+#   {"base": SHA-1 of the old maps.xml, "result": SHA-1 of the new one,
+#    "maps": [titles of the maps with tiles, in order],
+#    "changes": {map title: {"tiles": {coordinate: tile or null},
+#                            "size": [columns, rows]}}}
+#
+# "maps" is only there if it changed. A tile is TileInfo.json() of the new
+# version, or null if the tile was removed. "size" is only there if the
+# grid of the map changed.
+
+import sys, os
+import json
+import time
+import hashlib
+import argparse
+import importlib
+
+import lxml.etree as Etree
+
+mapgen = importlib.import_module("map-gen")
+
+def nodeDigest(node):
+    return hashlib.sha1(Etree.tostring(node, with_tail=False)).digest()
+
+def gridSize(coords):
+    """Return [columns, rows] of the grid that holds `coords`."""
+    Cols = 0
+    Rows = 0
+    for Coord in coords:
+        Col, Row = mapgen.parseCoord(Coord)
+        Cols = max(Cols, Col)
+        Rows = max(Rows, Row)
+    return [Cols, Rows]
+
+def readDigests(xml_file):
+    """Return {map title: (digest of the map, {coordinate: digest of the
+    tile})}, in the order of `xml_file`.
+    """
+    Maps = {}
+    for MapNode in mapgen.iterMapNodes(xml_file):
+        Maps[MapNode.get("name")] = (
+            nodeDigest(MapNode),
+            {TileNode.get("coordinate"): nodeDigest(TileNode)
+             for TileNode in MapNode[0]})
+    return Maps
+
+def diffMaps(old_file, new_file):
+    """Return the patch from `old_file` to `new_file`. Each file is read
+    once, and only the digests of the old one are kept in memory.
+    """
+    Old = readDigests(old_file)
+    Changes = {}
+    Titles = []
+    for MapNode in mapgen.iterMapNodes(new_file):
+        Title = MapNode.get("name")
+        if len(MapNode[0]) > 0:
+            Titles.append(Title)
+        OldDigest, OldTiles = Old.get(Title, (None, {}))
+        if nodeDigest(MapNode) == OldDigest:
+            continue
+
+        Tiles = {}
+        Coords = []
+        for TileNode in MapNode[0]:
+            Coord = TileNode.get("coordinate")
+            Coords.append(Coord)
+            if OldTiles.get(Coord) != nodeDigest(TileNode):
+                Tiles[Coord] = mapgen.TileInfo.fromNode(TileNode).json()
+        Present = set(Coords)
+        for Coord in OldTiles:
+            if Coord not in Present:
+                Tiles[Coord] = None
+        if not Tiles:
+            continue
+        Change = {"tiles": Tiles}
+        Size = gridSize(Coords)
+        if Size != gridSize(OldTiles):
+            Change["size"] = Size
+        Changes[Title] = Change
+
+    Patch = {"base": mapgen.fileDigest(old_file),
+             "result": mapgen.fileDigest(new_file)}
+    if Titles != [Title for Title, (_, Tiles) in Old.items() if Tiles]:
+        Patch["maps"] = Titles
+    Patch["changes"] = Changes
+    return Patch
+
+def writePatch(patch, filename):
+    Temp = filename + ".tmp"
+    with open(Temp, 'w', encoding="utf-8") as f:
+        json.dump(patch, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(Temp, filename)
+
+def main():
+    Parser = argparse.ArgumentParser(
+        description="Write the tiles that differ between two versions of "
+        "maps.xml as a patch for map-gen.py --patch.")
+    Parser.add_argument("old", help="The previous maps.xml.")
+    Parser.add_argument("new", nargs="?", default="maps.xml",
+                        help="The current maps.xml. Default: %(default)s")
+    Parser.add_argument("-o", "--output", default="maps.patch.json",
+                        help="Patch file. Default: %(default)s")
+    Args = Parser.parse_args()
+
+    Start = time.perf_counter()
+    Patch = diffMaps(Args.old, Args.new)
+    Time = time.perf_counter() - Start
+    writePatch(Patch, Args.output)
+
+    Tiles = [Tile for Change in Patch["changes"].values()
+             for Tile in Change["tiles"].values()]
+    Removed = Tiles.count(None)
+    print("{} maps, {} tiles changed or added, {} removed in {:.0f} ms; "
+          "{}: {} bytes".format(len(Patch["changes"]), len(Tiles) - Removed,
+                                Removed, Time * 1000, Args.output,
+                                os.path.getsize(Args.output)),
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,32 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8; -*-
 
+import sys, os
+import io
+import re
+import json
 import typing
+import argparse
+import gzip
+import marshal
+import contextlib
+import itertools
+import concurrent.futures
+import unicodedata
+import hashlib
+import shutil
+import time
 import lxml.etree as Etree
 
+import profiling
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+Profile = profiling.Profiler()
+
 def safeInt(x):
     try:
         y = int(x)
@@ -25,9 +48,113 @@ qname = SvgQName()
 DiffiColors = ("#bdc3c7", "#27ae60", "#f1c40f", "#8e44ad", "#e67e22", "#2980b9",
                "#c0392b")
 
+# Attributes that are the same on every tile, and that logic.js never
+# changes, by class. With shared_style in TileInfo.nodeSvg(), they are left
+# out, and sharedSvgCss() sets them instead.
+SharedSvgStyle = {"TileText": {"font-family": '"IBM Plex Mono", "Source Code '
+                               'Pro", Inconsolata, Consolas, monospace',
+                               "font-size": "12px",
+                               "text-anchor": "middle"},
+                  "TileBtn": {"fill": "transparent"}}
+
+CoordPattern = re.compile("([A-Z]+)([0-9]+)$")
+
+def parseCoord(coord):
+    """Return (column, row) of a coordinate like "B3" or "AA12", starting
+    from 1. Columns go from A to Z, then AA, AB...
+    """
+    Match = CoordPattern.match(coord)
+    if Match is None:
+        raise ValueError("Not a coordinate: " + coord)
+    Col = 0
+    for Char in Match.group(1):
+        Col = Col * 26 + ord(Char) - ord('A') + 1
+    return (Col, int(Match.group(2)))
+
+class GridLayout(object):
+    """Positions in the SVG of a map with `cols` x `rows` cells, computed
+    once per column and per row, as the strings that go in the attributes.
+    The lists are indexed by the column or row number, starting from 1.
+    """
+    def __init__(self, cols, rows, cell_width, cell_height):
+        self.CellWidth = str(cell_width)
+        self.CellHeight = str(cell_height)
+        Cols = range(1, cols + 1)
+        Rows = range(1, rows + 1)
+        # Top-left corners of the cells
+        self.CellX = [None] + [str((Col - 1) * cell_width + 0.5) for Col in Cols]
+        self.CellY = [None] + [str((Row - 1) * cell_height + 0.5) for Row in Rows]
+        # Anchors of the labels
+        self.TextX = [None] + [str((Col - 0.5) * cell_width) for Col in Cols]
+        self.TextY = [None] + [str((Row - 0.5) * cell_height + 5) for Row in Rows]
+
+Platforms = ("switch", "3ds")
+DefaultPlatform = "switch"
+PlatformNames = {"switch": "Switch", "3ds": "3DS"}
+
+class PlatformValues(dict):
+    """The value of a tile field that differs by platform, keyed by the
+    platform name.
+    """
+    __slots__ = ()
+
+def platformValue(value, platform):
+    """Return `value` with the PlatformValues in it resolved for
+    `platform`.
+    """
+    if type(value) is PlatformValues:
+        return value.get(platform)
+    if type(value) is list:
+        return [platformValue(Item, platform) for Item in value]
+    return value
+
+SnapshotMagic = b"HWSNAP3\n"
+
+def tableIndex(value, index, values):
+    """Return `value` with every str or int in it replaced by its position in
+    the value table `values`. `index` maps the values already in the table to
+    their positions.
+    """
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return tuple(tableIndex(Item, index, values) for Item in value)
+    if isinstance(value, PlatformValues):
+        return {Platform: tableIndex(Value, index, values)
+                for Platform, Value in value.items()}
+    Key = (type(value), value)
+    Pos = index.get(Key)
+    if Pos is None:
+        Pos = index[Key] = len(values)
+        values.append(value)
+    return Pos
+
+def tableValue(pos, values):
+    """Reverse of tableIndex()."""
+    if pos is None:
+        return None
+    if isinstance(pos, tuple):
+        return [tableValue(Item, values) for Item in pos]
+    if isinstance(pos, dict):
+        return PlatformValues((Platform, tableValue(Value, values))
+                              for Platform, Value in pos.items())
+    return values[pos]
+
 class TileInfo(object):
+    # The fields in records. Col and Row are parsed from Coord.
+    Fields = ("Coord", "Mission", "LootA", "LootV", "KoA", "TimeA", "DamageA",
+              "Treasure", "Difficulty")
+    __slots__ = Fields + ("Col", "Row")
+    # The fields other than Coord, with their tags in maps.xml
+    JsonKeys = (("Mission", "mission"), ("LootV", "loot-v"),
+                ("Treasure", "treasure"), ("LootA", "loot-a"), ("KoA", "ko-a"),
+                ("TimeA", "time-a"), ("DamageA", "damage-a"),
+                ("Difficulty", "difficulty"))
+
     def __init__(self):
         self.Coord = ""         # 1-based
+        self.Col = 0
+        self.Row = 0
         self.Mission = ""
         self.LootA = None
         self.LootV = None
@@ -37,12 +164,6 @@ class TileInfo(object):
         self.Treasure = None
         self.Difficulty = 0
 
-    @property
-    def CoordNum(self):
-        """(Column, row) in number (starting from 1)."""
-        return (ord(self.Coord[0]) - ord('A') + 1,
-                int(self.Coord[1]))
-
     @classmethod
     def fromNode(cls, node):
         def processSubNode(subnode):
@@ -56,18 +177,27 @@ class TileInfo(object):
                 # This node has subnode. It could be a platform-specific value,
                 # or multiple items.
                 if subnode[0].tag == "platform-specific":
-                    Node = subnode.xpath('platform-specific/'
-                                         'platform[@name = "switch"]')
-                    if Node:
-                        return processSubNode(Node[0])
+                    Values = PlatformValues()
+                    for Node in subnode[0]:
+                        if Node.tag == "platform":
+                            Values.setdefault(Node.get("name"),
+                                              processSubNode(Node))
+                    return Values
 
                 elif subnode[0].tag == "item":
                     return [processSubNode(ItemNode) for ItemNode in subnode]
                 else:
                     return None
 
+        def intValue(value):
+            if type(value) is PlatformValues:
+                return PlatformValues((Platform, safeInt(Value))
+                                      for Platform, Value in value.items())
+            return safeInt(value)
+
         Tile = cls()
         Tile.Coord = node.get("coordinate")
+        Tile.Col, Tile.Row = parseCoord(Tile.Coord)
         for SubNode in node:
             if SubNode.tag == "mission":
                 Tile.Mission = processSubNode(SubNode)
@@ -78,53 +208,115 @@ class TileInfo(object):
             elif SubNode.tag == "treasure":
                 Tile.Treasure = processSubNode(SubNode)
             elif SubNode.tag == "ko-a":
-                Tile.KoA = safeInt(processSubNode(SubNode))
+                Tile.KoA = intValue(processSubNode(SubNode))
             elif SubNode.tag == "time-a":
                 Tile.TimeA = processSubNode(SubNode)
             elif SubNode.tag == "damage-a":
-                Tile.DamageA = safeInt(processSubNode(SubNode))
+                Tile.DamageA = intValue(processSubNode(SubNode))
             elif SubNode.tag == "difficulty":
                 Tile.Difficulty = int(processSubNode(SubNode))
         return Tile
 
-    def nodeSvg(self, cell_width, cell_height, map_name):
+    def record(self, index, values):
+        """Return the tile as a tuple of value table positions. See
+        tableIndex().
+        """
+        return tuple(tableIndex(getattr(self, Name), index, values)
+                     for Name in self.Fields)
+
+    @classmethod
+    def fromRecord(cls, record, values):
+        Tile = cls.__new__(cls)
+        (Tile.Coord, Tile.Mission, Tile.LootA, Tile.LootV, Tile.KoA, Tile.TimeA,
+         Tile.DamageA, Tile.Treasure, Tile.Difficulty) = [
+             values[Pos] if type(Pos) is int else tableValue(Pos, values)
+             for Pos in record]
+        Tile.Col, Tile.Row = parseCoord(Tile.Coord)
+        return Tile
+
+    def json(self):
+        """Return the fields other than Coord, keyed by their tags in
+        maps.xml. A value that differs by platform is an object keyed by the
+        platform.
+        """
+        return {Key: getattr(self, Name) for Name, Key in self.JsonKeys}
+
+    def lootItems(self):
+        """Return the distinct items in the loot and treasure of a tile with
+        the values of one platform (see forPlatform()), in field order.
+        """
+        Items = []
+        for Value in (self.LootV, self.Treasure, self.LootA):
+            if Value is None:
+                continue
+            if not isinstance(Value, list):
+                Value = [Value,]
+            for Item in Value:
+                if Item is not None and str(Item) not in Items:
+                    Items.append(str(Item))
+        return Items
+
+    def forPlatform(self, platform):
+        """Return a copy of the tile with the values for `platform`."""
+        Tile = TileInfo.__new__(TileInfo)
+        for Name in self.__slots__:
+            setattr(Tile, Name, platformValue(getattr(self, Name), platform))
+        return Tile
+
+    def nodeSvg(self, layout, map_name, shared_style=False):
+        """`layout` is the GridLayout of the map. With `shared_style`, the
+        attributes in SharedSvgStyle are left out.
+        """
         TileNode = Etree.Element(qname('g'))
         RectNode = Etree.SubElement(
             TileNode, qname('rect'),
 
             fill=DiffiColors[self.Difficulty],
-            x=str((self.CoordNum[0] - 1) * cell_width + 0.5),
-            y=str((self.CoordNum[1] - 1) * cell_height + 0.5),
-            width=str(cell_width),
-            height=str(cell_height))
+            x=layout.CellX[self.Col],
+            y=layout.CellY[self.Row],
+            width=layout.CellWidth,
+            height=layout.CellHeight)
         RectNode.set("class", "TileBG")
         RectNode.set("id", "TileBG-{}-{}".format(map_name, self.Coord))
 
         TextNode = Etree.SubElement(
             TileNode, qname("text"),
-            x=str((self.CoordNum[0] - 0.5) * cell_width),
-            y=str((self.CoordNum[1] - 0.5) * cell_height + 5),
+            x=layout.TextX[self.Col],
+            y=layout.TextY[self.Row],
             fill="white")
         TextNode.text = self.Coord
         TextNode.set("class", "TileText")
         TextNode.set("id", "TileText-{}-{}".format(map_name, self.Coord))
-        TextNode.set("font-family", '"IBM Plex Mono", "Source Code Pro", '
-                     'Inconsolata, Consolas, monospace')
-        TextNode.set("font-weight", 'normal')
-        TextNode.set("font-size", "12")
-        TextNode.set("text-anchor", "middle")
+        if shared_style:
+            TextNode.set("font-weight", 'normal')
+        else:
+            TextNode.set("font-family", '"IBM Plex Mono", "Source Code Pro", '
+                         'Inconsolata, Consolas, monospace')
+            TextNode.set("font-weight", 'normal')
+            TextNode.set("font-size", "12")
+            TextNode.set("text-anchor", "middle")
 
-        BtnNode = Etree.SubElement(
-            TileNode, qname('rect'),
-            fill="transparent",
-            x=str((self.CoordNum[0] - 1) * cell_width + 0.5),
-            y=str((self.CoordNum[1] - 1) * cell_height + 0.5),
-            width=str(cell_width),
-            height=str(cell_height))
+        BtnNode = Etree.SubElement(TileNode, qname('rect'))
+        if not shared_style:
+            BtnNode.set("fill", "transparent")
+        BtnNode.set("x", layout.CellX[self.Col])
+        BtnNode.set("y", layout.CellY[self.Row])
+        BtnNode.set("width", layout.CellWidth)
+        BtnNode.set("height", layout.CellHeight)
         BtnNode.set("class", "TileBtn")
         BtnNode.set("id", "TileBtn-{}-{}".format(map_name, self.Coord))
         return TileNode
 
+    def compactSvg(self, layout):
+        """The label of the tile in the compact rendering. Its style comes from
+        CSS, and its class tells the difficulty.
+        """
+        TextNode = Etree.Element(
+            qname("text"), x=layout.TextX[self.Col], y=layout.TextY[self.Row])
+        TextNode.set("class", "D{}".format(self.Difficulty))
+        TextNode.text = self.Coord
+        return TextNode
+
     def html(self, map_name):
         Lines = ["<div>",]
         Lines.append("<h2>{} Map {}</h2>".format(map_name, self.Coord))
@@ -148,6 +340,8 @@ class TileInfo(object):
         return Lines
 
 class MapInfo(object):
+    __slots__ = ("Tiles", "Title", "Cols", "Rows")
+
     def __init__(self):
         self.Tiles = {}
         self.Title = ""
@@ -157,16 +351,52 @@ class MapInfo(object):
     def addTile(self, tile: TileInfo):
         self.Tiles[tile.Coord] = tile
 
-        if tile.CoordNum[0] > self.Cols:
-            self.Cols = tile.CoordNum[0]
-        if tile.CoordNum[1] > self.Rows:
-            self.Rows = tile.CoordNum[1]
+        if tile.Col > self.Cols:
+            self.Cols = tile.Col
+        if tile.Row > self.Rows:
+            self.Rows = tile.Row
 
         return self
 
-    def genSvg(self):
+    @classmethod
+    def fromNode(cls, node):
+        Map = cls()
+        Map.Title = node.get("name")
+        for TileNode in node[0]:
+            Map.addTile(TileInfo.fromNode(TileNode))
+        return Map
+
+    def record(self, index, values):
+        return (self.Title, self.Cols, self.Rows,
+                tuple(Tile.record(index, values) for Tile in self.Tiles.values()))
+
+    @classmethod
+    def fromRecord(cls, record, values):
+        Map = cls()
+        Map.Title, Map.Cols, Map.Rows, Tiles = record
+        for TileRecord in Tiles:
+            Tile = TileInfo.fromRecord(TileRecord, values)
+            Map.Tiles[Tile.Coord] = Tile
+        return Map
+
+    def forPlatform(self, platform):
+        """Return a copy of the map with the values for `platform`. The maps
+        loaded from maps.xml have the values of all platforms, and have to
+        be resolved before rendering.
+        """
+        Map = MapInfo()
+        Map.Title = self.Title
+        Map.Cols = self.Cols
+        Map.Rows = self.Rows
+        for Coord, Tile in self.Tiles.items():
+            Map.Tiles[Coord] = Tile.forPlatform(platform)
+        return Map
+
+    def genSvg(self, compact=False, shared_style=False):
         CellWidth = 30
         CellHeight = 20
+        if compact:
+            return self.genCompactSvg(CellWidth, CellHeight)
 
         Root = Etree.Element(qname("svg"), nsmap=qname.NsMap)
         Root.set("version", "1.1")
@@ -174,9 +404,11 @@ class MapInfo(object):
         Root.set("width", str(CellWidth * self.Cols + 1))
         Root.set("id", "Map-" + self.Title)
 
+        Layout = GridLayout(self.Cols, self.Rows, CellWidth, CellHeight)
         TileGroup = Etree.SubElement(Root, qname('g'))
         for Coord in self.Tiles:
-            TileNode = self.Tiles[Coord].nodeSvg(CellWidth, CellHeight, self.Title)
+            TileNode = self.Tiles[Coord].nodeSvg(Layout, self.Title,
+                                                 shared_style)
             TileGroup.append(TileNode)
 
         OutlineGroup = Etree.SubElement(Root, qname('g'))
@@ -209,36 +441,835 @@ class MapInfo(object):
 
         return Root
 
-def genHtml():
-    def tableRow(lines, key, value):
-        if value is None:
-            return
-
-        if key is not None:
-            lines.append('<tr><th>{}</th><td>'.format(key))
-
-        if isinstance(value, (list, tuple)):
-            lines.append('<ul>')
-            for Item in value:
-                lines.append('<li>')
-                tableRow(lines, None, Item)
-                lines.append('</li>')
-            lines.append('</ul>')
+    def genCompactSvg(self, cell_width, cell_height):
+        """One <text> per tile. The backgrounds are one <path> per
+        difficulty, and the grid is one <path>. logic.js handles the events on
+        the <svg> itself.
+        """
+        Root = Etree.Element(qname("svg"), nsmap=qname.NsMap)
+        Root.set("version", "1.1")
+        Root.set("height", str(cell_height * self.Rows + 1))
+        Root.set("width", str(cell_width * self.Cols + 1))
+        Root.set("id", "Map-" + self.Title)
+        Root.set("class", "CompactMap")
+        Root.set("data-cell", "{} {}".format(cell_width, cell_height))
+
+        Layout = GridLayout(self.Cols, self.Rows, cell_width, cell_height)
+        Backgrounds = {}
+        Cell = "h{0}v{1}h-{0}z".format(cell_width, cell_height)
+        for Tile in self.Tiles.values():
+            Backgrounds.setdefault(Tile.Difficulty, []).append(
+                "M" + Layout.CellX[Tile.Col] + " " + Layout.CellY[Tile.Row] +
+                Cell)
+        BgGroup = Etree.SubElement(Root, qname('g'))
+        for Difficulty in sorted(Backgrounds):
+            Path = Etree.SubElement(BgGroup, qname("path"),
+                                    d="".join(Backgrounds[Difficulty]))
+            Path.set("class", "D{}".format(Difficulty))
+
+        Cursor = Etree.SubElement(Root, qname("rect"), width=str(cell_width),
+                                  height=str(cell_height))
+        Cursor.set("class", "Cursor")
+
+        TileGroup = Etree.SubElement(Root, qname('g'))
+        TileGroup.set("class", "Tiles")
+        for Tile in self.Tiles.values():
+            TileGroup.append(Tile.compactSvg(Layout))
+
+        Grid = ["M0.5 0.5h{}v{}h-{}z".format(
+            self.Cols * cell_width, self.Rows * cell_height,
+            self.Cols * cell_width)]
+        for Col in range(1, self.Cols):
+            Grid.append("M{} 0.5v{}".format(Col * cell_width + 0.5,
+                                            self.Rows * cell_height))
+        for Row in range(1, self.Rows):
+            Grid.append("M0.5 {}h{}".format(Row * cell_height + 0.5,
+                                            self.Cols * cell_width))
+        Outline = Etree.SubElement(Root, qname("path"), d="".join(Grid))
+        Outline.set("class", "Grid")
+        return Root
+
+def difficultyCss():
+    """Colors of the difficulty classes in the compact rendering."""
+    Rules = []
+    for Difficulty, Color in enumerate(DiffiColors):
+        Rules.append("svg.CompactMap path.D{0}, svg.CompactMap text.Active.D{0} "
+                     "{{ fill: {1}; }}".format(Difficulty, Color))
+    return '\n'.join(Rules)
+
+def sharedSvgCss():
+    """CSS rules for SharedSvgStyle."""
+    Rules = []
+    for Class, Style in SharedSvgStyle.items():
+        Rules.append("svg .{} {{ {} }}".format(Class, " ".join(
+            "{}: {};".format(Name, Value) for Name, Value in Style.items())))
+    return '\n'.join(Rules)
+
+def minifyCss(css):
+    """Remove comments and the whitespace that does not matter."""
+    Css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    Css = re.sub(r"\s+", " ", Css)
+    Css = re.sub(r" ?([{};,>]) ?", r"\1", Css)
+    Css = Css.replace(": ", ":").replace(";}", "}")
+    return Css.strip()
+
+# Characters after which a "/" starts a regular expression in JavaScript,
+# not a division.
+JsRegexPrefix = set("(,=:[!&|?{};+-*%<>~^")
+
+def minifyJs(code):
+    """Remove comments, indentation and blank lines. Line breaks are kept, so
+    automatic semicolon insertion does not change.
+    """
+    Out = []
+    Last = ""                   # Last character written, other than spaces
+
+    def space(sep):
+        """Write a space or a line break, merged with the previous one."""
+        if Out and Out[-1] == " " and sep == "\n":
+            Out[-1] = sep
+        elif not Out or Out[-1] not in (" ", "\n"):
+            Out.append(sep)
+
+    i = 0
+    while i < len(code):
+        Char = code[i]
+        if Char in "'\"`":
+            End = i + 1
+            while End < len(code) and code[End] != Char:
+                End += 2 if code[End] == "\\" else 1
+            Out.append(code[i:End + 1])
+            Last = Char
+            i = End + 1
+        elif code.startswith("//", i):
+            End = code.find("\n", i)
+            i = len(code) if End < 0 else End
+        elif code.startswith("/*", i):
+            End = code.find("*/", i + 2)
+            i = len(code) if End < 0 else End + 2
+            space(" ")
+        elif Char == "/" and (Last == "" or Last in JsRegexPrefix):
+            End = i + 1
+            InClass = False
+            while End < len(code) and (code[End] != "/" or InClass):
+                if code[End] == "\\":
+                    End += 1
+                elif code[End] == "[":
+                    InClass = True
+                elif code[End] == "]":
+                    InClass = False
+                End += 1
+            End += 1
+            while End < len(code) and code[End].isalpha():
+                End += 1
+            Out.append(code[i:End])
+            Last = "/"
+            i = End
+        elif Char.isspace():
+            End = i
+            while End < len(code) and code[End].isspace():
+                End += 1
+            space("\n" if "\n" in code[i:End] else " ")
+            i = End
         else:
-            lines.append(str(value))
+            Out.append(Char)
+            Last = Char
+            i += 1
+    return "".join(Out).strip()
+
+def minifyMarkup(text):
+    """Collapse whitespace in markup where it does not matter."""
+    return re.sub(r">\s+<", "><", re.sub(r"\s+", " ", text)).strip()
+
+def compressFile(filename):
+    """Write deterministic gzip and (if the brotli module is installed) brotli
+    versions of a file next to it. Return {extension: size}.
+    """
+    with open(filename, 'rb') as f:
+        Data = f.read()
+    Sizes = {}
+    with open(filename + ".gz", 'wb') as f:
+        with gzip.GzipFile(filename="", mode="wb", compresslevel=9,
+                           fileobj=f, mtime=0) as Gzip:
+            Gzip.write(Data)
+    Sizes[".gz"] = os.path.getsize(filename + ".gz")
+    if brotli is not None:
+        with open(filename + ".br", 'wb') as f:
+            f.write(brotli.compress(Data, quality=11))
+        Sizes[".br"] = os.path.getsize(filename + ".br")
+    return Sizes
 
-        if key is not None:
-            lines.append('</td></tr>')
+def iterMapNodes(source):
+    """Yield each <map> element in `source` as soon as it is parsed.
+
+    Finished <map> elements are cleared and dropped from the partial tree,
+    so memory is bounded by the largest map, not the whole file.
+    """
+    for _, MapNode in Etree.iterparse(source, events=("end",), tag="map"):
+        yield MapNode
+        MapNode.clear()
+        while MapNode.getprevious() is not None:
+            del MapNode.getparent()[0]
+
+def iterMaps(source):
+    """Yield a MapInfo for each <map> in `source` as soon as it is parsed."""
+    for MapNode in iterMapNodes(source):
+        yield MapInfo.fromNode(MapNode)
+
+def snapshotFileName(xml_file):
+    """Return the default snapshot file of `xml_file`: maps.snapshot for
+    maps.xml.
+    """
+    return os.path.splitext(xml_file)[0] + ".snapshot"
+
+def sourceStamp(xml_file):
+    """Return what a snapshot records of the file it was made from: its
+    absolute path, size and SHA-1. The modification time is not enough, as
+    a file can be rewritten within its resolution.
+    """
+    return (os.path.abspath(xml_file), os.path.getsize(xml_file),
+            fileDigest(xml_file))
+
+def writeSnapshot(filename, source, values, records):
+    """Write the value table and the map records to a snapshot file, after
+    `source`, the sourceStamp() of the XML file. The file is replaced
+    atomically, and nothing is left behind if that fails.
+    """
+    Temp = filename + ".tmp"
+    try:
+        with open(Temp, 'wb') as f:
+            f.write(SnapshotMagic)
+            marshal.dump(source, f)
+            marshal.dump((values, records), f)
+        os.replace(Temp, filename)
+    except OSError:
+        if os.path.isfile(Temp):
+            os.remove(Temp)
+        raise
+
+def readSnapshot(filename, source=None):
+    """Return (values, records) from a snapshot file. Raise ValueError if the
+    file is not a snapshot of this format, or if `source` is given and the
+    snapshot was made from another file or another version of it.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(SnapshotMagic)) != SnapshotMagic:
+            raise ValueError("Not a snapshot: " + filename)
+        try:
+            Source = marshal.load(f)
+            if source is not None and Source != source:
+                raise ValueError("Stale snapshot: " + filename)
+            return marshal.load(f)
+        except (EOFError, TypeError) as e:
+            raise ValueError("Corrupted snapshot: " + filename) from e
+
+def loadMaps(xml_file="maps.xml", snapshot_file=None):
+    """Yield a MapInfo for each map. The maps are loaded from the snapshot
+    (by default the snapshotFileName() of `xml_file`), unless it is missing,
+    broken or made from another file or another version of it. In that case
+    they are parsed from `xml_file`, and the snapshot is rewritten after the
+    last map.
+    """
+    if snapshot_file is None:
+        snapshot_file = snapshotFileName(xml_file)
+    Source = sourceStamp(xml_file)
+    Snapshot = None
+    try:
+        Snapshot = readSnapshot(snapshot_file, Source)
+    except (OSError, ValueError):
+        pass
+
+    if Snapshot is not None:
+        Values, Records = Snapshot
+        for Record in Records:
+            yield MapInfo.fromRecord(Record, Values)
+        return
+
+    Index = {}
+    Values = []
+    Records = []
+    for Map in iterMaps(xml_file):
+        Records.append(Map.record(Index, Values))
+        yield Map
+    # The snapshot is only a cache: the maps are loaded without it.
+    try:
+        writeSnapshot(snapshot_file, Source, Values, Records)
+    except OSError as e:
+        print("Cannot write the snapshot: {}".format(e), file=sys.stderr)
+
+TokenPattern = re.compile("[a-z0-9]+")
+
+def searchTokens(text):
+    """Split `text` into lowercase alphanumeric tokens, with accents removed.
+    logic.js normalizes the search query the same way.
+    """
+    Text = unicodedata.normalize("NFKD", text)
+    Text = "".join(Char for Char in Text
+                   if not unicodedata.category(Char).startswith("M"))
+    return TokenPattern.findall(Text.lower())
+
+class SearchIndex(object):
+    """Inverted index from the tokens of the mission, loot and treasure of the
+    tiles to the tiles, for the search box in logic.js, and from the loot
+    items to the tiles, for its loot planner.
+    """
+    def __init__(self):
+        self.Maps = []
+        self.Tiles = []         # [(map index, coordinate, difficulty)]
+        self.Postings = {}      # token -> [tile index]
+        self.Loot = {}          # item -> [tile index]
+
+    def addMap(self, map_info: MapInfo):
+        """Add a map with the values of one platform."""
+        MapIndex = len(self.Maps)
+        self.Maps.append(map_info.Title)
+        for Tile in map_info.Tiles.values():
+            TileIndex = len(self.Tiles)
+            self.Tiles.append((MapIndex, Tile.Coord, Tile.Difficulty))
+            for Item in Tile.lootItems():
+                self.Loot.setdefault(Item, []).append(TileIndex)
+            for Value in (Tile.Mission, Tile.LootV, Tile.Treasure, Tile.LootA):
+                if Value is None:
+                    continue
+                if not isinstance(Value, list):
+                    Value = [Value,]
+                for Item in Value:
+                    if Item is None:
+                        continue
+                    for Token in searchTokens(str(Item)):
+                        Posting = self.Postings.setdefault(Token, [])
+                        if not Posting or Posting[-1] != TileIndex:
+                            Posting.append(TileIndex)
+        return self
 
-    Lines = ["<!DOCTYPE html>",]
+    def extend(self, other):
+        """Append the maps of SearchIndex `other`, as if they were added
+        here.
+        """
+        MapOffset = len(self.Maps)
+        TileOffset = len(self.Tiles)
+        self.Maps.extend(other.Maps)
+        self.Tiles.extend((MapIndex + MapOffset, Coord, Difficulty)
+                          for MapIndex, Coord, Difficulty in other.Tiles)
+        for Postings, OtherPostings in ((self.Postings, other.Postings),
+                                        (self.Loot, other.Loot)):
+            for Key, Posting in OtherPostings.items():
+                Postings.setdefault(Key, []).extend(
+                    TileIndex + TileOffset for TileIndex in Posting)
+        return self
+
+    def json(self):
+        """Return the index without the loot as compact JSON, safe to embed
+        in a <script>. The search box only needs this part.
+        """
+        return scriptJson({"maps": self.Maps, "tiles": self.Tiles,
+                           "tokens": self.Postings})
+
+    def lootJson(self):
+        """Return the loot postings as json() does, for the loot planner,
+        which loads them on its first use.
+        """
+        return scriptJson(self.Loot)
+
+def scriptJson(value):
+    """Return `value` as compact JSON, safe to embed in a <script>."""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'),
+                      sort_keys=True).replace("</", "<\\/")
+
+def mapFileName(title):
+    return re.sub("[^A-Za-z0-9]+", "-", title)
+
+def fingerprintedName(path, data):
+    """Return `path` with the start of the SHA-1 of `data` before its
+    extension, e.g. style.0123456789.css. The file of such a name never
+    changes, so it can be cached for good.
+    """
+    Root, Ext = os.path.splitext(path)
+    return "{}.{}{}".format(Root, hashlib.sha1(data).hexdigest()[:10], Ext)
+
+def writeAsset(open_fragment, path, data, fingerprint=True):
+    """Write the bytes `data` to the file `path` (or its fingerprinted
+    name) with `open_fragment`. Return the path it was written to.
+    """
+    if fingerprint:
+        path = fingerprintedName(path, data)
+    with open_fragment(path) as f:
+        f.write(data)
+    return path
+
+class HtmlWriter(object):
+    """Write lines of text to a binary stream as UTF-8, as '\\n'.join() would
+    join them. Lines are written in chunks of about `chunk_size` characters;
+    call flush() at the end. With `minify`, there is nothing between the
+    lines, and XML is not indented. With `started`, the writer continues
+    the output of another one, and the first line is separated too.
+    """
+    def __init__(self, stream, chunk_size=65536, minify=False, started=False):
+        self.Stream = stream
+        self.ChunkSize = chunk_size
+        self.Minify = minify
+        self.Chunk = []
+        self.ChunkLength = 0
+        self.Started = started
+
+    def append(self, text):
+        if self.Started and not self.Minify:
+            self.Chunk.append('\n')
+        self.Started = True
+        self.Chunk.append(text)
+        self.ChunkLength += len(text) + 1
+        if self.ChunkLength >= self.ChunkSize:
+            self.flush()
+
+    def appendXml(self, node):
+        """Serialize `node` pretty-printed, without building the string."""
+        self.append("")
+        self.flush()
+        with Etree.xmlfile(self.Stream, encoding="utf-8") as XmlFile:
+            XmlFile.write(node, pretty_print=not self.Minify)
+
+    def appendEncoded(self, data):
+        """Write `data` as it is. It should be the output of a writer with
+        the same `minify`, created with `started` if this one has started.
+        """
+        self.flush()
+        self.Stream.write(data)
+
+    def flush(self):
+        self.Stream.write(''.join(self.Chunk).encode("utf-8"))
+        self.Chunk = []
+        self.ChunkLength = 0
+
+def tableRow(lines, key, value):
+    if value is None:
+        return
+
+    if key is not None:
+        lines.append('<tr><th>{}</th><td>'.format(key))
+
+    if isinstance(value, (list, tuple)):
+        lines.append('<ul>')
+        for Item in value:
+            lines.append('<li>')
+            tableRow(lines, None, Item)
+            lines.append('</li>')
+        lines.append('</ul>')
+    else:
+        lines.append(str(value))
+
+    if key is not None:
+        lines.append('</td></tr>')
+
+def mapContent(map_info, lines, compact=False, minify=False):
+    """Append the SVG and the tile tables of a map to `lines`. Return
+    the SVG.
+    """
+    with Profile.section("genSvg", map_info.Title) as Sec:
+        Svg = map_info.genSvg(compact, minify)
+        Sec.tree = Svg
+    with Profile.section("writeSvg", map_info.Title):
+        lines.append('<div class="SvgWrapper">')
+        lines.appendXml(Svg)
+        lines.append('</div>')
+    with Profile.section("tileTables", map_info.Title):
+        lines.append('<div class="TilesWrapper">')
+        for Coord in map_info.Tiles:
+            Tile = map_info.Tiles[Coord]
+            lines.append('<div id="Tile-{}-{}" class="TileWrapper">'.format(
+                map_info.Title, Tile.Coord))
+            lines.append('<h3 class="TileTitle">{}</h3>'.format(Tile.Coord))
+            lines.append('<table id="TileData-{}-{}">'.format(map_info.Title, Tile.Coord))
+            lines.append('<tbody>')
+            tableRow(lines, "Mission", Tile.Mission)
+            tableRow(lines, "Loot", Tile.LootV)
+            tableRow(lines, "Treasure", Tile.Treasure)
+            tableRow(lines, "A-rank loot", Tile.LootA)
+            tableRow(lines, "A-rank KO", Tile.KoA)
+            tableRow(lines, "A-rank time", Tile.TimeA)
+            tableRow(lines, "A-rank damage", Tile.DamageA)
+            lines.append('</tbody>')
+            lines.append('</table>')
+            lines.append('</div>')
+        lines.append('</div>')
+    return Svg
+
+
+def renderMap(lines, map_info, split_dir=None, compact=False,
+              open_fragment=None, minify=False, fingerprint=False):
+    """Append the part of the page for a map to `lines`. With `split_dir`,
+    the content goes in a file of its own; return its path then. With
+    `fingerprint`, the name of the file has the hash of its content.
+    """
+    if split_dir is None:
+        lines.append('<div id="MapWrapper-{}" class="MapWrapper">'.format(map_info.Title))
+        lines.append('<h2>{}</h2>'.format(map_info.Title + " Map"))
+        mapContent(map_info, lines, compact, minify)
+        FileName = None
+    else:
+        Buffer = io.BytesIO()
+        Writer = HtmlWriter(Buffer, minify=minify)
+        Svg = mapContent(map_info, Writer, compact, minify)
+        Writer.flush()
+        FileName = "{}/{}.html".format(split_dir, mapFileName(map_info.Title))
+        FileName = writeAsset(open_fragment, FileName, Buffer.getvalue(),
+                              fingerprint)
+        lines.append('<div id="MapWrapper-{}" class="MapWrapper" '
+                     'data-src="{}">'.format(map_info.Title, FileName))
+        lines.append('<h2>{}</h2>'.format(map_info.Title + " Map"))
+        lines.append('<div class="SvgWrapper" style="width: {}px; '
+                     'height: {}px;"></div>'.format(Svg.get("width"),
+                                                     Svg.get("height")))
+    lines.append('</div>')
+    return FileName
+
+def renderMapData(map_info, split_dir=None, compact=False, minify=False,
+                  platform=DefaultPlatform, fingerprint=False):
+    """Render a map on its own, for the page of `platform`. Return the
+    encoded part of the page, its SearchIndex, and the path and the content
+    of its file (None without `split_dir`). The part of the page goes in an
+    HtmlWriter that has started with HtmlWriter.appendEncoded().
+    """
+    Map = map_info.forPlatform(platform)
+    Files = {}
+
+    @contextlib.contextmanager
+    def openFragment(path):
+        Buffer = io.BytesIO()
+        yield Buffer
+        Files[path] = Buffer.getvalue()
+
+    Buffer = io.BytesIO()
+    Writer = HtmlWriter(Buffer, minify=minify, started=True)
+    FileName = renderMap(Writer, Map, split_dir, compact, openFragment, minify,
+                         fingerprint)
+    Writer.flush()
+    return (Buffer.getvalue(), SearchIndex().addMap(Map), FileName,
+            Files.get(FileName))
+
+def renderMaps(lines, index, split_dir=None, compact=False, open_fragment=None,
+               minify=False, platform=DefaultPlatform, fingerprint=False,
+               maps=None, pool=None):
+    """Append every map to `lines` and to the SearchIndex `index`, with the
+    values for `platform`. `maps` are the MapInfo objects to render; by
+    default they are loaded from maps.xml. With `pool`, a
+    concurrent.futures executor, the maps are rendered by renderMapData()
+    in the pool, and `lines` has to be an HtmlWriter. Return the paths of
+    the map files.
+    """
+    if maps is None:
+        maps = Profile.iterate("loadMap", loadMaps("maps.xml"),
+                               lambda Map: Map.Title)
+    Fragments = []
+    if pool is not None:
+        Results = pool.map(renderMapData,
+                           (Map for Map in maps if len(Map.Tiles) > 0),
+                           itertools.repeat(split_dir),
+                           itertools.repeat(compact),
+                           itertools.repeat(minify),
+                           itertools.repeat(platform),
+                           itertools.repeat(fingerprint))
+        for Data, MapIndex, FileName, FileData in Results:
+            index.extend(MapIndex)
+            lines.appendEncoded(Data)
+            if FileName is not None:
+                with open_fragment(FileName) as f:
+                    f.write(FileData)
+                Fragments.append(FileName)
+        return Fragments
+
+    for Map in maps:
+        if len(Map.Tiles) <= 0:
+            continue
+        Map = Map.forPlatform(platform)
+        with Profile.section("searchIndex", Map.Title):
+            index.addMap(Map)
+        FileName = renderMap(lines, Map, split_dir, compact, open_fragment,
+                             minify, fingerprint)
+        if FileName is not None:
+            Fragments.append(FileName)
+    return Fragments
+
+def fileStamp(filename):
+    """Return something that changes when file `filename` is written, or
+    None if it is missing.
+    """
+    try:
+        Stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (Stat.st_mtime_ns, Stat.st_size)
+
+def fileDigest(filename):
+    """Return the SHA-1 of the content of file `filename`, in hex."""
+    Hash = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for Chunk in iter(lambda: f.read(1 << 20), b""):
+            Hash.update(Chunk)
+    return Hash.hexdigest()
+
+class MapCache(object):
+    """The rendered maps, for rebuilding the page repeatedly. Its
+    renderMaps() takes the place of the module-level one. A map is rendered
+    only if the hash of its <map> element is new, and maps.xml is not parsed
+    at all if it is unchanged.
+    """
+    def __init__(self, xml_file="maps.xml"):
+        self.XmlFile = xml_file
+        self.Stamp = None
+        self.Options = None
+        self.Keys = []
+        self.Entries = {}       # key -> (bytes, SearchIndex, file name)
+        self.Rendered = 0       # Number of maps rendered by the last call
+
+    def renderMaps(self, lines, index, split_dir=None, compact=False,
+                   open_fragment=None, minify=False, platform=DefaultPlatform,
+                   fingerprint=False):
+        """Same as the module-level renderMaps(), but `lines` has to be an
+        HtmlWriter that has started.
+        """
+        Options = (split_dir, compact, minify, platform, fingerprint)
+        if Options != self.Options:
+            self.Stamp = None
+            self.Entries = {}
+        Stamp = fileStamp(self.XmlFile)
+        self.Rendered = 0
+        if Stamp != self.Stamp:
+            # Parse everything before rendering anything, so that a broken
+            # maps.xml leaves the cache as it was.
+            Keys = []
+            Dirty = {}
+            for MapNode in iterMapNodes(self.XmlFile):
+                Key = hashlib.sha1(Etree.tostring(MapNode, with_tail=False)) \
+                             .digest()
+                Keys.append(Key)
+                if Key not in self.Entries and Key not in Dirty:
+                    Dirty[Key] = MapInfo.fromNode(MapNode)
+
+            Entries = {}
+            for Key in Keys:
+                if Key in Entries:
+                    continue
+                if Key in self.Entries:
+                    Entries[Key] = self.Entries[Key]
+                    continue
+                Map = Dirty[Key]
+                if len(Map.Tiles) <= 0:
+                    Entries[Key] = None
+                    continue
+                Data, MapIndex, FileName, FileData = renderMapData(
+                    Map, split_dir, compact, minify, platform, fingerprint)
+                if FileName is not None:
+                    with open_fragment(FileName) as f:
+                        f.write(FileData)
+                Entries[Key] = (Data, MapIndex, FileName)
+                self.Rendered += 1
+            self.Keys = Keys
+            self.Entries = Entries
+            self.Stamp = Stamp
+            self.Options = Options
+
+        Fragments = []
+        for Key in self.Keys:
+            if self.Entries[Key] is None:
+                continue
+            Data, MapIndex, FileName = self.Entries[Key]
+            index.extend(MapIndex)
+            lines.appendEncoded(Data)
+            if FileName is not None:
+                Fragments.append(FileName)
+        return Fragments
+
+GithubLink = '<a href="https://github.com/MetroWind/hyrule-warriors-maps" ' \
+             'id="GithubLink">'
+MapsDivPattern = re.compile(rb'<div id="maps" data-version="([0-9a-f]*)"[^>]*>')
+MapWrapperPattern = re.compile(rb'<div id="MapWrapper-(.*?)" class="MapWrapper"')
+MapSrcPattern = re.compile(rb' data-src="([^"]*)"')
+SearchIndexScript = '<script id="SearchIndex" type="application/json">'
+SearchIndexPattern = re.compile(
+    rb'<script id="SearchIndex" type="application/json"(?: data-src="([^"]*)")?>')
+LootIndexScript = '<script id="LootIndex" type="application/json">'
+LootIndexPattern = re.compile(
+    rb'<script id="LootIndex" type="application/json"(?: data-src="([^"]*)")?>')
+StylesheetLink = '<link rel="stylesheet" href="{}"/>'
+
+def splitSearchIndex(data):
+    """Split the JSON object of a SearchIndex, with its loot postings as
+    "loot", into a SearchIndex per map, keyed by the map title.
+    """
+    Parts = []
+    for Title in data["maps"]:
+        Part = SearchIndex()
+        Part.Maps.append(Title)
+        Parts.append(Part)
+    Local = []                  # tile index -> index in its map
+    for MapIndex, Coord, Difficulty in data["tiles"]:
+        Local.append(len(Parts[MapIndex].Tiles))
+        Parts[MapIndex].Tiles.append((0, Coord, Difficulty))
+    Tiles = data["tiles"]
+    for Key, Name in (("tokens", "Postings"), ("loot", "Loot")):
+        for Token, Posting in data[Key].items():
+            for TileIndex in Posting:
+                getattr(Parts[Tiles[TileIndex][0]], Name).setdefault(
+                    Token, []).append(Local[TileIndex])
+    return {Part.Maps[0]: Part for Part in Parts}
+
+class PreviousPage(object):
+    """A page written before, to update with a patch from map-diff.py. Its
+    renderMaps() takes the place of the module-level one: the maps that the
+    patch changes are rendered from maps.xml, and the others are copied from
+    the page, with their part of the search index. Raise ValueError if the
+    patch is not from the version of the page to the version of
+    `xml_file`, or if the page was not written with `split_dir`, `compact`,
+    `minify` and `fingerprint`.
+    """
+    def __init__(self, page_file, patch, split_dir=None, compact=False,
+                 minify=False, fingerprint=False, xml_file="maps.xml"):
+        self.PageDir = os.path.dirname(page_file)
+        self.XmlFile = xml_file
+        self.Changes = patch["changes"]
+        self.Rendered = 0
+        with open(page_file, 'rb') as f:
+            self.Page = f.read()
+        Match = MapsDivPattern.search(self.Page)
+        if Match is None or Match.group(1).decode() != patch["base"]:
+            raise ValueError("The patch is not for the version of " + page_file)
+        if fileDigest(xml_file) != patch["result"]:
+            raise ValueError("The patch does not lead to the version of " +
+                             xml_file)
+
+        # The options are told by the start of the page, its <head>, the
+        # <div> of the maps and the first map.
+        Head = self.Page[:Match.start()]
+        Options = minify != self.Page.startswith(b"<!DOCTYPE html>\n") and \
+            compact == (b' class="Compact"' in Match.group(0)) and \
+            fingerprint == (b'<link rel="stylesheet"' in Head)
+        Wrapper = MapWrapperPattern.search(self.Page)
+        if Wrapper is not None:
+            Src = b' data-src="'
+            if split_dir is not None:
+                Src += "{}/".format(split_dir).encode("utf-8")
+            Head = self.Page[Wrapper.end():Wrapper.end() + len(Src)]
+            Options = Options and (Head == Src) == (split_dir is not None)
+        if not Options:
+            raise ValueError(page_file + " was written with other options")
+
+    def sections(self, minify):
+        """Return the encoded part of the page for each map, as
+        renderMapData() returns it, keyed by the map title.
+        """
+        Sep = b"" if minify else b"\n"
+        Starts = [(Match.start() - len(Sep), Match.group(1).decode("utf-8"))
+                  for Match in MapWrapperPattern.finditer(self.Page)]
+        End = self.Page.index(GithubLink.encode("utf-8")) - \
+            len(Sep + b"</div>" + Sep)
+        return {Title: self.Page[Start:Next] for (Start, Title), (Next, _)
+                in zip(Starts, Starts[1:] + [(End, None)])}
+
+    def scriptJson(self, pattern):
+        """Return the JSON of the <script> that `pattern` matches. It is in
+        the page, or in the file it names.
+        """
+        Match = pattern.search(self.Page)
+        if Match.group(1) is not None:
+            with open(os.path.join(self.PageDir,
+                                   Match.group(1).decode("utf-8")), 'rb') as f:
+                return json.load(f)
+        End = self.Page.index(b"</script>", Match.end())
+        return json.loads(self.Page[Match.end():End])
+
+    def searchIndexes(self):
+        """Return the SearchIndex of each map in the page, keyed by the map
+        title.
+        """
+        Data = self.scriptJson(SearchIndexPattern)
+        # Older pages have the loot in the search index.
+        if "loot" not in Data:
+            Data["loot"] = self.scriptJson(LootIndexPattern)
+        return splitSearchIndex(Data)
+
+    def renderMaps(self, lines, index, split_dir=None, compact=False,
+                   open_fragment=None, minify=False, platform=DefaultPlatform,
+                   fingerprint=False):
+        """Same as the module-level renderMaps(), but `lines` has to be an
+        HtmlWriter that has started, and the other arguments have to be the
+        ones given when it was created.
+        """
+        Sections = self.sections(minify)
+        Indexes = self.searchIndexes()
+        Fragments = []
+        self.Rendered = 0
+        for MapNode in iterMapNodes(self.XmlFile):
+            Title = MapNode.get("name")
+            if Title in Sections and Title not in self.Changes:
+                Data = Sections[Title]
+                MapIndex = Indexes[Title]
+                FileName = None
+                if split_dir is not None:
+                    FileName = MapSrcPattern.search(Data).group(1) \
+                                            .decode("utf-8")
+            else:
+                Map = MapInfo.fromNode(MapNode)
+                if len(Map.Tiles) <= 0:
+                    continue
+                Data, MapIndex, FileName, FileData = renderMapData(
+                    Map, split_dir, compact, minify, platform, fingerprint)
+                if FileName is not None:
+                    with open_fragment(FileName) as f:
+                        f.write(FileData)
+                self.Rendered += 1
+            index.extend(MapIndex)
+            lines.appendEncoded(Data)
+            if FileName is not None:
+                Fragments.append(FileName)
+        return Fragments
+
+def renderPage(lines, split_dir=None, compact=False, open_fragment=None,
+               minify=False, render_maps=renderMaps, platform=DefaultPlatform,
+               platform_pages=None, patch_url=None, fingerprint=False):
+    """Append the lines of the page to `lines`, which is an HtmlWriter or
+    anything with the same methods. With `split_dir`, every map goes in its
+    own file under `split_dir`, which logic.js fetches when the map is
+    needed. `open_fragment(path)` is called with the path of each file,
+    relative to the page, and returns a binary stream to write it to. With
+    `compact`, the maps use the compact SVG rendering. With `minify`, CSS,
+    JavaScript and github.svg are minified, and the tile style shared by all
+    tiles is set once in CSS. `lines` should be a minifying HtmlWriter then.
+    `render_maps` appends the maps; see renderMaps(). The page shows the
+    values for `platform`. `platform_pages` is a list of (platform, URL) of
+    the pages of all platforms, to link to from the page. `patch_url` is
+    where logic.js looks for a patch from map-diff.py to update the page
+    with. With `split_dir`, the loot postings of the search index, which
+    only the loot planner uses, go in a file under it too. With
+    `fingerprint`, which needs `split_dir`, the style, the script and the
+    rest of the search index also go in files under `split_dir`, and every
+    file there has the hash of its content in its name. Return the paths of
+    the files under `split_dir`.
+    """
+    Lines = lines
+    Assets = []
+    def asset(name, text):
+        FileName = writeAsset(open_fragment, "{}/{}".format(split_dir, name),
+                              text.encode("utf-8"), fingerprint)
+        Assets.append(FileName)
+        return FileName
+
+    Lines.append("<!DOCTYPE html>")
     Lines.append('<html lang="en">')
     Lines.append('<head>')
     Lines.append('<title>Hyrule Warriors Map</title>')
     Lines.append('<meta charset="utf-8"/>')
-    Lines.append('<style>')
     with open("style.css", 'r') as f:
-        Lines.append(f.read())
-    Lines.append('</style>')
+        Css = f.read()
+    if compact:
+        Css += '\n' + difficultyCss()
+    if minify:
+        Css = minifyCss(Css + '\n' + sharedSvgCss())
+    if fingerprint:
+        Lines.append(StylesheetLink.format(asset("style.css", Css)))
+    else:
+        Lines.append('<style>')
+        Lines.append(Css)
+        Lines.append('</style>')
     Lines.append('</head>')
 
     Lines.append('<body>')
@@ -251,67 +1282,322 @@ def genHtml():
                  '<a href="https://gamefaqs.gamespot.com/3ds/'
                  '167257-hyrule-warriors-legends/faqs/73095/">'
                  'Unlockables Guide</a>.</p>')
+    if platform_pages:
+        Lines.append('<p id="Platforms">{}</p>'.format(" | ".join(
+            ('<strong>{}</strong>' if Platform == platform else
+             '<a href="{1}">{0}</a>').format(PlatformNames[Platform], Url)
+            for Platform, Url in platform_pages)))
+    Lines.append('<p id="SearchBar"><input type="search" id="Search" '
+                 'placeholder="Search missions, loot and treasures" '
+                 'autocomplete="off"/> <span id="SearchStatus"></span></p>')
+    Lines.append('<p id="PlanBar"><input type="search" id="PlanItem" '
+                 'list="LootItems" placeholder="Plan: add loot you need" '
+                 'autocomplete="off"/> <label><input type="checkbox" '
+                 'id="PlanWeighted"/> Easiest tiles</label> '
+                 '<span id="PlanItems"></span> <span id="PlanStatus"></span>'
+                 '</p>')
+    Lines.append('<datalist id="LootItems"></datalist>')
     Lines.append('</header>')
-    Lines.append('<div id="maps">')
-
-    with open("maps.xml", 'rb') as f:
-        Maps = Etree.XML(f.read())
-
-    for MapNode in Maps:
-        Map = MapInfo()
-        Map.Title = MapNode.get("name")
-        for TileNode in MapNode[0]:
-            Tile = TileInfo.fromNode(TileNode)
-            Map.addTile(Tile)
-        if len(Map.Tiles) <= 0:
-            continue
-
-        Svg = Map.genSvg()
-        Lines.append('<div id="MapWrapper-{}" class="MapWrapper">'.format(Map.Title))
-        Lines.append('<h2>{}</h2>'.format(Map.Title + " Map"))
-        Lines.append('<div class="SvgWrapper">')
-        Lines.append(Etree.tostring(Svg, encoding="utf-8", pretty_print=True,
-                                    xml_declaration=False).decode("utf-8"))
-        Lines.append('</div>')
-        Lines.append('<div class="TilesWrapper">')
-        for Coord in Map.Tiles:
-            Tile = Map.Tiles[Coord]
-            Lines.append('<div id="Tile-{}-{}" class="TileWrapper">'.format(
-                Map.Title, Tile.Coord))
-            Lines.append('<h3 class="TileTitle">{}</h3>'.format(Tile.Coord))
-            Lines.append('<table id="TileData-{}-{}">'.format(Map.Title, Tile.Coord))
-            Lines.append('<tbody>')
-            tableRow(Lines, "Mission", Tile.Mission)
-            tableRow(Lines, "Loot", Tile.LootV)
-            tableRow(Lines, "Treasure", Tile.Treasure)
-            tableRow(Lines, "A-rank loot", Tile.LootA)
-            tableRow(Lines, "A-rank KO", Tile.KoA)
-            tableRow(Lines, "A-rank time", Tile.TimeA)
-            tableRow(Lines, "A-rank damage", Tile.DamageA)
-            Lines.append('</tbody>')
-            Lines.append('</table>')
-            Lines.append('</div>')
-
-        Lines.append('</div>')
-        Lines.append('</div>')
+    Attributes = ' data-version="{}" data-platform="{}"'.format(
+        fileDigest("maps.xml"), platform)
+    if compact:
+        Attributes += ' class="Compact"'
+    if patch_url:
+        Attributes += ' data-patch="{}"'.format(patch_url)
+    Lines.append('<div id="maps"{}>'.format(Attributes))
 
+    Index = SearchIndex()
+    Fragments = render_maps(Lines, Index, split_dir, compact, open_fragment,
+                            minify, platform, fingerprint)
     Lines.append('</div>')
-    Lines.append('<a href="https://github.com/MetroWind/hyrule-warriors-maps" id="GithubLink">')
+    # logic.js sizes the button from its bounding box, so it stays inline.
+    Lines.append(GithubLink)
     with open("github.svg", 'r') as f:
-        Lines.append(f.read())
+        Lines.append(minifyMarkup(f.read()) if minify else f.read())
     Lines.append('</a>')
     Lines.append('</div>')
-    Lines.append('<script>')
+    with Profile.section("searchIndexJson"):
+        IndexJson = Index.json()
+        LootJson = Index.lootJson()
+    if fingerprint:
+        Lines.append('{} data-src="{}"></script>'.format(
+            SearchIndexScript[:-1], asset("search-index.json", IndexJson)))
+    else:
+        Lines.append(SearchIndexScript)
+        Lines.append(IndexJson)
+        Lines.append('</script>')
+    # Only the loot planner needs the loot postings, so they stay out of the
+    # page when the maps do.
+    if split_dir is not None:
+        Lines.append('{} data-src="{}"></script>'.format(
+            LootIndexScript[:-1], asset("loot-index.json", LootJson)))
+    else:
+        Lines.append(LootIndexScript)
+        Lines.append(LootJson)
+        Lines.append('</script>')
     with open("logic.js", 'r') as f:
-        Lines.append(f.read())
-    Lines.append('</script>')
+        Js = minifyJs(f.read()) if minify else f.read()
+    if fingerprint:
+        Lines.append('<script src="{}"></script>'.format(asset("logic.js", Js)))
+    else:
+        Lines.append('<script>')
+        Lines.append(Js)
+        Lines.append('</script>')
     Lines.append('</body>')
     Lines.append('</html>')
-    return '\n'.join(Lines)
+    return Fragments + Assets
+
+def writeHtml(out, split_dir=None, compact=False, open_fragment=None,
+              minify=False, render_maps=renderMaps, platform=DefaultPlatform,
+              platform_pages=None, patch_url=None, fingerprint=False):
+    """Write the page to the binary stream `out`. See renderPage()."""
+    Writer = HtmlWriter(out, minify=minify)
+    Fragments = renderPage(Writer, split_dir, compact, open_fragment, minify,
+                           render_maps, platform, platform_pages, patch_url,
+                           fingerprint)
+    Writer.flush()
+    return Fragments
+
+def genHtml(split_dir=None, compact=False, minify=False,
+            platform=DefaultPlatform, fingerprint=False):
+    """Return the page, and a dict of the files under `split_dir`, keyed by
+    their path relative to the page.
+    """
+    Fragments = {}
+
+    @contextlib.contextmanager
+    def openFragment(path):
+        Buffer = io.BytesIO()
+        yield Buffer
+        Fragments[path] = Buffer.getvalue().decode("utf-8")
+
+    Out = io.BytesIO()
+    writeHtml(Out, split_dir, compact, openFragment, minify, renderMaps,
+              platform, fingerprint=fingerprint)
+    return Out.getvalue().decode("utf-8"), Fragments
+
+WatchedFiles = ("maps.xml", "style.css", "logic.js", "github.svg")
+
+def platformFileName(filename, platform):
+    """Return the name of the output file or directory `filename` for
+    `platform`. It is `filename` itself for the default platform, and e.g.
+    maps-3ds.html for the 3DS.
+    """
+    if platform == DefaultPlatform:
+        return filename
+    Root, Ext = os.path.splitext(filename)
+    return "{}-{}{}".format(Root, platform, Ext)
+
+def watch(build, platforms, interval=0.05):
+    """Call build(platform, render_maps) for each platform whenever one of
+    WatchedFiles changes, with the renderMaps() of a MapCache per platform,
+    until interrupted.
+    """
+    Caches = [(Platform, MapCache()) for Platform in platforms]
+    Stamps = None
+    try:
+        while True:
+            NewStamps = [fileStamp(FileName) for FileName in WatchedFiles]
+            if NewStamps != Stamps:
+                Stamps = NewStamps
+                Start = time.perf_counter()
+                # A MapCache is left as it was if maps.xml cannot be
+                # parsed, so it keeps the last good maps.
+                try:
+                    for Platform, Cache in Caches:
+                        build(Platform, Cache.renderMaps)
+                except (OSError, ValueError, KeyError, IndexError, TypeError,
+                        Etree.XMLSyntaxError) as e:
+                    print("Build failed: {}".format(e), flush=True)
+                else:
+                    print("Built in {:.0f} ms, {} maps rendered".format(
+                        (time.perf_counter() - Start) * 1000,
+                        sum(Cache.Rendered for _, Cache in Caches)),
+                          flush=True)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
 
 def main():
-    with open("maps.html", 'wb') as f:
-        f.write(genHtml().encode("utf-8"))
+    Parser = argparse.ArgumentParser(description="Generate the map page from maps.xml.")
+    Parser.add_argument("-o", "--output", default="maps.html",
+                        help="Output file. Default: %(default)s")
+    Parser.add_argument("--split", metavar="DIR",
+                        help="Put each map in its own file under DIR (relative "
+                        "to the output), loaded when it is scrolled into view. "
+                        "The page has to be served over HTTP.")
+    Parser.add_argument("--assets", metavar="DIR",
+                        help="Like --split, but also put the style, the "
+                        "script and the search index in files under DIR, "
+                        "and name every file there by the hash of its "
+                        "content, so that a server can let them be cached "
+                        "for good. The page itself is a small shell. DIR is "
+                        "shared by all the platforms, and files of previous "
+                        "builds are left in it.")
+    Parser.add_argument("--compact", action="store_true",
+                        help="Render each tile as one SVG element, styled by "
+                        "CSS.")
+    Parser.add_argument("--minify", action="store_true",
+                        help="Minify the HTML, SVG, CSS and JavaScript.")
+    Parser.add_argument("--precompress", action="store_true",
+                        help="Also write gzip (and, with the brotli module, "
+                        "brotli) versions of every output file, for a server "
+                        "to send as they are.")
+    Parser.add_argument("--profile", metavar="FILE",
+                        help="Write the time, memory and node counts of each "
+                        "pass on each map to FILE as JSON, and print a "
+                        "summary.")
+    Parser.add_argument("--platform", action="append", choices=Platforms,
+                        help="Show the values for this platform. Repeat to "
+                        "write a page for each platform from one parse of "
+                        "maps.xml. Then the pages for other platforms than "
+                        "{0} get the platform in their names, e.g. "
+                        "maps-3ds.html, and link to each other. "
+                        "Default: {0}".format(
+                            DefaultPlatform))
+    Parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Render the maps in this many processes. Not "
+                        "used with --watch. Default: %(default)s")
+    Parser.add_argument("--watch", action="store_true",
+                        help="Keep running, and rebuild the output whenever "
+                        "one of {} changes. Only new or changed maps are "
+                        "rendered again.".format(", ".join(WatchedFiles)))
+    Parser.add_argument("--interval", type=float, default=0.05,
+                        help="How often to check the files in watch mode, in "
+                        "seconds. Default: %(default)s")
+    Parser.add_argument("--patch", metavar="FILE",
+                        help="Update the previous output with FILE, a patch "
+                        "from map-diff.py to the current maps.xml: only the "
+                        "maps it changes are rendered, and the others are "
+                        "copied from the output. Give the same options as "
+                        "for the previous output. FILE is then copied next "
+                        "to the output, where logic.js looks for it to "
+                        "update pages that are already open.")
+    Args = Parser.parse_args()
+    if Args.watch and Args.precompress:
+        Parser.error("--precompress cannot be used with --watch")
+    if Args.watch and Args.patch:
+        Parser.error("--patch cannot be used with --watch")
+    if Args.split and Args.assets:
+        Parser.error("--split cannot be used with --assets")
+    if Args.profile:
+        Profile.enable()
+    SelectedPlatforms = []
+    for Platform in Args.platform or [DefaultPlatform,]:
+        if Platform not in SelectedPlatforms:
+            SelectedPlatforms.append(Platform)
+    PlatformPages = None
+    if len(SelectedPlatforms) > 1:
+        PlatformPages = [(Platform, os.path.basename(
+            platformFileName(Args.output, Platform)))
+                         for Platform in SelectedPlatforms]
+
+    OutputDir = os.path.dirname(Args.output)
+    # The patch is the same for all the platforms. Every page looks for one,
+    # so that a page from a full build can be updated by the next --patch.
+    PatchUrl = os.path.splitext(os.path.basename(Args.output))[0] + \
+        ".patch.json"
+
+    @contextlib.contextmanager
+    def openFragment(path):
+        Path = os.path.join(OutputDir, path)
+        os.makedirs(os.path.dirname(Path), exist_ok=True)
+        with open(Path + ".tmp", 'wb') as f:
+            yield f
+        os.replace(Path + ".tmp", Path)
+
+    def outputNames(platform):
+        """Return the file name of the page for `platform`, and the
+        directory of its map files.
+        """
+        Output = platformFileName(Args.output, platform) if PlatformPages \
+            else Args.output
+        if Args.assets:
+            # The names of the files are unique to their content.
+            return Output, Args.assets
+        if PlatformPages:
+            return Output, Args.split and platformFileName(Args.split, platform)
+        return Output, Args.split
+
+    def build(platform, render_maps=renderMaps):
+        """Write the page for `platform`. Return its file name and the
+        paths of its map files.
+        """
+        Output, SplitDir = outputNames(platform)
+        Temp = Output + ".tmp"
+        with open(Temp, 'wb') as f:
+            Fragments = writeHtml(f, SplitDir, Args.compact, openFragment,
+                                  Args.minify, render_maps, platform,
+                                  PlatformPages, PatchUrl, bool(Args.assets))
+        os.replace(Temp, Output)
+        return Output, Fragments
+
+    if Args.watch:
+        watch(build, SelectedPlatforms, Args.interval)
+        if Args.profile:
+            Profile.save(Args.profile)
+            Profile.printSummary()
+        return
+
+    if Args.patch:
+        with open(Args.patch, 'rb') as f:
+            Patch = json.load(f)
+        Pages = {}
+        try:
+            for Platform in SelectedPlatforms:
+                Output, SplitDir = outputNames(Platform)
+                Pages[Platform] = PreviousPage(Output, Patch, SplitDir,
+                                               Args.compact, Args.minify,
+                                               bool(Args.assets))
+        except (OSError, ValueError) as e:
+            Parser.error("Cannot apply {}: {}".format(Args.patch, e))
+        Outputs = [build(Platform, Pages[Platform].renderMaps)
+                   for Platform in SelectedPlatforms]
+        print("{} maps rendered".format(
+            sum(Page.Rendered for Page in Pages.values())))
+        PatchFile = os.path.join(OutputDir, PatchUrl)
+        if not (os.path.exists(PatchFile) and
+                os.path.samefile(Args.patch, PatchFile)):
+            shutil.copyfile(Args.patch, PatchFile + ".tmp")
+            os.replace(PatchFile + ".tmp", PatchFile)
+    else:
+        with contextlib.ExitStack() as Stack:
+            Pool = None
+            if Args.jobs > 1:
+                Pool = Stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(Args.jobs))
+            # The maps are parsed once and kept in memory for all the
+            # platforms.
+            Maps = None
+            if len(SelectedPlatforms) > 1:
+                Maps = list(Profile.iterate("loadMap", loadMaps("maps.xml"),
+                                            lambda Map: Map.Title))
+            RenderMaps = lambda *args: renderMaps(*args, maps=Maps, pool=Pool)
+            Outputs = [build(Platform, RenderMaps)
+                       for Platform in SelectedPlatforms]
+    for Output, Fragments in Outputs:
+        print("{}: initial payload: {} bytes".format(
+            Output, os.path.getsize(Output)))
+        if Fragments:
+            print("Loaded separately: {} bytes in {} files".format(
+                sum(os.path.getsize(os.path.join(OutputDir, FileName))
+                    for FileName in Fragments), len(Fragments)))
+
+    if Args.precompress:
+        if brotli is None:
+            print("No brotli module; only writing .gz files.")
+        print("{:<40} {:>10} {:>10} {:>10}".format("File", "Size", ".gz", ".br"))
+        for Output, Fragments in Outputs:
+            for FileName in [Output,] + [os.path.join(OutputDir, Fragment)
+                                         for Fragment in Fragments]:
+                Sizes = compressFile(FileName)
+                print("{:<40} {:>10} {:>10} {:>10}".format(
+                    FileName, os.path.getsize(FileName), Sizes[".gz"],
+                    Sizes.get(".br", "-")))
+
+    if Args.profile:
+        Profile.save(Args.profile)
+        Profile.printSummary()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8; -*-
+
+# Per-pass instrumentation for grab.py and map-gen.py. A disabled Profiler
+# hands out one shared do-nothing section, so the passes can stay
+# instrumented all the time.
+
+import sys
+import time
+import json
+import tracemalloc
+
+class NullSectionType(object):
+    """Section of a disabled Profiler. It is shared by all the passes, so it
+    does not keep the trees it is given: they would stay alive until the next
+    pass.
+    """
+    __slots__ = ()
+
+    @property
+    def tree(self):
+        return None
+
+    @tree.setter
+    def tree(self, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NullSection = NullSectionType()
+
+def countNodes(tree):
+    return sum(1 for _ in tree.iter())
+
+class Section(object):
+    """Measures one run of a pass. Set `tree` to count the nodes of the tree
+    after the pass; if it is given at the start, the nodes are also counted
+    before. Without `memory`, allocations are not measured, which is needed
+    for sections that run in parallel threads.
+    """
+    def __init__(self, profiler, name, item, tree, memory=True):
+        self.Profiler = profiler
+        self.Name = name
+        self.Item = item
+        self.tree = tree
+        self.TraceMemory = memory and tracemalloc.is_tracing()
+
+    def __enter__(self):
+        self.NodesBefore = None if self.tree is None else countNodes(self.tree)
+        if self.TraceMemory:
+            tracemalloc.reset_peak()
+            self.Memory = tracemalloc.get_traced_memory()[0]
+        self.Cpu = time.thread_time()
+        self.Wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        Wall = time.perf_counter() - self.Wall
+        Cpu = time.thread_time() - self.Cpu
+        Peak = None
+        if self.TraceMemory:
+            Peak = tracemalloc.get_traced_memory()[1] - self.Memory
+        self.Profiler.Records.append({
+            "pass": self.Name, "item": self.Item, "wall": Wall, "cpu": Cpu,
+            "peak": Peak, "nodes_before": self.NodesBefore,
+            "nodes_after": None if self.tree is None else countNodes(self.tree)})
+        return False
+
+class Profiler(object):
+    """Records wall time, CPU time of the calling thread, peak of Python
+    allocations and node counts of each pass on each item (chapter or map).
+    Sections should not be nested, because each one resets the allocation
+    peak.
+    """
+    def __init__(self):
+        self.Enabled = False
+        self.Records = []
+
+    def enable(self, memory=True):
+        self.Enabled = True
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def section(self, name, item=None, tree=None, memory=True):
+        if not self.Enabled:
+            return NullSection
+        return Section(self, name, item, tree, memory)
+
+    def iterate(self, name, iterable, item=str):
+        """Yield from `iterable`, recording each step as a run of pass
+        `name`. `item` gives the item name from a yielded value.
+        """
+        if not self.Enabled:
+            return iterable
+        return self._iterate(name, iter(iterable), item)
+
+    def _iterate(self, name, iterator, item):
+        while True:
+            Sec = Section(self, name, None, None)
+            with Sec:
+                try:
+                    Value = next(iterator)
+                except StopIteration:
+                    Sec.Item = "(end)"
+                    return
+                Sec.Item = item(Value)
+            yield Value
+
+    def summary(self):
+        """Totals per pass, in the order the passes first ran."""
+        Passes = {}
+        for Record in self.Records:
+            Total = Passes.setdefault(Record["pass"], {
+                "runs": 0, "wall": 0.0, "cpu": 0.0, "peak": None,
+                "nodes_after": None})
+            Total["runs"] += 1
+            Total["wall"] += Record["wall"]
+            Total["cpu"] += Record["cpu"]
+            if Record["peak"] is not None:
+                Total["peak"] = max(Total["peak"] or 0, Record["peak"])
+            if Record["nodes_after"] is not None:
+                Total["nodes_after"] = (Total["nodes_after"] or 0) + \
+                    Record["nodes_after"]
+        return Passes
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({"passes": self.summary(), "records": self.Records}, f,
+                      indent=2)
+
+    def printSummary(self, file=sys.stderr):
+        print("{:<24} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+            "Pass", "Runs", "Wall (s)", "CPU (s)", "Peak (MB)", "Nodes"),
+              file=file)
+        for Name, Total in self.summary().items():
+            print("{:<24} {:>6} {:>10.4f} {:>10.4f} {:>10} {:>10}".format(
+                Name, Total["runs"], Total["wall"], Total["cpu"],
+                "-" if Total["peak"] is None
+                else "{:.2f}".format(Total["peak"] / 2 ** 20),
+                "-" if Total["nodes_after"] is None else Total["nodes_after"]),
+                  file=file)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; -*-
+
+# Query the tiles in maps.xml through an indexed SQLite database, which is
+# rebuilt whenever it was made from another file or version. The tiles are
+# read by map-gen, so the database holds the same values as the page.
+
+import sys, os
+import re
+import time
+import argparse
+import sqlite3
+import importlib
+
+mapgen = importlib.import_module("map-gen")
+
+DatabaseFileName = "maps.sqlite"
+
+Schema = """
+-- The map data the database was made from: see mapgen.sourceStamp().
+CREATE TABLE source (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha1 TEXT NOT NULL
+);
+CREATE TABLE maps (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE tiles (
+    id INTEGER PRIMARY KEY,
+    map_id INTEGER NOT NULL REFERENCES maps(id),
+    coordinate TEXT NOT NULL,
+    difficulty INTEGER
+);
+-- One row per value of a tile field. `platform` is NULL when the value is
+-- the same on every platform, and `seq` orders the items of a list.
+CREATE TABLE tile_values (
+    tile_id INTEGER NOT NULL REFERENCES tiles(id),
+    field TEXT NOT NULL,
+    platform TEXT,
+    seq INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    number INTEGER
+);
+CREATE VIEW loot AS
+    SELECT tile_id, field AS kind, platform, value AS name FROM tile_values
+    WHERE field IN ('loot-a', 'loot-v', 'treasure');
+"""
+
+Indexes = """
+CREATE INDEX tiles_map ON tiles(map_id);
+CREATE INDEX tiles_difficulty ON tiles(difficulty);
+CREATE INDEX values_tile ON tile_values(tile_id);
+CREATE INDEX values_value ON tile_values(value COLLATE NOCASE);
+CREATE INDEX values_number ON tile_values(field, number);
+"""
+
+LootFields = ("loot-a", "loot-v", "treasure")
+
+def numberValue(value):
+    if type(value) is int:
+        return value
+    Digits = value.replace(",", "")
+    if Digits.isdigit():
+        return int(Digits)
+    return None
+
+def fieldValues(value, platform=None, seq=0):
+    """Yield (platform, seq, value) for a field of a TileInfo, with every
+    platform of its PlatformValues. Empty values are left out.
+    """
+    if value is None:
+        return
+    if type(value) is mapgen.PlatformValues:
+        for Platform, Value in value.items():
+            yield from fieldValues(Value, Platform, seq)
+    elif type(value) is list:
+        for Seq, Item in enumerate(value):
+            yield from fieldValues(Item, platform, Seq)
+    elif value != "":
+        yield (platform, seq, value)
+
+def buildIndex(xml_file, db_file):
+    """Write the tiles of `xml_file` into a new database at `db_file`. The
+    file is replaced atomically.
+    """
+    Temp = db_file + ".tmp"
+    if os.path.exists(Temp):
+        os.remove(Temp)
+    Db = sqlite3.connect(Temp)
+    Db.executescript(Schema)
+    Db.execute("INSERT INTO source (path, size, sha1) VALUES (?, ?, ?)",
+               mapgen.sourceStamp(xml_file))
+    for Map in mapgen.loadMaps(xml_file):
+        MapId = Db.execute("INSERT INTO maps (name) VALUES (?)",
+                           (Map.Title,)).lastrowid
+        for Tile in Map.Tiles.values():
+            Values = []
+            for Name, Field in mapgen.TileInfo.JsonKeys:
+                if Field == "difficulty":
+                    continue
+                for Platform, Seq, Value in fieldValues(getattr(Tile, Name)):
+                    Values.append((Field, Platform, Seq, str(Value),
+                                   numberValue(Value)))
+            TileId = Db.execute(
+                "INSERT INTO tiles (map_id, coordinate, difficulty) "
+                "VALUES (?, ?, ?)",
+                (MapId, Tile.Coord, Tile.Difficulty)).lastrowid
+            Db.executemany(
+                "INSERT INTO tile_values (tile_id, field, platform, seq, value, "
+                "number) VALUES ({}, ?, ?, ?, ?, ?)".format(TileId), Values)
+    Db.executescript(Indexes)
+    Db.execute("ANALYZE")
+    Db.commit()
+    Db.close()
+    os.replace(Temp, db_file)
+
+def indexSource(db_file):
+    """Return the sourceStamp() of the map data `db_file` was made from, or
+    None if it is missing or is not an index database of this version.
+    """
+    if not os.path.exists(db_file):
+        return None
+    Db = sqlite3.connect(db_file)
+    try:
+        return Db.execute("SELECT path, size, sha1 FROM source").fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        Db.close()
+
+def openIndex(xml_file, db_file, rebuild=False):
+    """Connect to the database, building it first if it is missing or was
+    made from another file than `xml_file`, or another version of it.
+    """
+    if rebuild or indexSource(db_file) != mapgen.sourceStamp(xml_file):
+        buildIndex(xml_file, db_file)
+    return sqlite3.connect(db_file)
+
+Comparison = re.compile(r"^\s*(<=|>=|<|>|=)?\s*(-?\d+)\s*$")
+
+def comparison(text):
+    """Parse ">1500", "<=200" or "1500" into (operator, number)."""
+    Match = Comparison.match(text)
+    if Match is None:
+        raise argparse.ArgumentTypeError("Not a comparison: " + text)
+    return (Match.group(1) or "=", int(Match.group(2)))
+
+def queryTiles(db, map_name=None, difficulty=None, loot=None, loot_like=None,
+               platform=None, ko=None, damage=None):
+    """Return (map, coordinate, difficulty, mission) of the matching tiles.
+    `loot` is a case-insensitive item name, `loot_like` a substring of it.
+    `ko` and `damage` are (operator, number) pairs. Platform-specific values
+    only match if they are for `platform`, unless it is None.
+    """
+    Conditions = []
+    Params = []
+
+    def valueExists(condition, params):
+        Sql = "t.id IN (SELECT v.tile_id FROM tile_values AS v WHERE " + \
+              condition
+        if platform is not None:
+            Sql += " AND (v.platform IS NULL OR v.platform = ?)"
+            params = params + [platform]
+        Conditions.append(Sql + ")")
+        Params.extend(params)
+
+    if map_name is not None:
+        Conditions.append("m.name = ? COLLATE NOCASE")
+        Params.append(map_name)
+    if difficulty is not None:
+        Conditions.append("t.difficulty = ?")
+        Params.append(difficulty)
+    InLoot = "v.field IN ({})".format(", ".join("?" * len(LootFields)))
+    if loot is not None:
+        valueExists(InLoot + " AND v.value = ? COLLATE NOCASE",
+                    list(LootFields) + [loot])
+    if loot_like is not None:
+        valueExists(InLoot + " AND v.value LIKE ?",
+                    list(LootFields) + ["%" + loot_like + "%"])
+    for Field, Cmp in (("ko-a", ko), ("damage-a", damage)):
+        if Cmp is not None:
+            valueExists("v.field = ? AND v.number {} ?".format(Cmp[0]),
+                        [Field, Cmp[1]])
+
+    Sql = "SELECT m.name, t.coordinate, t.difficulty, " \
+          "(SELECT group_concat(value, '; ') FROM tile_values " \
+          "WHERE tile_id = t.id AND field = 'mission') " \
+          "FROM tiles AS t JOIN maps AS m ON m.id = t.map_id"
+    if Conditions:
+        Sql += " WHERE " + " AND ".join(Conditions)
+    Sql += " ORDER BY m.id, t.id"
+    return db.execute(Sql, Params).fetchall()
+
+def main():
+    Parser = argparse.ArgumentParser(
+        description="Find tiles in maps.xml. All the given filters must match.")
+    Parser.add_argument("--xml", default="maps.xml",
+                        help="Map data. Default: %(default)s")
+    Parser.add_argument("--db", default=DatabaseFileName,
+                        help="Index database, rebuilt when it was made from "
+                        "other map data. Default: %(default)s")
+    Parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild the index database.")
+    Parser.add_argument("--map", help="Map name.")
+    Parser.add_argument("--difficulty", type=int, help="Difficulty (0 to 6).")
+    Parser.add_argument("--loot", help="Exact name of a loot or treasure "
+                        "item. Case-insensitive.")
+    Parser.add_argument("--loot-like", help="Part of the name of a loot or "
+                        "treasure item.")
+    Parser.add_argument("--platform", choices=("3ds", "switch"),
+                        help="Ignore values specific to the other platform.")
+    Parser.add_argument("--ko", type=comparison,
+                        help='A-rank KO count, e.g. ">1500".')
+    Parser.add_argument("--damage", type=comparison,
+                        help='A-rank damage, e.g. "<=200".')
+    Args = Parser.parse_args()
+
+    Db = openIndex(Args.xml, Args.db, Args.rebuild)
+    Start = time.perf_counter()
+    Rows = queryTiles(Db, Args.map, Args.difficulty, Args.loot, Args.loot_like,
+                      Args.platform, Args.ko, Args.damage)
+    Time = time.perf_counter() - Start
+    Db.close()
+
+    for Map, Coord, Difficulty, Mission in Rows:
+        print("{}\t{}\t{}\t{}".format(Map, Coord, Difficulty, Mission or ""))
+    print("{} tiles in {:.1f} ms".format(len(Rows), Time * 1000),
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
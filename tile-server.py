@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; -*-
+
+# Serve the tiles in maps.xml as JSON over HTTP, from indexes kept in
+# memory. The data is reloaded when maps.xml changes.
+
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import importlib
+import functools
+import urllib.parse
+import email.utils
+
+mapgen = importlib.import_module("map-gen")
+
+LootFields = ("LootV", "Treasure", "LootA")
+# Request bodies are not used. Longer ones are not read, and the connection
+# is closed after the response instead.
+MaxDiscardedBody = 1 << 16
+
+Reasons = {200: "OK", 304: "Not Modified", 400: "Bad Request",
+           404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error"}
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.Status = status
+
+def valueStrings(value):
+    """Yield the strings in a tile field value, for every platform."""
+    if value is None:
+        return
+    if isinstance(value, dict):
+        for Item in value.values():
+            yield from valueStrings(Item)
+    elif isinstance(value, list):
+        for Item in value:
+            yield from valueStrings(Item)
+    else:
+        yield str(value)
+
+class TileIndex(object):
+    """The maps, with the tiles indexed by map, coordinate, loot item
+    (case-insensitive, of any platform) and difficulty. The tiles keep the
+    values of all platforms and are resolved when a response is made.
+    """
+    def __init__(self, maps):
+        self.Maps = {}          # name -> MapInfo
+        self.Loot = {}          # lowercase item -> [(map, tile)]
+        self.LootNames = {}     # lowercase item -> item
+        self.Difficulty = {}    # difficulty -> [(map, tile)]
+        for Map in maps:
+            if len(Map.Tiles) <= 0:
+                continue
+            self.Maps[Map.Title] = Map
+            for Tile in Map.Tiles.values():
+                self.Difficulty.setdefault(Tile.Difficulty, []).append(
+                    (Map, Tile))
+                Items = set()
+                for Field in LootFields:
+                    Items.update(valueStrings(getattr(Tile, Field)))
+                for Item in Items:
+                    Key = Item.lower()
+                    self.LootNames.setdefault(Key, Item)
+                    self.Loot.setdefault(Key, []).append((Map, Tile))
+
+    @staticmethod
+    def tileJson(map_info, tile, platform):
+        Tile = tile.forPlatform(platform)
+        Result = {"map": map_info.Title, "coordinate": Tile.Coord,
+                  "difficulty": Tile.Difficulty}
+        Result.update(Tile.json())
+        return Result
+
+    def mapInfo(self, name):
+        if name not in self.Maps:
+            raise RequestError(404, "No map " + name)
+        return self.Maps[name]
+
+    def query(self, path, params):
+        """Return the JSON-able result for a GET of `path`, with the query
+        parameters `params` (a dict of str). Raise RequestError if there is
+        none.
+        """
+        Platform = params.get("platform", mapgen.DefaultPlatform)
+        if Platform not in mapgen.Platforms:
+            raise RequestError(400, "Unknown platform " + Platform)
+        Parts = [urllib.parse.unquote(Part) for Part in
+                 path.strip("/").split("/")]
+
+        if Parts == ["maps"]:
+            return [{"name": Map.Title, "cols": Map.Cols, "rows": Map.Rows,
+                     "tiles": len(Map.Tiles)} for Map in self.Maps.values()]
+        if len(Parts) == 2 and Parts[0] == "maps":
+            Map = self.mapInfo(Parts[1])
+            return {"name": Map.Title, "cols": Map.Cols, "rows": Map.Rows,
+                    "tiles": [self.tileJson(Map, Tile, Platform)
+                              for Tile in Map.Tiles.values()]}
+        if len(Parts) == 3 and Parts[0] == "maps":
+            Map = self.mapInfo(Parts[1])
+            if Parts[2] not in Map.Tiles:
+                raise RequestError(404, "No tile {} in map {}".format(
+                    Parts[2], Map.Title))
+            return self.tileJson(Map, Map.Tiles[Parts[2]], Platform)
+        if Parts == ["loot"]:
+            return sorted(({"name": self.LootNames[Key], "tiles": len(Tiles)}
+                           for Key, Tiles in self.Loot.items()),
+                          key=lambda Item: Item["name"].lower())
+        if Parts == ["tiles"]:
+            return self.searchTiles(params, Platform)
+        raise RequestError(404, "No resource " + path)
+
+    def searchTiles(self, params, platform):
+        """Tiles matching all of the parameters "map", "difficulty" and
+        "loot", in the order of maps.xml. A loot item has to be in the tile
+        on `platform`.
+        """
+        Candidates = []
+        if "map" in params:
+            Map = self.mapInfo(params["map"])
+            Candidates.append([(Map, Tile) for Tile in Map.Tiles.values()])
+        if "difficulty" in params:
+            try:
+                Difficulty = int(params["difficulty"])
+            except ValueError:
+                raise RequestError(400, "Bad difficulty " + params["difficulty"])
+            Candidates.append(self.Difficulty.get(Difficulty, []))
+        Loot = params.get("loot")
+        if Loot is not None:
+            Candidates.append(self.Loot.get(Loot.lower(), []))
+        if not Candidates:
+            raise RequestError(400, "No filter given")
+
+        # Every list is in the order of maps.xml. Go through the shortest
+        # one, and look the tiles up in the others by identity.
+        Candidates.sort(key=len)
+        Others = [set(id(Tile) for _, Tile in Pairs) for Pairs in Candidates[1:]]
+        Result = []
+        for Map, Tile in Candidates[0]:
+            if not all(id(Tile) in Ids for Ids in Others):
+                continue
+            Json = self.tileJson(Map, Tile, platform)
+            if Loot is not None:
+                Items = set(Item.lower() for Field in ("loot-v", "treasure",
+                                                       "loot-a")
+                            for Item in valueStrings(Json[Field]))
+                if Loot.lower() not in Items:
+                    continue
+            Result.append(Json)
+        return {"tiles": Result}
+
+    def respond(self, target):
+        """Return (status, body, ETag) for a GET of `target`, a path with an
+        optional query string.
+        """
+        Url = urllib.parse.urlsplit(target)
+        Params = dict(urllib.parse.parse_qsl(Url.query))
+        try:
+            Body = json.dumps(self.query(Url.path, Params), ensure_ascii=False,
+                              separators=(',', ':')).encode("utf-8")
+            Status = 200
+        except RequestError as e:
+            Body = json.dumps({"error": str(e)}).encode("utf-8")
+            Status = e.Status
+        return Status, Body, '"{}"'.format(hashlib.sha1(Body).hexdigest()[:20])
+
+class TileServer(object):
+    """Serves a TileIndex of `xml_file` over HTTP/1.1 with keep-alive.
+    Responses are kept in an LRU cache of `cache_size` entries, which is
+    dropped with the index when `xml_file` changes.
+    """
+    def __init__(self, xml_file="maps.xml", cache_size=1024, interval=1.0):
+        self.XmlFile = xml_file
+        self.CacheSize = cache_size
+        self.Interval = interval
+        self.Stamp = None
+        self.respond = None
+
+    def load(self):
+        """Load the maps if the file changed. Return whether it did."""
+        Stamp = mapgen.fileStamp(self.XmlFile)
+        if Stamp == self.Stamp:
+            return False
+        Index = TileIndex(mapgen.loadMaps(self.XmlFile))
+        self.respond = functools.lru_cache(self.CacheSize)(Index.respond)
+        self.Stamp = Stamp
+        return True
+
+    async def watch(self):
+        Loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.Interval)
+            try:
+                if await Loop.run_in_executor(None, self.load):
+                    print("Reloaded " + self.XmlFile, flush=True)
+            except Exception as e:
+                print("Reloading failed: {}".format(e), flush=True)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                Line = await reader.readline()
+                if not Line:
+                    break
+                try:
+                    Method, Target, Version = Line.decode("latin-1").split()
+                except ValueError:
+                    break
+                Headers = {}
+                while True:
+                    HeaderLine = await reader.readline()
+                    if HeaderLine in (b"\r\n", b"\n", b""):
+                        break
+                    Name, _, Value = HeaderLine.decode("latin-1").partition(":")
+                    Headers[Name.strip().lower()] = Value.strip()
+
+                KeepAlive = Headers.get("connection", "").lower() != "close" \
+                    if Version == "HTTP/1.1" else \
+                    Headers.get("connection", "").lower() == "keep-alive"
+                # Skip the body, if any, to get to the next request.
+                Length = Headers.get("content-length", "0")
+                if "transfer-encoding" in Headers or not Length.isdigit() or \
+                   int(Length) > MaxDiscardedBody:
+                    KeepAlive = False
+                else:
+                    await reader.readexactly(int(Length))
+                if Method in ("GET", "HEAD"):
+                    try:
+                        Status, Body, ETag = self.respond(Target)
+                    except Exception as e:
+                        # Not cached: lru_cache does not keep exceptions.
+                        print("Error on {}: {!r}".format(Target, e), flush=True)
+                        Status, Body, ETag = \
+                            500, b'{"error":"Internal error"}', None
+                    if Status == 200 and \
+                       Headers.get("if-none-match") == ETag:
+                        Status, Body = 304, b""
+                else:
+                    Status, Body, ETag = 405, b'{"error":"Only GET"}', None
+
+                Head = ["HTTP/1.1 {} {}".format(Status, Reasons[Status]),
+                        "Content-Type: application/json; charset=utf-8",
+                        "Content-Length: {}".format(len(Body)),
+                        "Date: " + email.utils.formatdate(usegmt=True),
+                        "Cache-Control: no-cache"]
+                if Status in (200, 304):
+                    Head.append("ETag: " + ETag)
+                if not KeepAlive:
+                    Head.append("Connection: close")
+                writer.write(("\r\n".join(Head) + "\r\n\r\n").encode("latin-1"))
+                if Method != "HEAD":
+                    writer.write(Body)
+                await writer.drain()
+                if not KeepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        self.load()
+        Server = await asyncio.start_server(self.handle, host, port)
+        Watcher = asyncio.create_task(self.watch())
+        print("Serving {} on http://{}:{}/".format(self.XmlFile, host, port),
+              flush=True)
+        try:
+            async with Server:
+                await Server.serve_forever()
+        finally:
+            Watcher.cancel()
+
+def main():
+    Parser = argparse.ArgumentParser(
+        description="Serve the tiles in maps.xml as JSON. Endpoints: /maps, "
+        "/maps/NAME, /maps/NAME/COORDINATE, /loot, and "
+        "/tiles?map=&difficulty=&loot= (at least one filter). All of them "
+        "take ?platform=switch|3ds.")
+    Parser.add_argument("--xml", default="maps.xml",
+                        help="Map data. Default: %(default)s")
+    Parser.add_argument("--host", default="127.0.0.1",
+                        help="Address to listen on. Default: %(default)s")
+    Parser.add_argument("--port", type=int, default=8000,
+                        help="Port to listen on. Default: %(default)s")
+    Parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Number of responses to cache. Default: "
+                        "%(default)s")
+    Parser.add_argument("--interval", type=float, default=1.0,
+                        help="How often to check maps.xml for changes, in "
+                        "seconds. Default: %(default)s")
+    Args = Parser.parse_args()
+
+    Server = TileServer(Args.xml, Args.cache_size, Args.interval)
+    try:
+        asyncio.run(Server.serve(Args.host, Args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())